@@ -0,0 +1,261 @@
+"""Adaptive sentence bucketing for batch inference.
+
+``sentences_bucket_max_size`` used to be a static slider whose safe value
+depends on the GPU, the text and the sampling parameters. In adaptive mode the
+buckets of a request are planned from its sentence length distribution (similar
+lengths together, so little padding is decoded) and from the free memory the
+worker reads right before running them. A persisted ``BucketProfile`` of past
+runs — time and peak memory per (bucket size, padded tokens) — supplies the
+memory cost per token of each such bin and the bucket size with the best
+throughput. A bucket that still runs out of memory is split in half and
+retried. The OOM only bounds the cost of its own bin, and only until later runs
+of that bin succeed: the free memory read before a batch is a guess (other
+workers, fragmentation), and a single bad guess must not shrink every later
+bucket.
+"""
+import json
+import os
+import threading
+import time
+
+import torch
+
+import infer_stages
+
+DEFAULT_BUCKET_SIZE = 4
+MAX_BUCKET_SIZE = 16
+MIN_FILL = 0.7  # real / padded text tokens below which a bucket is closed
+MEMORY_HEADROOM = 0.8
+DEFAULT_MB_PER_UNIT = 0.2  # GPT KV cache per (row * beam * token), fp32, before anything is measured
+TOKEN_BIN = 64
+OOM_HISTORY = 4  # out-of-memory bounds kept per bin; each successful run of the bin retires the oldest
+
+
+def batch_cost(rows, longest, gen_kwargs):
+    """Memory units of one batch: ``rows * num_beams * (longest text + max_mel_tokens)``.
+
+    This tracks the size of the GPT key/value cache the batch needs.
+    """
+    num_beams = int(gen_kwargs.get("num_beams", infer_stages.GENERATION_DEFAULTS["num_beams"]))
+    max_mel_tokens = int(gen_kwargs.get("max_mel_tokens", infer_stages.GENERATION_DEFAULTS["max_mel_tokens"]))
+    return rows * num_beams * (longest + max_mel_tokens)
+
+
+def is_oom(e):
+    return isinstance(e, torch.cuda.OutOfMemoryError) or "out of memory" in str(e).lower() \
+        or "can't allocate memory" in str(e)
+
+
+def free_memory_mb(device):
+    """Free memory of the worker's device: CUDA free memory, or available system RAM."""
+    if torch.device(device).type == "cuda":
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        # blocks cached by the allocator are free for this process too
+        free += torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+        return free / 2 ** 20
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def bin_key(bucket_size, tokens):
+    """Profile bin of a batch: its row count and padded text tokens, rounded down to ``TOKEN_BIN``."""
+    return f"{bucket_size}:{tokens // TOKEN_BIN * TOKEN_BIN}"
+
+
+def plan_buckets(lengths, gen_kwargs, cap, budget_mb, unit_mb):
+    """Bucket sentence indices by length, within ``cap`` rows and ``budget_mb`` of memory.
+
+    ``unit_mb(rows, padded_tokens)`` is the memory per ``batch_cost`` unit of such a batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets = []
+    bucket = []
+    total = 0
+    for i in order:
+        # ascending order: the candidate is the longest row of the bucket
+        rows, longest = len(bucket) + 1, lengths[i]
+        fill = (total + longest) / (rows * longest) if longest else 1.0
+        over_budget = batch_cost(rows, longest, gen_kwargs) * unit_mb(rows, rows * longest) > budget_mb
+        if bucket and (rows > cap or fill < MIN_FILL or over_budget):
+            buckets.append(bucket)
+            bucket, total = [], 0
+        bucket.append(i)
+        total += longest
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+def _run_bucket(tts, cond_mel, token_id_lists, seed, gen_kwargs, observations):
+    """Synthesize one bucket, halving it on out-of-memory errors."""
+    cuda = torch.device(tts.device).type == "cuda"
+    longest = max(len(ids) for ids in token_id_lists)
+    observation = {
+        "bucket_size": len(token_id_lists),
+        "tokens": len(token_id_lists) * longest,
+        "cost": batch_cost(len(token_id_lists), longest, gen_kwargs),
+        "free_mb": round(free_memory_mb(tts.device), 1),
+    }
+    if cuda:
+        torch.cuda.reset_peak_memory_stats(tts.device)
+        base = torch.cuda.memory_allocated(tts.device)
+    start = time.perf_counter()
+    try:
+        wavs = infer_stages.synthesize_batch(tts, cond_mel, token_id_lists, seed=seed, **gen_kwargs)
+    except RuntimeError as e:
+        if not is_oom(e):
+            raise
+        observations.append({**observation, "oom": True})
+        if cuda:
+            torch.cuda.empty_cache()
+        if len(token_id_lists) == 1:
+            raise
+        half = len(token_id_lists) // 2
+        print(f"⚠️ 显存不足，分桶 {len(token_id_lists)} 拆分为 {half} + {len(token_id_lists) - half} 后重试")
+        return (_run_bucket(tts, cond_mel, token_id_lists[:half], seed, gen_kwargs, observations)
+                + _run_bucket(tts, cond_mel, token_id_lists[half:], seed, gen_kwargs, observations))
+    observation["seconds"] = round(time.perf_counter() - start, 4)
+    observation["peak_mb"] = round((torch.cuda.max_memory_allocated(tts.device) - base) / 2 ** 20, 1) if cuda else None
+    observations.append(observation)
+    return wavs
+
+
+def adaptive_wavs(tts, cond_mel, token_id_lists, bucket_cap=DEFAULT_BUCKET_SIZE, mb_per_unit=DEFAULT_MB_PER_UNIT,
+                  bin_mb_per_unit=None, seed=None, **generation_kwargs):
+    """Plan buckets against this worker's free memory and synthesize them.
+
+    ``bin_mb_per_unit`` maps profile bins to their memory per unit; other bins
+    use ``mb_per_unit``. Returns ``(wavs, observations)`` with the waveforms in
+    input order; feed the observations to ``BucketProfile.record``.
+    """
+    cond_mel = cond_mel.to(tts.device)
+    budget_mb = free_memory_mb(tts.device) * MEMORY_HEADROOM
+    bins = bin_mb_per_unit or {}
+
+    def unit_mb(rows, tokens):
+        return bins.get(bin_key(rows, tokens), mb_per_unit)
+
+    lengths = [len(ids) for ids in token_id_lists]
+    observations = []
+    wavs = [None] * len(token_id_lists)
+    done = 0
+    for bucket in plan_buckets(lengths, generation_kwargs, bucket_cap, budget_mb, unit_mb):
+        tts._set_gr_progress(done / len(token_id_lists), f"合成分句 {done + 1}/{len(token_id_lists)}")
+        done += len(bucket)
+        bucket_wavs = _run_bucket(tts, cond_mel, [token_id_lists[i] for i in bucket], seed, generation_kwargs,
+                                  observations)
+        for i, wav in zip(bucket, bucket_wavs):
+            wavs[i] = wav
+    return wavs, observations
+
+
+def synthesize_adaptive(tts, cond_mel, token_id_lists, output_path, **kwargs):
+    """``adaptive_wavs`` written to ``output_path``; returns ``(output_path, observations)``."""
+    wavs, observations = adaptive_wavs(tts, cond_mel, token_id_lists, **kwargs)
+    return infer_stages.save_wav(output_path, wavs), observations
+
+
+class BucketProfile:
+    """Persisted table of (bucket size, padded tokens) -> runs, time, peak memory, OOMs.
+
+    ``mb_per_unit`` of an entry is measured (peak memory over cost);
+    ``oom_mb_per_unit`` holds the lower bounds recent OOMs of the bin imply.
+    """
+
+    def __init__(self, path=None, max_bucket_size=MAX_BUCKET_SIZE):
+        self.path = path
+        self.max_bucket_size = max_bucket_size
+        self._lock = threading.Lock()
+        self.table = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.table = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 分桶性能记录读取失败，将重新统计: {e}")
+        for entry in self.table.values():
+            if "oom_mb_per_unit" not in entry:
+                # earlier records folded OOM guesses into the measured value; measure those bins again
+                entry["oom_mb_per_unit"] = []
+                if entry["ooms"]:
+                    entry["mb_per_unit"] = 0.0
+
+    def record(self, observations):
+        with self._lock:
+            for obs in observations:
+                entry = self.table.setdefault(bin_key(obs["bucket_size"], obs["tokens"]), {
+                    "runs": 0, "seconds": 0.0, "tokens": 0, "peak_mb": 0.0, "mb_per_unit": 0.0, "ooms": 0,
+                    "oom_mb_per_unit": []})
+                if obs.get("oom"):
+                    entry["ooms"] += 1
+                    # it did not fit into the memory that was free, as far as that was read right
+                    entry["oom_mb_per_unit"] = (entry["oom_mb_per_unit"] + [obs["free_mb"] / obs["cost"]])[-OOM_HISTORY:]
+                    continue
+                entry["runs"] += 1
+                entry["seconds"] += obs["seconds"]
+                entry["tokens"] += obs["tokens"]
+                if obs["peak_mb"] is not None:
+                    entry["peak_mb"] = max(entry["peak_mb"], obs["peak_mb"])
+                    entry["mb_per_unit"] = max(entry["mb_per_unit"], obs["peak_mb"] / obs["cost"])
+                # the bin fit this time: its oldest OOM bound has served its turn
+                entry["oom_mb_per_unit"] = entry["oom_mb_per_unit"][1:]
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.table, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def mb_per_unit(self):
+        """Memory per unit for bins without a record of their own: the most pessimistic measured one."""
+        measured = [entry["mb_per_unit"] for entry in self.table.values() if entry["mb_per_unit"] > 0]
+        return max(measured) if measured else DEFAULT_MB_PER_UNIT
+
+    def bin_mb_per_unit(self):
+        """Memory per unit of each recorded bin: its measured value, raised by its recent OOMs."""
+        bins = {}
+        for key, entry in self.table.items():
+            value = max([entry["mb_per_unit"], *entry["oom_mb_per_unit"]])
+            if value > 0:
+                bins[key] = value
+        return bins
+
+    def bucket_cap(self):
+        """Bucket size with the best measured throughput; probes twice as large when the best is the largest tried."""
+        throughput = {}
+        for key, entry in self.table.items():
+            size = int(key.split(":")[0])
+            runs, seconds, tokens = throughput.get(size, (0, 0.0, 0))
+            throughput[size] = (runs + entry["runs"], seconds + entry["seconds"], tokens + entry["tokens"])
+        measured = {size: tokens / seconds for size, (runs, seconds, tokens) in throughput.items() if runs and seconds}
+        if not measured:
+            return DEFAULT_BUCKET_SIZE
+        best = max(measured, key=measured.get)
+        if best == max(measured):
+            return min(self.max_bucket_size, best * 2)
+        return best
+
+    def planner_params(self):
+        with self._lock:
+            return {"bucket_cap": self.bucket_cap(), "mb_per_unit": self.mb_per_unit(),
+                    "bin_mb_per_unit": self.bin_mb_per_unit()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.table),
+                "runs": sum(entry["runs"] for entry in self.table.values()),
+                "ooms": sum(entry["ooms"] for entry in self.table.values()),
+                "oom_bins": sum(1 for entry in self.table.values() if entry["oom_mb_per_unit"]),
+                "bucket_cap": self.bucket_cap(),
+                "mb_per_unit": round(self.mb_per_unit(), 4),
+            }
@@ -0,0 +1,144 @@
+"""Async plumbing of the HTTP API: blocking synthesis driven from the event loop.
+
+A request holds a model lease and an admission slot of the model's pool until
+its audio is done. For a streamed response "done" is not the end of the
+endpoint: the body runs later, may stop at any chunk when the client goes away,
+or may never run at all. A ``Lease`` is therefore shared by the response and
+by the thread synthesizing for it, and the model is returned once both let go,
+however the response ended.
+"""
+import asyncio
+import threading
+
+from starlette.responses import StreamingResponse
+
+
+class RequestCancelled(RuntimeError):
+    """Raised inside a synthesis once its client has gone away."""
+
+
+class Lease:
+    """Reference-counted hold on a leased model; ``release_fn`` runs when the last holder lets go.
+
+    Starts with one holder, the caller.
+    """
+
+    def __init__(self, release_fn):
+        self._release_fn = release_fn
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    @property
+    def returned(self):
+        with self._lock:
+            return self._holders == 0
+
+    def hold(self):
+        with self._lock:
+            if self._holders == 0:
+                raise RuntimeError("lease already returned")
+            self._holders += 1
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            last = self._holders == 0
+        if last:
+            self._release_fn()
+
+
+class LeasedStreamingResponse(StreamingResponse):
+    """``StreamingResponse`` that gives back its share of ``lease`` however it ends.
+
+    A background task would not do: Starlette skips it when the client
+    disconnects, and nothing runs for a body that was never iterated.
+    """
+
+    def __init__(self, content, lease, **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # a body suspended at a chunk the client never took stops its synthesis now
+                aclose = getattr(self.body_iterator, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            finally:
+                self.lease.release()
+
+
+async def iterate_in_thread(make_generator, cancel, executor, lease=None):
+    """Drive a blocking generator on ``executor`` and yield its items asynchronously.
+
+    Setting ``cancel`` (or closing this async generator) stops the blocking side
+    before it pulls the next item, i.e. between sentences. The blocking side
+    holds ``lease`` until its generator is closed.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    done = object()
+
+    def pump():
+        try:
+            generator = make_generator()
+            try:
+                for item in generator:
+                    loop.call_soon_threadsafe(items.put_nowait, (item, None))
+                    if cancel.is_set():
+                        break
+            finally:
+                generator.close()
+        except Exception as e:
+            loop.call_soon_threadsafe(items.put_nowait, (done, e))
+        else:
+            loop.call_soon_threadsafe(items.put_nowait, (done, None))
+        finally:
+            if lease is not None:
+                lease.release()
+
+    if lease is not None:
+        lease.hold()
+    try:
+        loop.run_in_executor(executor, pump)
+    except BaseException:
+        if lease is not None:
+            lease.release()
+        raise
+    finished = False
+    try:
+        while True:
+            item, error = await items.get()
+            if item is done:
+                finished = True
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        if not finished:
+            cancel.set()
+
+
+async def cancel_on_disconnect(request, cancel, interval=0.5):
+    while not cancel.is_set():
+        if await request.is_disconnected():
+            cancel.set()
+            return
+        await asyncio.sleep(interval)
+
+
+def cancel_progress(cancel):
+    """Progress callback for a synthesis that raises ``RequestCancelled`` once ``cancel`` is set.
+
+    Every synthesis path reports at least once per sentence (chapter for long
+    form), so a disconnect stops it at the next boundary.
+    """
+
+    def progress(value, desc=None):
+        if cancel.is_set():
+            raise RequestCancelled("client disconnected")
+    return progress
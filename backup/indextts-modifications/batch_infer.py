@@ -0,0 +1,311 @@
+"""Headless batch synthesis driven by JSONL manifests.
+
+Each manifest line uses the same record schema as ``tests/cases.jsonl``::
+
+    {"prompt_audio": "voice.wav", "text": "...", "infer_mode": 0}
+
+Optional keys: ``id`` (output file stem), ``max_text_tokens_per_sentence``,
+``sentences_bucket_max_size`` and any generation parameter of the WebUI
+(``do_sample``, ``top_p``, ``top_k``, ``temperature``, ``num_beams`` ...).
+
+The manifest is streamed in windows; rows of a window are grouped by reference
+voice so conditioning is computed once per voice, and groups are split into
+chunks synthesized by ``--workers`` model instances (a single-narrator manifest
+still uses every worker; the conditioning cache serves the repeated voice).
+Outputs land in ``<out_dir>/<voice>/<row>.wav``; a row whose ``id`` repeats an
+earlier row's output path is rejected. Every finished row is recorded with its
+checksum in ``<out_dir>/_done.jsonl``, so re-running the same command after a
+crash skips what is already done.
+
+Usage:
+    python batch_infer.py chapters.jsonl --out_dir outputs/batch --workers 2
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+sys.path.append(os.path.join(current_dir, "indextts"))
+
+from cond_cache import CACHE_DIRNAME, ConditioningCache, file_content_hash
+from infer_stages import GENERATION_DEFAULTS, prepare_instance
+from model_pool import load_index_tts, missing_model_files
+
+LEDGER_NAME = "_done.jsonl"
+INFER_MODES = {0: "infer", 1: "infer_fast"}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="IndexTTS headless batch synthesis")
+    parser.add_argument("manifest", type=str, help="JSONL manifest (same schema as tests/cases.jsonl)")
+    parser.add_argument("--out_dir", type=str, default="outputs/batch", help="Root of the output tree")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("--prompt_dir", type=str, default="tests", help="Directory relative prompt_audio paths resolve against")
+    parser.add_argument("--workers", type=int, default=1, help="Number of model instances synthesizing concurrently")
+    parser.add_argument("--devices", type=str, default="", help="Comma separated devices for the workers, e.g. cuda:0,cuda:1")
+    parser.add_argument("--window", type=int, default=2000, help="Manifest rows read and grouped by voice at a time")
+    parser.add_argument("--cond_cache_mb", type=int, default=256, help="Memory budget (MB) of the speaker-conditioning cache")
+    parser.add_argument("--cpu_mode", type=str, default="none", choices=["none", "quantize", "compile", "full"],
+                        help="CPU performance mode: int8 GPT (quantize), compiled BigVGAN (compile) or both (full); check quality with cpu_perf.py")
+    parser.add_argument("--prefix_cache_mb", type=int, default=64, help="Per-worker memory (MB) for reused GPT conditioning prefixes (0 = disabled); measure with prefix_cache.py")
+    parser.add_argument("--verbose", action="store_true", default=False, help="Enable verbose mode")
+    return parser.parse_args(argv)
+
+
+def iter_manifest(path):
+    """Yield ``(line_no, record)`` for every non-empty manifest line."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"⚠️ 第 {line_no} 行不是合法 JSON，已跳过: {e}")
+                continue
+            if not record.get("text"):
+                print(f"⚠️ 第 {line_no} 行缺少 text，已跳过")
+                continue
+            yield line_no, record
+
+
+def iter_windows(rows, size):
+    window = []
+    for row in rows:
+        window.append(row)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def group_by_voice(window):
+    """Group a window of rows by prompt_audio, keeping first-appearance order."""
+    groups = {}
+    for line_no, record in window:
+        groups.setdefault(record.get("prompt_audio", "sample_prompt.wav"), []).append((line_no, record))
+    return groups
+
+
+def split_rows(rows, parts):
+    """Split a voice group into at most ``parts`` contiguous chunks of near-equal size."""
+    size = max(1, -(-len(rows) // max(1, parts)))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+def row_params(record):
+    params = {k: record[k] for k in GENERATION_DEFAULTS if k in record}
+    params["infer_mode"] = int(record.get("infer_mode", 0))
+    params["max_text_tokens_per_sentence"] = int(record.get("max_text_tokens_per_sentence", 120))
+    if params["infer_mode"] == 1:
+        params["sentences_bucket_max_size"] = int(record.get("sentences_bucket_max_size", 4))
+    return params
+
+
+def row_key(record):
+    """Deterministic identity of a row: voice, text and every parameter."""
+    canonical = json.dumps(
+        {"prompt_audio": record.get("prompt_audio"), "text": record["text"], "params": row_params(record)},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def output_path_for(out_dir, record, key):
+    voice = os.path.splitext(os.path.basename(record.get("prompt_audio", "sample_prompt.wav")))[0]
+    stem = str(record["id"]) if record.get("id") is not None else key[:16]
+    return os.path.join(out_dir, voice, f"{stem}.wav")
+
+
+class Ledger:
+    """Append-only record of finished rows and their output checksums."""
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, LEDGER_NAME)
+        self._lock = threading.Lock()
+        self._done = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn write from a crash
+                    self._done[entry["key"]] = entry
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def is_done(self, key, output_path):
+        entry = self._done.get(key)
+        if entry is None or entry["output"] != output_path or not os.path.exists(output_path):
+            return False
+        return file_content_hash(output_path) == entry["sha256"]
+
+    def mark_done(self, key, output_path, line_no):
+        entry = {"key": key, "output": output_path, "sha256": file_content_hash(output_path), "line": line_no}
+        with self._lock:
+            self._done[key] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRunner:
+    def __init__(self, args, models):
+        self.args = args
+        self.models = models
+        self.ledger = Ledger(args.out_dir)
+        self.cond_cache = ConditioningCache(
+            os.path.join(args.prompt_dir, CACHE_DIRNAME),
+            model_version=models[0].model_version,
+            max_bytes=args.cond_cache_mb * 1024 * 1024,
+        )
+        # bounded so only a few voice group chunks are held in memory ahead of the workers
+        self._groups = queue.Queue(maxsize=len(models) * 2)
+        self._lock = threading.Lock()
+        self._outputs = {}  # output path -> (row key, line) of the row that claimed it
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _claim_outputs(self, window):
+        """Drop rows whose output path an earlier row already claimed.
+
+        An exact duplicate (same voice, text and parameters) is skipped; a
+        different row with the same ``id`` would overwrite the first one's
+        output, so it fails.
+        """
+        rows = []
+        for line_no, record in window:
+            key = row_key(record)
+            output_path = output_path_for(self.args.out_dir, record, key)
+            claimed = self._outputs.setdefault(output_path, (key, line_no))
+            if claimed == (key, line_no):
+                rows.append((line_no, record))
+            elif claimed[0] == key:
+                self._count("skipped")
+            else:
+                print(f"❌ 第 {line_no} 行与第 {claimed[1]} 行输出到同一文件 {output_path}（id 重复），已跳过")
+                self._count("failed")
+        return rows
+
+    def _synthesize_group(self, tts, voice, rows):
+        prompt_path = voice if os.path.isabs(voice) else os.path.join(self.args.prompt_dir, voice)
+        todo = []
+        for line_no, record in rows:
+            key = row_key(record)
+            output_path = output_path_for(self.args.out_dir, record, key)
+            try:
+                done = self.ledger.is_done(key, output_path)
+            except OSError as e:
+                print(f"❌ 第 {line_no} 行检查已完成记录失败: {e}")
+                self._count("failed")
+                continue
+            if done:
+                self._count("skipped")
+            else:
+                todo.append((line_no, record, key, output_path))
+        if not todo:
+            return
+        if not os.path.exists(prompt_path):
+            print(f"❌ 参考音频不存在: {prompt_path}（{len(todo)} 行失败）")
+            for _ in todo:
+                self._count("failed")
+            return
+        # computed once per voice; every row of the group reuses it
+        try:
+            tts.cache_cond_mel = self.cond_cache.get(prompt_path).to(tts.device)
+            tts.cache_audio_prompt = prompt_path
+        except Exception as e:
+            print(f"❌ 参考音频处理失败: {prompt_path}（{len(todo)} 行失败）: {e}")
+            for _ in todo:
+                self._count("failed")
+            return
+        for line_no, record, key, output_path in todo:
+            try:
+                params = row_params(record)
+                infer_mode = params.pop("infer_mode")
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                part_path = output_path + ".part.wav"
+                getattr(tts, INFER_MODES.get(infer_mode, "infer"))(
+                    prompt_path, record["text"], part_path, verbose=self.args.verbose, **params)
+                os.replace(part_path, output_path)
+                self.ledger.mark_done(key, output_path, line_no)
+                self._count("done")
+            except Exception as e:
+                print(f"❌ 第 {line_no} 行合成失败: {e}")
+                self._count("failed")
+
+    def _worker(self, tts):
+        while True:
+            item = self._groups.get()
+            if item is None:
+                return
+            voice, rows = item
+            try:
+                self._synthesize_group(tts, voice, rows)
+            except Exception as e:
+                # a dead worker would leave run() blocked on the bounded queue
+                print(f"❌ 参考音频 {voice} 的 {len(rows)} 行处理异常: {e}")
+                for _ in rows:
+                    self._count("failed")
+
+    def run(self):
+        threads = [threading.Thread(target=self._worker, args=(tts,), daemon=True) for tts in self.models]
+        for t in threads:
+            t.start()
+        start = time.perf_counter()
+        for window in iter_windows(iter_manifest(self.args.manifest), self.args.window):
+            for voice, rows in group_by_voice(self._claim_outputs(window)).items():
+                for chunk in split_rows(rows, len(self.models)):
+                    self._groups.put((voice, chunk))
+            print(f"📊 已完成 {self.done}，跳过 {self.skipped}，失败 {self.failed}，"
+                  f"用时 {time.perf_counter() - start:.1f}s")
+        for _ in threads:
+            self._groups.put(None)
+        for t in threads:
+            t.join()
+        self.ledger.close()
+        print(f"✅ 批量合成结束: 完成 {self.done}，跳过 {self.skipped}，失败 {self.failed}，"
+              f"用时 {time.perf_counter() - start:.1f}s")
+        return self.failed == 0
+
+
+def load_models(args):
+    """Load the worker instances the way the WebUI does: memory-mapped weights, CPU mode, prefix cache."""
+    for file_path in missing_model_files(args.model_dir):
+        print(f"Required file {file_path} does not exist. Please download it.")
+        sys.exit(1)
+    prepare = functools.partial(prepare_instance, cpu_mode=args.cpu_mode, prefix_cache_mb=args.prefix_cache_mb)
+    devices = [d.strip() for d in args.devices.split(",") if d.strip()]
+    models = []
+    for i in range(max(1, args.workers)):
+        device = devices[i % len(devices)] if devices else None
+        models.append(load_index_tts(args.model_dir, device, prepare))
+    return models
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.out_dir, exist_ok=True)
+    runner = BatchRunner(args, load_models(args))
+    sys.exit(0 if runner.run() else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Dynamic cross-request batching in front of IndexTTS.
+
+``infer_fast`` only buckets the sentences of a single request, so under load
+the GPU decodes one small batch per Gradio job. ``BatchScheduler`` collects
+sentence segments from concurrent requests over a short window, groups them by
+voice and sampling parameters, buckets each group by token length and runs every
+bucket through the model as one batch, then resolves each caller's futures.
+
+The model only needs ``synthesize_batch(cond_mel, token_id_lists, gen_kwargs)``
+returning one waveform per row, so the scheduler runs against
+``PooledBatchModel`` in production and ``stub_tts.StubBatchModel`` on CPU.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import infer_stages
+from adaptive_bucket import batch_cost
+
+
+class PooledBatchModel:
+    """Runs scheduler batches on the least loaded worker of a ``ModelPool``."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def synthesize_batch(self, cond_mel, token_id_lists, gen_kwargs):
+        return self.pool.run(infer_stages.synthesize_batch, cond_mel, token_id_lists, **gen_kwargs)
+
+
+@dataclass
+class _Segment:
+    group_key: tuple
+    cond_mel: object
+    token_ids: list
+    gen_kwargs: dict
+    model: object = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    future: Future = field(default_factory=Future)
+
+
+class BatchScheduler:
+    """Collects segments for up to ``max_wait_ms`` and runs them in shared batches.
+
+    ``max_batch_tokens`` is the memory ceiling: a batch is closed once
+    ``rows * num_beams * (longest_text + max_mel_tokens)`` would exceed it, which
+    tracks the size of the GPT key/value cache the batch needs.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=30, max_batch_tokens=20000, concurrency=1):
+        self.model = model
+        # batches in flight at once; match the number of model workers
+        self.concurrency = max(1, int(concurrency))
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.max_batch_tokens = int(max_batch_tokens)
+        self._cond = threading.Condition()
+        self._pending = []
+        self._stopped = False
+        self._thread = None
+        self.batches_run = 0
+        self.segments_run = 0
+        self.largest_batch = 0
+
+    def start(self):
+        if self._thread is None:
+            if self.concurrency > 1:
+                self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="batch-run")
+            self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def submit(self, voice_key, cond_mel, token_id_lists, gen_kwargs, model=None):
+        """Queue one request's sentences; returns one future per sentence, in order.
+
+        ``model`` runs this request's batches instead of the scheduler's own
+        (e.g. another checkpoint of a ``ModelRegistry``); only requests for the
+        same model are batched together.
+        """
+        model = model or self.model
+        group_key = (voice_key, tuple(sorted(gen_kwargs.items())), id(model))
+        segments = [_Segment(group_key, cond_mel, list(ids), dict(gen_kwargs), model) for ids in token_id_lists]
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("batch scheduler is stopped")
+            self._pending.extend(segments)
+            self._cond.notify_all()
+        return [seg.future for seg in segments]
+
+    def _collect(self):
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            deadline = self._pending[0].enqueued_at + self.max_wait
+            while not self._stopped and len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            segments, self._pending = self._pending, []
+        return segments
+
+    def plan_batches(self, segments):
+        """Group by voice and sampling params, then bucket by token length."""
+        groups = {}
+        for seg in segments:
+            groups.setdefault(seg.group_key, []).append(seg)
+        batches = []
+        for group in groups.values():
+            group.sort(key=lambda s: len(s.token_ids))
+            batch = []
+            for seg in group:
+                # sorted ascending, so the candidate is the longest row of the batch
+                too_big = batch_cost(len(batch) + 1, len(seg.token_ids), seg.gen_kwargs) > self.max_batch_tokens
+                if batch and (len(batch) >= self.max_batch_size or too_big):
+                    batches.append(batch)
+                    batch = []
+                batch.append(seg)
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def _run_batch(self, batch):
+        live = [seg for seg in batch if seg.future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        head = live[0]
+        try:
+            wavs = head.model.synthesize_batch(head.cond_mel, [seg.token_ids for seg in live], head.gen_kwargs)
+        except Exception as e:
+            for seg in live:
+                seg.future.set_exception(e)
+            return
+        for seg, wav in zip(live, wavs):
+            seg.future.set_result(wav)
+        with self._cond:
+            self.batches_run += 1
+            self.segments_run += len(live)
+            self.largest_batch = max(self.largest_batch, len(live))
+
+    def _run_in_slot(self, batch):
+        try:
+            self._run_batch(batch)
+        finally:
+            self._slots.release()
+
+    def _loop(self):
+        while True:
+            segments = self._collect()
+            if segments is None:
+                return
+            batches = self.plan_batches(segments)
+            if self._executor is None:
+                for batch in batches:
+                    self._run_batch(batch)
+                continue
+            for batch in batches:
+                # no barrier per round: a long batch holds one slot, and segments arriving
+                # meanwhile are collected and run as soon as any slot frees up
+                self._slots.acquire()
+                self._executor.submit(self._run_in_slot, batch)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "batches": self.batches_run,
+            "segments": self.segments_run,
+            "avg_batch_size": round(self.segments_run / self.batches_run, 2) if self.batches_run else 0.0,
+            "largest_batch": self.largest_batch,
+        }
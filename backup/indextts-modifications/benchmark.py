@@ -0,0 +1,343 @@
+"""Reproducible synthesis benchmark.
+
+Replays ``tests/cases.jsonl`` plus synthetic long texts through ``tts.infer``
+and ``tts.infer_fast`` over a parameter grid (max tokens per sentence, bucket
+size, ``num_beams``, ``max_mel_tokens``, concurrent clients) and records latency
+percentiles, real-time factor, throughput and peak RSS/VRAM per configuration.
+Results are written as JSON and CSV, optionally compared against a saved
+baseline; a configuration regressing beyond ``--max_regression`` fails the run.
+
+``--stub`` swaps the checkpoints for ``stub_tts.StubIndexTTS`` so the suite runs
+on a CPU-only CI machine.
+
+Usage:
+    python benchmark.py --stub --out_dir outputs/bench --baseline bench_baseline.json
+    python benchmark.py --modes infer_fast --bucket_sizes 2,4,8 --concurrency 1,4 --workers 2
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import queue
+import random
+import sys
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+sys.path.append(os.path.join(current_dir, "indextts"))
+
+from infer_stages import GENERATION_DEFAULTS, wav_seconds
+from model_pool import ModelPool, ThreadWorker
+
+# metric -> True when larger is better
+COMPARED_METRICS = {
+    "latency_p50": False,
+    "latency_p95": False,
+    "rtf_mean": False,
+    "throughput": True,
+    "peak_rss_mb": False,
+    "peak_vram_mb": False,
+}
+CONFIG_KEYS = ("mode", "max_text_tokens_per_sentence", "sentences_bucket_max_size", "num_beams",
+               "max_mel_tokens", "concurrency")
+
+_ZH_PHRASES = ["今天的天气非常好", "我们一起去公园散步", "人工智能正在改变世界", "请在会议开始前准备好材料",
+               "这本书讲述了一个感人的故事", "城市的夜晚灯火通明", "他花了三年时间完成这个项目"]
+_EN_PHRASES = ["the quick brown fox jumps over the lazy dog", "speech synthesis has improved a lot",
+               "please review the quarterly report", "the train leaves at half past seven"]
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="IndexTTS synthesis benchmark")
+    parser.add_argument("--cases", type=str, default="tests/cases.jsonl", help="Cases to replay (tests/cases.jsonl schema)")
+    parser.add_argument("--prompt_dir", type=str, default="tests", help="Directory relative prompt_audio paths resolve against")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("--stub", action="store_true", default=False, help="Use the CPU stub model instead of checkpoints")
+    parser.add_argument("--workers", type=int, default=1, help="Number of model instances")
+    parser.add_argument("--devices", type=str, default="", help="Comma separated devices for the workers")
+    parser.add_argument("--modes", type=str, default="infer,infer_fast", help="Inference methods to benchmark")
+    parser.add_argument("--max_text_tokens", type=parse_int_list, default=[120], help="Sweep of max_text_tokens_per_sentence")
+    parser.add_argument("--bucket_sizes", type=parse_int_list, default=[4], help="Sweep of sentences_bucket_max_size (infer_fast)")
+    parser.add_argument("--num_beams", type=parse_int_list, default=[GENERATION_DEFAULTS["num_beams"]], help="Sweep of num_beams")
+    parser.add_argument("--max_mel_tokens", type=parse_int_list, default=[GENERATION_DEFAULTS["max_mel_tokens"]], help="Sweep of max_mel_tokens")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1], help="Sweep of concurrent clients")
+    parser.add_argument("--long_texts", type=parse_int_list, default=[300, 1500], help="Character counts of synthetic long texts")
+    parser.add_argument("--repeats", type=int, default=1, help="Times every text is submitted per configuration")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for synthetic texts and sampling")
+    parser.add_argument("--out_dir", type=str, default="outputs/bench", help="Where results.json/results.csv are written")
+    parser.add_argument("--baseline", type=str, default="", help="Baseline JSON to compare against")
+    parser.add_argument("--save_baseline", type=str, default="", help="Also write the results as a baseline to this path")
+    parser.add_argument("--max_regression", type=float, default=0.2, help="Allowed relative regression per metric before failing")
+    return parser.parse_args(argv)
+
+
+def synthetic_long_text(n_chars, seed):
+    """Deterministic mixed Chinese/English paragraph of about ``n_chars`` characters."""
+    rng = random.Random(seed * 7919 + n_chars)
+    parts = []
+    length = 0
+    while length < n_chars:
+        phrase = rng.choice(_EN_PHRASES).capitalize() + "." if rng.random() < 0.2 else rng.choice(_ZH_PHRASES) + rng.choice("，。。！？")
+        parts.append(phrase)
+        length += len(phrase)
+    return "".join(parts)
+
+
+def load_texts(args):
+    """``(name, prompt_path, text)`` for the replayed cases and the synthetic texts."""
+    texts = []
+    default_prompt = os.path.join(args.prompt_dir, "sample_prompt.wav")
+    if os.path.exists(args.cases):
+        with open(args.cases, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    continue
+                case = json.loads(line)
+                prompt = os.path.join(args.prompt_dir, case.get("prompt_audio", "sample_prompt.wav"))
+                texts.append((f"case{i}", prompt, case["text"]))
+    else:
+        print(f"⚠️ 未找到 {args.cases}，仅使用合成长文本")
+    prompt = texts[0][1] if texts else default_prompt
+    for n in args.long_texts:
+        texts.append((f"long{n}", prompt, synthetic_long_text(n, args.seed)))
+    return texts
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemorySampler:
+    """Peak RSS of this process (thread workers included) and peak CUDA memory."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+            self._stopped.wait(self.interval)
+
+    def __enter__(self):
+        import torch
+        if torch.cuda.is_available():
+            for i in range(torch.cuda.device_count()):
+                torch.cuda.reset_peak_memory_stats(i)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+        return False
+
+    @staticmethod
+    def peak_vram_mb():
+        import torch
+        if not torch.cuda.is_available():
+            return 0.0
+        return sum(torch.cuda.max_memory_allocated(i) for i in range(torch.cuda.device_count())) / 2 ** 20
+
+
+def bench_call(tts, method, prompt_path, text, output_path, seed=None, **kwargs):
+    """Work unit run on a pool worker: one ``infer``/``infer_fast`` call."""
+    if seed is not None:
+        import torch
+        torch.manual_seed(seed)
+    return getattr(tts, method)(prompt_path, text, output_path, **kwargs)
+
+
+def iter_configs(args):
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        buckets = args.bucket_sizes if mode == "infer_fast" else [None]
+        for mtt, bucket, beams, mel, conc in itertools.product(
+                args.max_text_tokens, buckets, args.num_beams, args.max_mel_tokens, args.concurrency):
+            yield {"mode": mode, "max_text_tokens_per_sentence": mtt, "sentences_bucket_max_size": bucket,
+                   "num_beams": beams, "max_mel_tokens": mel, "concurrency": conc}
+
+
+def run_config(pool, config, texts, args):
+    """Submit every text ``repeats`` times from ``concurrency`` client threads."""
+    kwargs = dict(GENERATION_DEFAULTS)
+    kwargs.update(num_beams=config["num_beams"], max_mel_tokens=config["max_mel_tokens"],
+                  max_text_tokens_per_sentence=config["max_text_tokens_per_sentence"])
+    if config["sentences_bucket_max_size"] is not None:
+        kwargs["sentences_bucket_max_size"] = config["sentences_bucket_max_size"]
+    audio_dir = os.path.join(args.out_dir, "audio")
+    os.makedirs(audio_dir, exist_ok=True)
+    jobs = queue.Queue()
+    for r in range(args.repeats):
+        for name, prompt, text in texts:
+            jobs.put((f"{name}_r{r}", prompt, text))
+    samples = []  # (latency, audio seconds)
+    errors = []
+    lock = threading.Lock()
+
+    def client(index):
+        while True:
+            try:
+                name, prompt, text = jobs.get_nowait()
+            except queue.Empty:
+                return
+            output_path = os.path.join(audio_dir, f"c{index}_{name}.wav")
+            start = time.perf_counter()
+            try:
+                pool.run(bench_call, config["mode"], prompt, text, output_path, seed=args.seed, **kwargs)
+                latency = time.perf_counter() - start
+                sample = (latency, wav_seconds(output_path))
+                with lock:
+                    samples.append(sample)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{name}: {type(e).__name__}: {e}")
+
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        clients = [threading.Thread(target=client, args=(i,)) for i in range(config["concurrency"])]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        wall = time.perf_counter() - start
+    latencies = [lat for lat, _ in samples]
+    rtfs = [lat / audio for lat, audio in samples if audio > 0]
+    audio_total = sum(audio for _, audio in samples)
+    row = dict(config)
+    row.update({
+        "requests": len(samples),
+        "errors": len(errors),
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "rtf_mean": sum(rtfs) / len(rtfs) if rtfs else None,
+        "rtf_p95": percentile(rtfs, 95),
+        "audio_seconds": audio_total,
+        "wall_seconds": wall,
+        # seconds of audio produced per second of wall time across all clients
+        "throughput": audio_total / wall if wall else None,
+        "requests_per_s": len(samples) / wall if wall else None,
+        "peak_rss_mb": memory.peak_rss_mb,
+        "peak_vram_mb": memory.peak_vram_mb(),
+    })
+    for error in errors[:5]:
+        print(f"❌ {error}")
+    return row
+
+
+def config_key(row):
+    return tuple(row.get(k) for k in CONFIG_KEYS)
+
+
+def compare(rows, baseline_rows, max_regression):
+    """Annotate rows with their change vs the baseline; returns the list of regressions."""
+    baseline = {config_key(r): r for r in baseline_rows}
+    regressions = []
+    for row in rows:
+        base = baseline.get(config_key(row))
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            new, old = row.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            row[f"{metric}_vs_baseline"] = round(change, 4)
+            worse = -change if higher_is_better else change
+            if worse > max_regression:
+                regressions.append(f"{dict(zip(CONFIG_KEYS, config_key(row)))} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    return regressions
+
+
+def build_pool(args):
+    if args.stub:
+        from stub_tts import StubIndexTTS
+
+        return ModelPool([ThreadWorker(i, StubIndexTTS(), "cpu") for i in range(max(1, args.workers))],
+                         max_pending=1 << 30)
+    return ModelPool.create(args.model_dir, num_workers=args.workers,
+                            devices=[d.strip() for d in args.devices.split(",") if d.strip()], max_pending=1 << 30)
+
+
+def environment():
+    import torch
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+    }
+
+
+def write_results(out_dir, meta, rows):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "results.json"), "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": rows}, f, ensure_ascii=False, indent=2)
+    fields = list(dict.fromkeys(k for row in rows for k in row))
+    with open(os.path.join(out_dir, "results.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    texts = load_texts(args)
+    pool = build_pool(args)
+    meta = {"args": vars(args), "environment": environment(), "texts": [name for name, _, _ in texts]}
+    rows = []
+    try:
+        for config in iter_configs(args):
+            row = run_config(pool, config, texts, args)
+            rows.append(row)
+            print(f"📊 {config}: p50={row['latency_p50'] or 0:.3f}s p95={row['latency_p95'] or 0:.3f}s "
+                  f"RTF={row['rtf_mean'] or 0:.3f} 吞吐={row['throughput'] or 0:.2f} 音频秒/秒")
+    finally:
+        pool.close()
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(rows, json.load(f)["results"], args.max_regression)
+    write_results(args.out_dir, meta, rows)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": rows}, f, ensure_ascii=False, indent=2)
+    print(f"✅ 结果已写入 {os.path.join(args.out_dir, 'results.json')} / results.csv")
+    failed = bool(regressions) or any(row["errors"] for row in rows)
+    for regression in regressions:
+        print(f"❌ 性能回退: {regression}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
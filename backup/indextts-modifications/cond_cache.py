@@ -0,0 +1,256 @@
+"""Persistent speaker-conditioning cache for the WebUI.
+
+IndexTTS only remembers the conditioning mel of the *last* prompt path it saw
+(``tts.cache_audio_prompt`` / ``tts.cache_cond_mel``), so alternating between
+library voices decodes, resamples and re-encodes the reference clip on every
+request. This module keeps conditioning mels keyed by the clip's content hash
+plus the model version, in an in-memory LRU bounded by bytes and in an on-disk
+store that survives restarts. Every upload is a new clip, so the disk store is
+bounded too: entries unused for ``max_age_s`` and the least recently used ones
+above ``max_disk_bytes`` are swept after writes. Which content a path last had
+is recorded next to the entries, so a clip replaced while the WebUI was down
+still has its old entry dropped by ``invalidate``.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+import torchaudio
+
+CACHE_DIRNAME = ".cond_cache"
+PATHS_DIRNAME = "paths"
+PROMPT_SAMPLE_RATE = 24000
+
+
+def file_content_hash(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_cond_mel(audio_path):
+    """Compute the conditioning mel exactly like ``IndexTTS.infer`` does (on CPU)."""
+    from indextts.utils.feature_extractors import MelSpectrogramFeatures
+
+    if audio_path.endswith(".npy"):
+        # canonical ingest copy: already mono at the model rate
+        from ref_ingest import load_canonical
+
+        return MelSpectrogramFeatures()(load_canonical(audio_path))
+    audio, sr = torchaudio.load(audio_path)
+    audio = torch.mean(audio, dim=0, keepdim=True)
+    if audio.shape[0] > 1:
+        audio = audio[0].unsqueeze(0)
+    audio = torchaudio.transforms.Resample(sr, PROMPT_SAMPLE_RATE)(audio)
+    return MelSpectrogramFeatures()(audio)
+
+
+def _tensor_nbytes(tensor):
+    return tensor.element_size() * tensor.nelement()
+
+
+class ConditioningCache:
+    """Content-addressed conditioning cache: memory LRU in front of a disk store."""
+
+    def __init__(self, store_dir, model_version, max_bytes=256 * 1024 * 1024, compute_fn=compute_cond_mel,
+                 max_disk_bytes=1024 ** 3, max_age_s=30 * 86400, sweep_interval_s=60):
+        self.store_dir = store_dir
+        self.compute_fn = compute_fn
+        self.model_version = str(model_version or "1.0")
+        self.max_bytes = int(max_bytes)
+        self.max_disk_bytes = int(max_disk_bytes)
+        self.max_age_s = max_age_s
+        self.sweep_interval_s = sweep_interval_s
+        self._paths_dir = os.path.join(store_dir, PATHS_DIRNAME)
+        os.makedirs(self._paths_dir, exist_ok=True)
+        self._last_sweep = None
+        self.swept_files = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> cpu tensor
+        self._bytes = 0
+        # path -> (mtime_ns, size, digest); avoids re-hashing unchanged files
+        self._path_digests = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _digest(self, path):
+        st = os.stat(path)
+        with self._lock:
+            known = self._path_digests.get(path)
+        if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            return known[2]
+        digest = file_content_hash(path)
+        with self._lock:
+            self._path_digests[path] = (st.st_mtime_ns, st.st_size, digest)
+        self._record_path(path, digest)
+        return digest
+
+    def _path_record(self, path):
+        name = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self._paths_dir, f"{name}.txt")
+
+    def _record_path(self, path, digest):
+        record = self._path_record(path)
+        tmp_path = f"{record}.tmp{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(digest)
+            os.replace(tmp_path, record)
+        except OSError as e:
+            print(f"⚠️ 无法写入条件缓存: {e}")
+
+    def _recorded_digest(self, path):
+        try:
+            with open(self._path_record(path), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def key_for(self, path):
+        """Cache key of a reference clip: content hash plus model version."""
+        return f"{self._digest(path)}_v{self.model_version}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.store_dir, f"{key}.pt")
+
+    def _remember(self, key, tensor):
+        nbytes = _tensor_nbytes(tensor)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= _tensor_nbytes(self._entries.pop(key))
+        self._entries[key] = tensor
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= _tensor_nbytes(evicted)
+
+    def get(self, path, compute_fn=None):
+        """Return the CPU conditioning mel for ``path``, computing it on a miss."""
+        key = self.key_for(path)
+        with self._lock:
+            tensor = self._entries.get(key)
+            if tensor is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return tensor
+
+        disk_path = self._disk_path(key)
+        tensor = None
+        if os.path.exists(disk_path):
+            try:
+                tensor = torch.load(disk_path, map_location="cpu")
+            except Exception as e:
+                print(f"⚠️ 条件缓存文件损坏，将重新计算: {disk_path} ({e})")
+        if tensor is not None:
+            try:
+                # recency for the disk sweep
+                os.utime(disk_path)
+            except OSError:
+                pass
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, tensor)
+            return tensor
+
+        tensor = (compute_fn or self.compute_fn)(path).detach().cpu()
+        # per thread: workers may miss the same voice at the same time
+        tmp_path = f"{disk_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        try:
+            torch.save(tensor, tmp_path)
+            os.replace(tmp_path, disk_path)
+        except OSError as e:
+            print(f"⚠️ 无法写入条件缓存: {e}")
+        with self._lock:
+            self.misses += 1
+            self._remember(key, tensor)
+            now = time.monotonic()
+            due = self._last_sweep is None or now - self._last_sweep >= self.sweep_interval_s
+            if due:
+                self._last_sweep = now
+        if due:
+            self.sweep()
+        return tensor
+
+    def invalidate(self, path):
+        """Forget everything cached for ``path`` (call after it is written)."""
+        with self._lock:
+            known = self._path_digests.pop(path, None)
+        # the content it had before, even when that was seen by an earlier process
+        digest = known[2] if known else self._recorded_digest(path)
+        if digest is None:
+            return
+        key = f"{digest}_v{self.model_version}"
+        with self._lock:
+            tensor = self._entries.pop(key, None)
+            if tensor is not None:
+                self._bytes -= _tensor_nbytes(tensor)
+        for stale in (self._disk_path(key), self._path_record(path)):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    def sweep(self):
+        """Remove disk entries unused for ``max_age_s``, then the least recently used above ``max_disk_bytes``."""
+        now = time.time()
+        entries = []
+        removed = 0
+        for directory, suffix in ((self.store_dir, ".pt"), (self._paths_dir, ".txt")):
+            try:
+                with os.scandir(directory) as it:
+                    for de in it:
+                        if not de.is_file() or not de.name.endswith(suffix):
+                            continue
+                        try:
+                            st = de.stat()
+                        except OSError:
+                            continue
+                        if self.max_age_s > 0 and now - st.st_mtime > self.max_age_s:
+                            try:
+                                os.remove(de.path)
+                                removed += 1
+                            except OSError:
+                                pass
+                        elif suffix == ".pt":
+                            entries.append((st.st_mtime, st.st_size, de.path))
+            except OSError as e:
+                print(f"⚠️ 条件缓存清理失败: {e}")
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.max_disk_bytes <= 0 or total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self.swept_files += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "swept_files": self.swept_files,
+            }
@@ -0,0 +1,253 @@
+"""CPU performance mode: int8 GPT, compiled BigVGAN, and a quality check.
+
+Without ``CUDA_HOME`` the fused ``anti_alias_activation`` extension is not
+built and IndexTTS runs plain eager fp32 PyTorch on CPU nodes. ``optimize``
+trades precision for speed on a loaded instance:
+
+- ``quantize``: int8 dynamic quantization of the GPT transformer blocks. HF
+  GPT-2 uses ``Conv1D`` projections, which are turned into ``nn.Linear`` first
+  so ``quantize_dynamic`` picks them up.
+- ``compile``: every anti-alias activation of BigVGAN is replaced by a CPU
+  version with its Snake parameters exponentiated once and its up/down-sampling
+  filters pre-expanded, and the vocoder is wrapped in ``torch.compile`` (falling
+  back to eager if compilation fails).
+
+The speedup must not cost audible quality, so ``python cpu_perf.py`` compares
+an optimized instance against fp32 on ``tests/cases.jsonl``: log-mel spectral
+distance of the end-to-end output (DTW-aligned, as int8 decoding may change
+durations) and of the vocoder alone on identical latents.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+CPU_MODES = ("none", "quantize", "compile", "full")
+SNAKE_EPS = 1e-9
+
+
+def _conv1d_to_linear(module):
+    """Swap HF ``Conv1D`` (x @ W + b, W is [in, out]) for an equivalent ``nn.Linear``."""
+    for name, child in module.named_children():
+        if type(child).__name__ == "Conv1D":
+            linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1])
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def quantize_gpt(tts):
+    """int8 dynamic quantization of the GPT-2 blocks shared by training and inference paths."""
+    transformer = tts.gpt.gpt
+    _conv1d_to_linear(transformer)
+    # in place: the GPT-2 inference wrapper holds the same module objects
+    torch.ao.quantization.quantize_dynamic(transformer, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return tts
+
+
+class CPUActivation1d(torch.nn.Module):
+    """Eager BigVGAN ``Activation1d`` (upsample, Snake/SnakeBeta, downsample) with constants folded."""
+
+    def __init__(self, activation):
+        super().__init__()
+        up, low, act = activation.upsample, activation.downsample.lowpass, activation.act
+        alpha = act.alpha.detach()
+        beta = act.beta.detach() if hasattr(act, "beta") else alpha
+        if act.alpha_logscale:
+            alpha, beta = torch.exp(alpha), torch.exp(beta)
+        channels = alpha.shape[0]
+        self.register_buffer("alpha", alpha.view(1, -1, 1).clone())
+        self.register_buffer("inv_beta", (1.0 / (beta + SNAKE_EPS)).view(1, -1, 1).clone())
+        self.register_buffer("up_filter", (up.ratio * up.filter).expand(channels, -1, -1).contiguous())
+        self.register_buffer("low_filter", low.filter.expand(channels, -1, -1).contiguous())
+        self.channels = channels
+        self.up_ratio = up.ratio
+        self.up_pad = up.pad
+        self.up_pad_left = up.pad_left
+        self.up_pad_right = up.pad_right
+        self.low_padding = low.padding
+        self.low_pad_left = low.pad_left
+        self.low_pad_right = low.pad_right
+        self.low_stride = low.stride
+        self.low_padding_mode = low.padding_mode
+
+    def forward(self, x):
+        x = F.pad(x, (self.up_pad, self.up_pad), mode="replicate")
+        x = F.conv_transpose1d(x, self.up_filter, stride=self.up_ratio, groups=self.channels)
+        x = x[..., self.up_pad_left:-self.up_pad_right]
+        x = torch.addcmul(x, self.inv_beta, torch.sin(x * self.alpha).pow(2))
+        if self.low_padding:
+            x = F.pad(x, (self.low_pad_left, self.low_pad_right), mode=self.low_padding_mode)
+        return F.conv1d(x, self.low_filter, stride=self.low_stride, groups=self.channels)
+
+
+def _replace_activations(module):
+    replaced = 0
+    for name, child in module.named_children():
+        if type(child).__name__ == "Activation1d" and hasattr(child, "upsample"):
+            setattr(module, name, CPUActivation1d(child))
+            replaced += 1
+        else:
+            replaced += _replace_activations(child)
+    return replaced
+
+
+class _CompiledVocoder:
+    """``torch.compile``-d BigVGAN that falls back to eager for good if compilation fails."""
+
+    def __init__(self, module):
+        self._module = module
+        self._compiled = torch.compile(module, dynamic=True)
+
+    def __call__(self, *args, **kwargs):
+        if self._compiled is not None:
+            try:
+                return self._compiled(*args, **kwargs)
+            except Exception as e:
+                print(f"⚠️ BigVGAN 编译失败，回退为 eager 模式: {e}")
+                self._compiled = None
+        return self._module(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+def compile_bigvgan(tts):
+    replaced = _replace_activations(tts.bigvgan)
+    if hasattr(torch, "compile"):
+        tts.bigvgan = _CompiledVocoder(tts.bigvgan)
+    return replaced
+
+
+def optimize(tts, mode="full", num_threads=0):
+    """Apply CPU mode ``mode`` (see ``CPU_MODES``) to a loaded ``IndexTTS`` in place."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if mode == "none":
+        return tts
+    if torch.device(tts.device).type != "cpu":
+        print(f"⚠️ CPU 性能模式仅对 CPU 实例生效，{tts.device} 保持原样")
+        return tts
+    if mode in ("quantize", "full"):
+        quantize_gpt(tts)
+    if mode in ("compile", "full"):
+        compile_bigvgan(tts)
+    return tts
+
+
+def log_mel_db(wav, sample_rate=24000):
+    """``[1, N]`` int16-range waveform -> ``[frames, 80]`` log-mel in dB."""
+    import torchaudio
+
+    mel = torchaudio.transforms.MelSpectrogram(sample_rate, n_fft=1024, hop_length=256, n_mels=80)(wav.float() / 32767)
+    return (10 * torch.log10(mel.clamp_min(1e-10))).squeeze(0).T.numpy()
+
+
+def spectral_distance(a, b):
+    """Mean per-frame RMS log-mel difference in dB of two equally timed spectrograms."""
+    n = min(len(a), len(b))
+    return float(np.sqrt(((a[:n] - b[:n]) ** 2).mean(axis=1)).mean())
+
+
+def dtw_spectral_distance(a, b):
+    """``spectral_distance`` along the DTW alignment of two spectrograms of different timing.
+
+    The accumulated cost is normalized by the longer length.
+    """
+    def row_cost(i):
+        return np.sqrt(((b - a[i]) ** 2).mean(axis=1))
+
+    prev = np.cumsum(row_cost(0))
+    for i in range(1, len(a)):
+        # acc[j] = c[j] + min(prev[j - 1], prev[j], acc[j - 1]), solved as a prefix-min scan over the row
+        cost = row_cost(i)
+        best = np.minimum(prev, np.concatenate([[np.inf], prev[:-1]]))
+        total = np.cumsum(cost)
+        prev = total + np.minimum.accumulate(best - (total - cost))
+    return float(prev[-1] / max(len(a), len(b)))
+
+
+def check_quality(baseline, optimized, cases, seed=0):
+    """Synthesize every case on both instances; returns one result dict per case."""
+    import infer_stages
+    from cond_cache import compute_cond_mel
+
+    kwargs = {"do_sample": False}
+    results = []
+    for tts in (baseline, optimized):
+        # the first call compiles BigVGAN; keep it out of the timings
+        warm_up_ids = infer_stages.sentence_token_ids(tts, infer_stages.split_text(tts, cases[0]["text"]))[:1]
+        infer_stages.synthesize_batch(tts, compute_cond_mel(cases[0]["prompt_audio"]), warm_up_ids, **kwargs)
+    for case in cases:
+        cond_mel = compute_cond_mel(case["prompt_audio"])
+        token_ids = infer_stages.sentence_token_ids(baseline, infer_stages.split_text(baseline, case["text"]))
+        outputs, seconds = {}, {}
+        for name, tts in (("fp32", baseline), ("optimized", optimized)):
+            start = time.perf_counter()
+            wavs = infer_stages.synthesize_batch(tts, cond_mel, token_ids, seed=seed, **kwargs)
+            seconds[name] = time.perf_counter() - start
+            outputs[name] = torch.cat(wavs, dim=1)
+        # vocoder alone, on the latents of the fp32 GPT
+        text_tokens, codes, code_lens = infer_stages.generate_codes(baseline, cond_mel, token_ids[:1], **kwargs)
+        latent = infer_stages.codes_to_latent(baseline, cond_mel, text_tokens[0],
+                                              codes[:1, :int(code_lens[0].item())], code_lens[:1])
+        vocoded = [log_mel_db(infer_stages.vocode(tts, cond_mel, latent)) for tts in (baseline, optimized)]
+        results.append({
+            "id": case.get("id"),
+            "fp32_s": round(seconds["fp32"], 3),
+            "optimized_s": round(seconds["optimized"], 3),
+            "speedup": round(seconds["fp32"] / seconds["optimized"], 2),
+            "duration_ratio": round(outputs["optimized"].shape[-1] / outputs["fp32"].shape[-1], 3),
+            "distance_db": round(dtw_spectral_distance(log_mel_db(outputs["fp32"]), log_mel_db(outputs["optimized"])), 3),
+            "vocoder_distance_db": round(spectral_distance(*vocoded), 3),
+        })
+    return results
+
+
+def main(argv=None):
+    from model_pool import load_index_tts
+
+    parser = argparse.ArgumentParser(description="Compare a CPU performance mode against fp32 output")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("--cases", type=str, default=os.path.join("tests", "cases.jsonl"), help="JSONL cases (prompt_audio/text)")
+    parser.add_argument("--cpu_mode", type=str, default="full", choices=CPU_MODES[1:], help="Mode to evaluate")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = torch default)")
+    parser.add_argument("--max_distance_db", type=float, default=3.0, help="Fail when the end-to-end log-mel distance exceeds this")
+    parser.add_argument("--max_vocoder_distance_db", type=float, default=1.0, help="Fail when the vocoder-only distance exceeds this")
+    parser.add_argument("--out", type=str, default="cpu_quality.json", help="Where to write the per-case report")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    cases = []
+    with open(args.cases, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                case = json.loads(line)
+                case["prompt_audio"] = os.path.join(os.path.dirname(args.cases), case.get("prompt_audio", "sample_prompt.wav"))
+                case.setdefault("id", i)
+                cases.append(case)
+    baseline = load_index_tts(args.model_dir, "cpu")
+    optimized = optimize(load_index_tts(args.model_dir, "cpu"), args.cpu_mode)
+    results = check_quality(baseline, optimized, cases)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"cpu_mode": args.cpu_mode, "cases": results}, f, ensure_ascii=False, indent=2)
+    failed = 0
+    for r in results:
+        ok = r["distance_db"] <= args.max_distance_db and r["vocoder_distance_db"] <= args.max_vocoder_distance_db
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} case {r['id']}: 加速 {r['speedup']}x, 频谱距离 {r['distance_db']} dB, "
+              f"声码器 {r['vocoder_distance_db']} dB, 时长比 {r['duration_ratio']}")
+    print(f"📊 平均加速 {np.mean([r['speedup'] for r in results]):.2f}x，报告已写入 {args.out}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""Stage-level helpers over an ``IndexTTS`` instance.
+
+``IndexTTS.infer``/``infer_fast`` run text splitting, GPT decoding, latent
+extraction and BigVGAN vocoding as one opaque call. The WebUI extensions need
+those stages separately (cross-request batching, streaming, ...), so this
+module mirrors the per-sentence code path of ``infer_fast`` stage by stage.
+"""
+import struct
+import threading
+import time
+import wave
+import zlib
+from contextlib import contextmanager
+
+import torch
+import torchaudio
+
+SAMPLING_RATE = 24000
+SILENT_TOKEN = 52
+MAX_CONSECUTIVE_SILENCE = 30
+
+GENERATION_DEFAULTS = {
+    "do_sample": True,
+    "top_p": 0.8,
+    "top_k": 30,
+    "temperature": 1.0,
+    "length_penalty": 0.0,
+    "num_beams": 3,
+    "repetition_penalty": 10.0,
+    "max_mel_tokens": 600,
+}
+
+
+def _autocast(tts):
+    return torch.amp.autocast(torch.device(tts.device).type, enabled=tts.dtype is not None, dtype=tts.dtype)
+
+
+def split_text(tts, text, max_text_tokens_per_sentence=120):
+    """Tokenize ``text`` and split it into sentences of BPE tokens."""
+    text_tokens_list = tts.tokenizer.tokenize(text)
+    return tts.tokenizer.split_sentences(text_tokens_list, max_tokens_per_sentence=int(max_text_tokens_per_sentence))
+
+
+def sentence_token_ids(tts, sentences):
+    """Convert split sentences (lists of BPE pieces) to lists of token ids."""
+    return [tts.tokenizer.convert_tokens_to_ids(sent) for sent in sentences]
+
+
+def generate_codes(tts, cond_mel, token_id_lists, **generation_kwargs):
+    """Run GPT autoregressive decoding for a batch of sentences sharing one voice.
+
+    Returns ``(text_tokens, codes, code_lens)`` where ``text_tokens`` is a list
+    of ``[1, L]`` tensors and ``codes`` is the silence-trimmed ``[B, T]`` batch.
+    """
+    kwargs = dict(GENERATION_DEFAULTS)
+    kwargs.update(generation_kwargs)
+    max_mel_tokens = kwargs.pop("max_mel_tokens")
+    text_tokens = [
+        torch.tensor(ids, dtype=torch.int32, device=tts.device).unsqueeze(0)
+        for ids in token_id_lists
+    ]
+    batch_text_tokens = tts.pad_tokens_cat(text_tokens) if len(text_tokens) > 1 else text_tokens[0]
+    with torch.no_grad():
+        with _autocast(tts):
+            codes = tts.gpt.inference_speech(
+                cond_mel, batch_text_tokens,
+                cond_mel_lengths=torch.tensor([cond_mel.shape[-1]], device=cond_mel.device),
+                num_return_sequences=1,
+                max_generate_length=max_mel_tokens,
+                **kwargs,
+            )
+    codes, code_lens = tts.remove_long_silence(codes, silent_token=SILENT_TOKEN,
+                                               max_consecutive=MAX_CONSECUTIVE_SILENCE)
+    return text_tokens, codes, code_lens
+
+
+def codes_to_latent(tts, cond_mel, text_tokens, codes, code_len):
+    """GPT forward pass turning one sentence's codes into vocoder latents."""
+    with torch.no_grad():
+        with _autocast(tts):
+            return tts.gpt(
+                cond_mel, text_tokens,
+                torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
+                codes, code_len * tts.gpt.mel_length_compression,
+                cond_mel_lengths=torch.tensor([cond_mel.shape[-1]], device=text_tokens.device),
+                return_latent=True, clip_inputs=False,
+            )
+
+
+def vocode(tts, cond_mel, latent):
+    """BigVGAN vocoding; returns a ``[1, N]`` CPU tensor scaled to the int16 range."""
+    with torch.no_grad():
+        with _autocast(tts):
+            wav, _ = tts.bigvgan(latent, cond_mel.transpose(1, 2))
+            wav = wav.squeeze(1)
+    wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
+    return wav.float().cpu()
+
+
+def sentence_seed(seed, ids):
+    """Seed for one sentence derived from the request seed and the sentence itself.
+
+    Seeding per sentence (rather than once per request) makes a sentence's audio
+    independent of its position, so it can be cached and reused on its own.
+    """
+    return (int(seed) * 1000003 + zlib.crc32(",".join(map(str, ids)).encode("ascii"))) % (1 << 32)
+
+
+def synthesize_batch(tts, cond_mel, token_id_lists, seed=None, **generation_kwargs):
+    """Synthesize several sentences of one voice with a single GPT decoding batch.
+
+    With a ``seed`` every sentence is sampled from its own ``sentence_seed``, so
+    its audio does not depend on the rows it shares a batch with; a batch draws
+    from one random stream, so seeded sampling decodes the rows one at a time.
+    """
+    cond_mel = cond_mel.to(tts.device)
+    if seed is not None and len(token_id_lists) > 1 and generation_kwargs.get("do_sample", True):
+        return [wav for ids in token_id_lists
+                for wav in synthesize_batch(tts, cond_mel, [ids], seed=seed, **generation_kwargs)]
+    if seed is not None:
+        torch.manual_seed(sentence_seed(seed, token_id_lists[0]))
+    text_tokens, codes, code_lens = generate_codes(tts, cond_mel, token_id_lists, **generation_kwargs)
+    wavs = []
+    for i, tokens in enumerate(text_tokens):
+        code_len = code_lens[i:i + 1]
+        row_codes = codes[i:i + 1, :int(code_len.item())]
+        latent = codes_to_latent(tts, cond_mel, tokens, row_codes, code_len)
+        wavs.append(vocode(tts, cond_mel, latent))
+    return wavs
+
+
+def iter_sentence_wavs(tts, cond_mel, token_id_lists, seed=None, **generation_kwargs):
+    """Yield each sentence's waveform as soon as it has been vocoded."""
+    cond_mel = cond_mel.to(tts.device)
+    for ids in token_id_lists:
+        yield synthesize_batch(tts, cond_mel, [ids], seed=seed, **generation_kwargs)[0]
+
+
+def synthesize_buckets(tts, cond_mel, token_id_lists, bucket_size, seed=None, **generation_kwargs):
+    """``infer_fast``-style bucketing of given sentences: length-sorted batches of
+    ``bucket_size``; returns the waveforms in input order."""
+    cond_mel = cond_mel.to(tts.device)
+    order = sorted(range(len(token_id_lists)), key=lambda i: len(token_id_lists[i]))
+    size = max(1, int(bucket_size))
+    wavs = [None] * len(token_id_lists)
+    for start in range(0, len(order), size):
+        tts._set_gr_progress(start / len(order), f"合成分句 {start + 1}/{len(order)}")
+        bucket = order[start:start + size]
+        for i, wav in zip(bucket, synthesize_batch(tts, cond_mel, [token_id_lists[i] for i in bucket], seed=seed,
+                                                   **generation_kwargs)):
+            wavs[i] = wav
+    return wavs
+
+
+class StageTimer:
+    """Accumulates wall time per stage inside a worker.
+
+    CUDA work is asynchronous, so the current stream is synchronized at span
+    edges to attribute GPU time to the stage that launched it. Only the current
+    stream is waited on, so stages running concurrently on other streams (see
+    ``long_form``) keep overlapping; spans may be recorded from several threads.
+    """
+
+    def __init__(self, device):
+        self.cuda = torch.device(device).type == "cuda"
+        self.started_at = time.time()
+        self.spans = {}
+        self.gpt_tokens = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        if self.cuda:
+            torch.cuda.current_stream().synchronize()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.cuda:
+                torch.cuda.current_stream().synchronize()
+            with self._lock:
+                self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self):
+        with self._lock:
+            return {"started_at": self.started_at, "spans": dict(self.spans), "gpt_tokens": self.gpt_tokens}
+
+
+class _TimedModule:
+    """Proxy that times calls to a module, and to some of its methods, into a ``StageTimer``."""
+
+    def __init__(self, module, timer, call_span, method_spans=None):
+        self._module = module
+        self._timer = timer
+        self._call_span = call_span
+        self._method_spans = method_spans or {}
+
+    def __call__(self, *args, **kwargs):
+        with self._timer.span(self._call_span):
+            return self._module(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._module, name)
+        span = self._method_spans.get(name)
+        if span is None:
+            return attr
+
+        def timed(*args, **kwargs):
+            with self._timer.span(span):
+                out = attr(*args, **kwargs)
+            if span == "gpt_decode" and torch.is_tensor(out):
+                self._timer.gpt_tokens += out.numel()
+            return out
+        return timed
+
+
+@contextmanager
+def instrument(tts, timer):
+    """Time GPT decoding, the GPT latent pass and BigVGAN for calls made on ``tts``.
+
+    Works for ``tts.infer``/``infer_fast`` as well as the stage functions above,
+    since both reach the models through ``tts.gpt`` and ``tts.bigvgan``.
+    """
+    gpt, bigvgan = tts.gpt, tts.bigvgan
+    tts.gpt = _TimedModule(gpt, timer, "gpt_latent", {"inference_speech": "gpt_decode"})
+    tts.bigvgan = _TimedModule(bigvgan, timer, "vocoder")
+    try:
+        yield timer
+    finally:
+        tts.gpt, tts.bigvgan = gpt, bigvgan
+
+
+def run_traced(tts, fn, *args, **kwargs):
+    """Run the work unit ``fn(tts, ...)`` with stage timing; returns ``(result, timings)``."""
+    timer = StageTimer(tts.device)
+    with instrument(tts, timer):
+        result = fn(tts, *args, **kwargs)
+    return result, timer.report()
+
+
+def stream_traced(tts, fn, *args, **kwargs):
+    """Generator counterpart of ``run_traced``: yields ``("item", x)`` pairs, then ``("timings", report)``."""
+    timer = StageTimer(tts.device)
+    with instrument(tts, timer):
+        for item in fn(tts, *args, **kwargs):
+            yield "item", item
+    yield "timings", timer.report()
+
+
+def prepare_instance(tts, cpu_mode="none", prefix_cache_mb=0):
+    """WebUI setup of a loaded instance: CPU mode (``cpu_perf``) and prefix cache (``prefix_cache``).
+
+    Runs in the worker that owns the instance; bind the options with
+    ``functools.partial`` so worker processes can unpickle it.
+    """
+    if cpu_mode != "none":
+        import cpu_perf
+
+        cpu_perf.optimize(tts, mode=cpu_mode)
+    if prefix_cache_mb > 0:
+        import prefix_cache
+
+        prefix_cache.enable(tts, prefix_cache_mb)
+    return tts
+
+
+class _PretokenizedTokenizer:
+    """Tokenizer proxy answering ``tokenize(text)`` from tokens computed earlier."""
+
+    def __init__(self, tokenizer, text, tokens):
+        self._tokenizer = tokenizer
+        self._text = text
+        self._tokens = tokens
+
+    def tokenize(self, text):
+        if text == self._text:
+            return list(self._tokens)
+        return self._tokenizer.tokenize(text)
+
+    def __getattr__(self, name):
+        return getattr(self._tokenizer, name)
+
+
+def run_infer(tts, method, prompt_path, cond_mel, text, output_path, text_tokens=None, **kwargs):
+    """Call ``tts.infer``/``tts.infer_fast`` with a precomputed conditioning mel.
+
+    IndexTTS reuses ``cache_cond_mel`` whenever ``cache_audio_prompt`` equals the
+    prompt it is given, so seeding both skips re-encoding the reference clip.
+    ``text_tokens`` (e.g. from the sentence preview) spares a second tokenization.
+    Seeded requests do not come here: ``tts.infer`` draws all sentences from one
+    random stream, which ``sentence_seed`` cannot reach.
+    """
+    tts.cache_cond_mel = cond_mel.to(tts.device)
+    tts.cache_audio_prompt = prompt_path
+    if text_tokens is None:
+        return getattr(tts, method)(prompt_path, text, output_path, **kwargs)
+    tokenizer = tts.tokenizer
+    tts.tokenizer = _PretokenizedTokenizer(tokenizer, text, text_tokens)
+    try:
+        return getattr(tts, method)(prompt_path, text, output_path, **kwargs)
+    finally:
+        tts.tokenizer = tokenizer
+
+
+def save_wav(path, wavs):
+    """Concatenate ``[1, N]`` int16-range tensors and write them as a 16-bit WAV."""
+    wav = torch.cat(wavs, dim=1) if len(wavs) > 1 else wavs[0]
+    torchaudio.save(path, wav.type(torch.int16), SAMPLING_RATE)
+    return path
+
+
+def wav_seconds(path):
+    """Duration of a PCM WAV file in seconds, from its header."""
+    with wave.open(path, "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+def read_pcm16(path):
+    """Raw PCM frames of a 16-bit WAV file."""
+    with wave.open(path, "rb") as f:
+        return f.readframes(f.getnframes())
+
+
+def to_pcm16(wav):
+    """``[1, N]`` int16-range tensor -> 1-D int16 numpy array."""
+    return wav.squeeze(0).type(torch.int16).numpy()
+
+
+def wav_stream_header(sample_rate=SAMPLING_RATE, channels=1, bits_per_sample=16):
+    """RIFF/WAVE header with unknown (0xFFFFFFFF) sizes, for chunked streaming."""
+    block_align = channels * bits_per_sample // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 0xFFFFFFFF, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits_per_sample,
+        b"data", 0xFFFFFFFF,
+    )
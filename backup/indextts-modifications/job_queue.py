@@ -0,0 +1,326 @@
+"""Persistent synthesis job queue with priority classes and cancellation.
+
+``demo.queue(20)`` is an in-memory FIFO: jobs vanish on restart, a short
+interactive request waits behind a long-form job, and an abandoned tab keeps its
+job running. Jobs are now rows of a SQLite table. Interactive jobs always run
+before bulk ones, and among interactive jobs the shortest estimated one goes
+first (bulk jobs stay FIFO). Jobs that were running when the process stopped are
+queued again on start.
+
+A job is cancelled by flagging it: the progress callback handed to the runner
+raises ``JobCancelled`` on its next report, which every synthesis path makes at
+least once per sentence, so in-flight generation stops at a sentence boundary.
+
+Queue position and estimated start time come from the history of finished
+jobs: audio seconds per text character and the real-time factor. They are
+computed for the whole queue in one pass at most every ``POSITION_REFRESH_S``,
+and a waiter is only woken by changes of its own job, so many polling clients
+do not each re-run the queue queries on every progress report.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+PRIORITIES = {"interactive": 0, "bulk": 1}
+ACTIVE = ("queued", "running")
+DEFAULT_SECONDS_PER_CHAR = 0.25
+DEFAULT_RTF = 1.0
+HISTORY = 200  # finished jobs the estimates are computed from
+POSITION_REFRESH_S = 1.0
+
+_COLUMNS = ("id", "priority", "status", "payload", "text_chars", "est_seconds", "created_at", "started_at",
+            "finished_at", "progress", "stage", "result_path", "error", "audio_seconds", "run_seconds")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    text_chars INTEGER NOT NULL,
+    est_seconds REAL NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    progress REAL NOT NULL DEFAULT 0,
+    stage TEXT NOT NULL DEFAULT '',
+    result_path TEXT,
+    error TEXT,
+    audio_seconds REAL,
+    run_seconds REAL
+)
+"""
+# interactive first, shortest first within interactive, then arrival order
+_DISPATCH_ORDER = "ORDER BY priority, CASE WHEN priority = 0 THEN est_seconds ELSE 0 END, created_at"
+
+
+class JobCancelled(RuntimeError):
+    """Raised inside a running job once it has been cancelled."""
+
+
+class JobQueue:
+    """SQLite-backed queue drained by ``concurrency`` runner threads.
+
+    ``run_fn(job, progress)`` synthesizes one job and returns ``(result_path,
+    audio_seconds)``; ``progress(value, desc=None)`` raises ``JobCancelled`` once
+    the job was cancelled. ``result_path`` may also be a ``Future`` of it (e.g.
+    an encode still running): the runner moves on and the job finishes when the
+    future does. Exceptions listed in ``retry_on`` (e.g. a full model pool) put
+    the job back in the queue instead of failing it.
+    """
+
+    def __init__(self, db_path, run_fn, retry_on=(), poll_interval=0.5):
+        self.run_fn = run_fn
+        self.retry_on = tuple(retry_on)
+        self.poll_interval = poll_interval
+        self.concurrency = 1
+        self._lock = threading.RLock()
+        self._queued = threading.Condition(self._lock)  # runners wait here for submissions
+        self._watchers = {}  # job id -> [Condition, waiters] of ``wait`` calls on that job
+        self._positions = {}  # queued job id -> (position, eta_s), see ``_queue_position``
+        self._positions_at = float("-inf")
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority)")
+        self._db.commit()
+        self._cancel = {}  # running job id -> threading.Event
+        self._progress = {}  # running job id -> (value, stage)
+        self._stopped = threading.Event()
+        self._threads = []
+        self._rates = (DEFAULT_SECONDS_PER_CHAR, DEFAULT_RTF)
+        self._refresh_rates()
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self, concurrency=1):
+        """Requeue jobs interrupted by a restart and start the runner threads."""
+        self.concurrency = max(1, int(concurrency))
+        with self._lock:
+            requeued = self._db.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, progress = 0, stage = '' "
+                "WHERE status = 'running'").rowcount
+            self._db.commit()
+        if requeued:
+            print(f"🔁 重新排队 {requeued} 个中断的任务")
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run_loop, daemon=True, name=f"job-runner-{i}")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._queued:
+            for event in self._cancel.values():
+                event.set()
+            self._queued.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def prune(self, max_age_s):
+        """Forget finished jobs older than ``max_age_s``."""
+        if max_age_s <= 0:
+            return 0
+        with self._lock:
+            removed = self._db.execute("DELETE FROM jobs WHERE status NOT IN (?, ?) AND finished_at < ?",
+                                       (*ACTIVE, time.time() - max_age_s)).rowcount
+            self._db.commit()
+        return removed
+
+    # -- submission and control ------------------------------------------
+
+    def submit(self, payload, text_chars, priority="interactive"):
+        job_id = uuid.uuid4().hex
+        est_seconds = text_chars * self._rates[0]
+        with self._queued:
+            self._db.execute(
+                "INSERT INTO jobs (id, priority, status, payload, text_chars, est_seconds, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, PRIORITIES[priority], json.dumps(payload, ensure_ascii=False), int(text_chars),
+                 est_seconds, time.time()))
+            self._db.commit()
+            self._queued.notify_all()
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or stop a running one at its next sentence; False if already finished."""
+        with self._lock:
+            row = self._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[0] not in ACTIVE:
+                return False
+            cancelled = self._cancel.get(job_id)
+            if cancelled is not None:
+                cancelled.set()
+            else:
+                # queued, or left running by a crash and not requeued by ``start`` yet
+                self._finish(job_id, "cancelled")
+            return True
+
+    # -- status ----------------------------------------------------------
+
+    def get(self, job_id):
+        """Job as a dict, with ``position`` and ``eta_s`` (estimated start) while queued."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(_COLUMNS, row))
+            job["payload"] = json.loads(job["payload"])
+            job["priority"] = next(name for name, value in PRIORITIES.items() if value == job["priority"])
+            if job["id"] in self._progress:
+                job["progress"], job["stage"] = self._progress[job["id"]]
+            if job["status"] == "queued":
+                job["position"], job["eta_s"] = self._queue_position(job_id)
+        return job
+
+    def wait(self, job_id, timeout):
+        """``get`` after the job changed or ``timeout`` passed, whichever comes first.
+
+        Only changes of this job (start, progress, finish) wake the caller; a
+        queued job's position is picked up at the timeout.
+        """
+        with self._lock:
+            watcher = self._watchers.setdefault(job_id, [threading.Condition(self._lock), 0])
+            watcher[1] += 1
+            try:
+                watcher[0].wait(timeout)
+            finally:
+                watcher[1] -= 1
+                if not watcher[1]:
+                    del self._watchers[job_id]
+        return self.get(job_id)
+
+    def _notify(self, job_id):
+        # callers hold self._lock
+        watcher = self._watchers.get(job_id)
+        if watcher is not None:
+            watcher[0].notify_all()
+
+    def _queue_position(self, job_id):
+        """``(position, eta_s)`` of a queued job from a snapshot of the whole queue.
+
+        The snapshot is refreshed at most every ``POSITION_REFRESH_S`` (the ETAs
+        drift), and right away once a job started or finished or when the job was
+        submitted after it was taken.
+        """
+        now = time.monotonic()
+        if job_id not in self._positions or now - self._positions_at > POSITION_REFRESH_S:
+            self._positions = self._compute_positions()
+            self._positions_at = now
+        return self._positions.get(job_id, (0, 0.0))
+
+    def _compute_positions(self):
+        seconds_per_char, rtf = self._rates
+        now = time.time()
+        # time the running jobs still need, then every job dispatched before each queued one
+        busy = sum(max(0.0, est * rtf - (now - started)) for est, started in self._db.execute(
+            "SELECT est_seconds, started_at FROM jobs WHERE status = 'running'"))
+        positions = {}
+        queued = self._db.execute(f"SELECT id, est_seconds FROM jobs WHERE status = 'queued' {_DISPATCH_ORDER}")
+        for ahead, (job_id, est) in enumerate(queued):
+            positions[job_id] = (ahead, round(busy / self.concurrency, 1))
+            busy += est * rtf
+        return positions
+
+    def _refresh_rates(self):
+        with self._lock:
+            chars, audio, run = self._db.execute(
+                "SELECT SUM(text_chars), SUM(audio_seconds), SUM(run_seconds) FROM ("
+                "SELECT text_chars, audio_seconds, run_seconds FROM jobs "
+                "WHERE status = 'done' AND audio_seconds > 0 ORDER BY finished_at DESC LIMIT ?)", (HISTORY,)).fetchone()
+        if chars and audio:
+            self._rates = (audio / chars, run / audio)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        seconds_per_char, rtf = self._rates
+        return {**counts, "seconds_per_char": round(seconds_per_char, 4), "rtf": round(rtf, 3),
+                "concurrency": self.concurrency}
+
+    # -- runners ---------------------------------------------------------
+
+    def _claim(self):
+        with self._lock:
+            row = self._db.execute(f"SELECT id FROM jobs WHERE status = 'queued' {_DISPATCH_ORDER} LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), row[0]))
+            self._db.commit()
+            self._cancel[row[0]] = threading.Event()
+            self._progress[row[0]] = (0.0, "")
+            self._positions_at = float("-inf")
+            self._notify(row[0])
+        return self.get(row[0])
+
+    def _finish(self, job_id, status, **fields):
+        with self._lock:
+            last = self._progress.pop(job_id, None)
+            fields = {"status": status, "finished_at": time.time(),
+                      **({"progress": last[0], "stage": last[1]} if last else {}), **fields}
+            self._cancel.pop(job_id, None)
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+            self._positions_at = float("-inf")
+            self._notify(job_id)
+
+    def _run_loop(self):
+        while not self._stopped.is_set():
+            job = self._claim()
+            if job is None:
+                with self._queued:
+                    self._queued.wait(self.poll_interval)
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job_id = job["id"]
+        cancelled = self._cancel[job_id]
+
+        def progress(value, desc=None):
+            if cancelled.is_set():
+                raise JobCancelled(f"job {job_id} cancelled")
+            with self._lock:
+                self._progress[job_id] = (float(value or 0.0), desc or "")
+                self._notify(job_id)
+
+        start = time.perf_counter()
+        try:
+            result_path, audio_seconds = self.run_fn(job, progress)
+        except JobCancelled:
+            self._finish(job_id, "cancelled")
+        except self.retry_on:
+            with self._lock:
+                self._cancel.pop(job_id, None)
+                self._progress.pop(job_id, None)
+                self._db.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE id = ?", (job_id,))
+                self._db.commit()
+                self._positions_at = float("-inf")
+                self._notify(job_id)
+            self._stopped.wait(self.poll_interval)
+        except Exception as e:
+            self._finish(job_id, "failed", error=f"{type(e).__name__}: {e}")
+        else:
+            run_seconds = time.perf_counter() - start
+            if isinstance(result_path, Future):
+                result_path.add_done_callback(
+                    lambda future: self._complete(job_id, cancelled, future, audio_seconds, run_seconds))
+            else:
+                self._complete(job_id, cancelled, result_path, audio_seconds, run_seconds)
+
+    def _complete(self, job_id, cancelled, result_path, audio_seconds, run_seconds):
+        if isinstance(result_path, Future):
+            try:
+                result_path = result_path.result()
+            except Exception as e:
+                self._finish(job_id, "failed", error=f"{type(e).__name__}: {e}")
+                return
+        if cancelled.is_set():
+            self._finish(job_id, "cancelled")
+            return
+        self._finish(job_id, "done", result_path=result_path, audio_seconds=audio_seconds, run_seconds=run_seconds,
+                     progress=1.0)
+        self._refresh_rates()
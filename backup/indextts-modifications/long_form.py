@@ -0,0 +1,315 @@
+"""Pipelined long-form synthesis with chapter checkpoints.
+
+``infer``/``infer_fast`` finish GPT decoding before BigVGAN runs and keep every
+sentence's audio in memory until the end, which does not scale to book-length
+texts. Here GPT decodes sentence k+1 while a vocoder thread renders sentence k
+(on its own CUDA stream), and sentences are crossfaded straight into the output
+WAV so only a few latents and one fade tail are held at a time.
+
+Documents are split into chapters, each synthesized into its own checkpoint
+file under a job directory keyed by the request; re-running a failed document
+skips the chapters already on disk and only the final assembly re-reads them.
+"""
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import wave
+
+import numpy as np
+import torch
+
+from infer_stages import SAMPLING_RATE, codes_to_latent, generate_codes, sentence_seed, vocode
+
+CHAPTER_CHARS = 4000
+CROSSFADE_S = 0.01
+CHAPTER_PAUSE_S = 0.6
+PIPELINE_DEPTH = 2  # latents decoded ahead of the vocoder
+COPY_FRAMES = 1 << 16
+
+CHAPTER_HEADING = re.compile(r"^\s*(第[0-9零一二三四五六七八九十百千]+[章节回卷]|chapter\s+\w+)", re.IGNORECASE)
+
+
+# a sentence runs up to its closing punctuation and any quotes after it; a "." only ends one before a space
+_SENTENCE = re.compile(r".*?(?:[。！？!?；;…]+|\.(?=\s|$))[”’」』\"'）)]*\s*|.+", re.S)
+
+
+def _line_pieces(line, max_chars):
+    """``line``, or when it exceeds ``max_chars`` its sentences, hard-cut when a sentence is still too long."""
+    if len(line) <= max_chars:
+        return [line]
+    pieces = []
+    for sentence in _SENTENCE.findall(line):
+        while len(sentence) > max_chars:
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def split_chapters(text, max_chars=CHAPTER_CHARS):
+    """Split a document at chapter headings, and into chunks of at most ``max_chars``.
+
+    Chunks end at line breaks; text without them (pasted paragraphs, web pages)
+    is cut at sentence ends, and a single sentence longer than ``max_chars`` at
+    ``max_chars`` characters.
+    """
+    chapters = []
+    current = ""
+    for line in text.split("\n"):
+        if not line.strip():
+            continue
+        for i, piece in enumerate(_line_pieces(line, max_chars)):
+            # pieces of one line join back without a break
+            sep = "\n" if i == 0 else ""
+            if current and ((i == 0 and CHAPTER_HEADING.match(line)) or len(current) + len(sep) + len(piece) > max_chars):
+                chapters.append(current)
+                current = piece
+            else:
+                current = f"{current}{sep}{piece}" if current else piece
+    if current:
+        chapters.append(current)
+    return chapters
+
+
+class CrossfadeWriter:
+    """Append ``[1, N]`` int16-range sentences to a 16-bit WAV with a short crossfade.
+
+    Only the last ``crossfade_s`` of audio is buffered. The file is written under
+    a temporary name and moved into place by ``close``, so a path that exists is
+    always complete.
+    """
+
+    def __init__(self, path, sample_rate=SAMPLING_RATE, crossfade_s=CROSSFADE_S):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.fade = int(sample_rate * crossfade_s)
+        self.frames = 0
+        # identical concurrent requests write the same checkpoint paths
+        self._tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}.wav"
+        self._file = wave.open(self._tmp_path, "wb")
+        self._file.setnchannels(1)
+        self._file.setsampwidth(2)
+        self._file.setframerate(sample_rate)
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def write_raw(self, samples):
+        """Append 1-D int16-range samples as they are, without crossfading."""
+        if samples.size:
+            self._file.writeframes(np.clip(samples, -32767, 32767).astype("<i2").tobytes())
+            self.frames += samples.size
+
+    def write(self, wav):
+        samples = wav.squeeze(0).float().numpy()
+        n = min(self.fade, self._tail.size, samples.size)
+        if n:
+            ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+            head = self._tail[-n:] * (1.0 - ramp) + samples[:n] * ramp
+            self.write_raw(np.concatenate([self._tail[:-n], head]))
+            samples = samples[n:]
+        else:
+            self.write_raw(self._tail)
+        keep = min(self.fade, samples.size)
+        self.write_raw(samples[:samples.size - keep])
+        self._tail = samples[samples.size - keep:]
+
+    def write_silence(self, seconds):
+        self.write_raw(self._tail)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self.write_raw(np.zeros(int(self.sample_rate * seconds), dtype=np.float32))
+
+    def close(self):
+        self.write_raw(self._tail)
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def synthesize_pipelined(tts, cond_mel, token_id_lists, output_path, seed=None, crossfade_s=CROSSFADE_S,
+                         **generation_kwargs):
+    """Synthesize sentences into ``output_path``, overlapping GPT decoding with vocoding.
+
+    Runs inside a model worker. GPT work (decoding and the latent pass) stays on
+    the calling thread; BigVGAN runs on a second thread fed through a bounded
+    queue, so at most ``PIPELINE_DEPTH`` latents wait for the vocoder.
+    """
+    cond_mel = cond_mel.to(tts.device)
+    cuda = torch.device(tts.device).type == "cuda"
+    latents = queue.Queue(maxsize=PIPELINE_DEPTH)
+    errors = []
+    writer = CrossfadeWriter(output_path, crossfade_s=crossfade_s)
+
+    def vocoder_loop():
+        stream = torch.cuda.Stream(device=tts.device) if cuda else None
+        while True:
+            item = latents.get()
+            if item is None:
+                return
+            if errors:
+                continue  # keep draining so the producer never blocks
+            latent, ready = item
+            try:
+                if stream is None:
+                    wav = vocode(tts, cond_mel, latent)
+                else:
+                    stream.wait_event(ready)
+                    latent.record_stream(stream)
+                    with torch.cuda.stream(stream):
+                        wav = vocode(tts, cond_mel, latent)
+                writer.write(wav)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=vocoder_loop, daemon=True, name="long-form-vocoder")
+    thread.start()
+    try:
+        for i, ids in enumerate(token_id_lists):
+            if errors:
+                break
+            # also the cancellation point of queued jobs (see job_queue)
+            tts._set_gr_progress(i / len(token_id_lists), f"合成分句 {i + 1}/{len(token_id_lists)}")
+            if seed is not None:
+                torch.manual_seed(sentence_seed(seed, ids))
+            text_tokens, codes, code_lens = generate_codes(tts, cond_mel, [ids], **generation_kwargs)
+            code_len = code_lens[:1]
+            latent = codes_to_latent(tts, cond_mel, text_tokens[0], codes[:1, :int(code_len.item())], code_len)
+            ready = None
+            if cuda:
+                ready = torch.cuda.Event()
+                ready.record()
+            latents.put((latent, ready))
+    except BaseException:
+        latents.put(None)
+        thread.join()
+        writer.abort()
+        raise
+    latents.put(None)
+    thread.join()
+    if errors:
+        writer.abort()
+        raise errors[0]
+    return writer.close()
+
+
+class _SharedJob:
+    def __init__(self):
+        # one request synthesizes a document at a time; the others then reuse its chapters
+        self.lock = threading.Lock()
+        self.holders = 0
+        self.finished = False
+
+
+class ChapterCheckpoint:
+    """Job directory holding one finished WAV per chapter of a long-form request.
+
+    Identical requests share the directory (the key has no per-request part, so
+    a retry resumes). Use it as a context manager: each request holds it while
+    it runs, and the directory is removed once the document was assembled and
+    the last holder has let go.
+    """
+
+    _jobs = {}  # job directory -> _SharedJob of the requests holding it
+    _jobs_lock = threading.Lock()
+
+    def __init__(self, root, key):
+        self.dir = os.path.join(root, key)
+        with self._jobs_lock:
+            self._job = self._jobs.setdefault(self.dir, _SharedJob())
+            self._job.holders += 1
+        # created after registering, so a finishing holder cannot remove it underneath us
+        os.makedirs(self.dir, exist_ok=True)
+
+    @property
+    def lock(self):
+        return self._job.lock
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def release(self):
+        with self._jobs_lock:
+            self._job.holders -= 1
+            if self._job.holders:
+                return
+            del self._jobs[self.dir]
+            if self._job.finished:
+                shutil.rmtree(self.dir, ignore_errors=True)
+
+    def chapter_path(self, index):
+        return os.path.join(self.dir, f"chapter_{index:05d}.wav")
+
+    def done(self, index):
+        return os.path.exists(self.chapter_path(index))
+
+    def assemble(self, count, output_path, pause_s=CHAPTER_PAUSE_S):
+        """Concatenate the chapter files into ``output_path`` without loading them whole."""
+        writer = CrossfadeWriter(output_path, crossfade_s=0)
+        try:
+            for index in range(count):
+                if index:
+                    writer.write_silence(pause_s)
+                with wave.open(self.chapter_path(index), "rb") as f:
+                    while True:
+                        frames = f.readframes(COPY_FRAMES)
+                        if not frames:
+                            break
+                        writer.write_raw(np.frombuffer(frames, dtype="<i2").astype(np.float32))
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def remove(self):
+        """Remove the directory once no other request for the same document holds it."""
+        self._job.finished = True
+
+
+def prune_jobs(root, max_age_s):
+    """Remove checkpoint directories of abandoned jobs untouched for ``max_age_s``."""
+    if max_age_s <= 0 or not os.path.isdir(root):
+        return 0
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(root):
+        with ChapterCheckpoint._jobs_lock:
+            held = entry.path in ChapterCheckpoint._jobs
+        if entry.is_dir() and not held and now - entry.stat().st_mtime > max_age_s:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def synthesize_document(checkpoint, chapters, synthesize_chapter, output_path, progress=None):
+    """Run ``synthesize_chapter(index, text, chapter_path)`` for unfinished chapters, then assemble.
+
+    The checkpoint directory is removed once the document has been assembled.
+    An identical request already running goes first; its chapters are reused.
+    """
+    progress = progress or (lambda value, desc=None: None)
+    # progress is also the cancellation point while waiting
+    while not checkpoint.lock.acquire(timeout=1.0):
+        progress(0, desc="等待相同文档的请求完成")
+    try:
+        for index, text in enumerate(chapters):
+            if not checkpoint.done(index):
+                synthesize_chapter(index, text, checkpoint.chapter_path(index))
+            progress((index + 1) / len(chapters), desc=f"合成章节 {index + 1}/{len(chapters)}")
+        checkpoint.assemble(len(chapters), output_path)
+    finally:
+        checkpoint.lock.release()
+    checkpoint.remove()
+    return output_path
@@ -0,0 +1,179 @@
+"""Per-request timing traces and Prometheus metrics.
+
+Each synthesis request gets a ``RequestTrace`` collecting wall-time spans for
+its stages: tokenize/split, conditioning and queue wait measured in the WebUI,
+plus GPT decoding, GPT latent pass, vocoding and file write measured inside the
+model worker (see ``infer_stages.run_traced``). On completion the trace feeds
+histograms labelled by ``infer_mode`` and bucket size, exposed in the Prometheus
+text format at ``/metrics``, and is optionally appended to a JSON-lines trace log.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+TOKENS_PER_S_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600, 3200)
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = defaultdict(lambda: [[0] * len(self.buckets), 0.0, 0])  # labels -> [counts, sum, count]
+
+    def observe(self, value, **labels):
+        series = self._series[tuple(sorted(labels.items()))]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_label_str(labels + (('le', bound),))} {n}")
+            lines.append(f"{self.name}_bucket{_label_str(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_label_str(labels)} {total}")
+            lines.append(f"{self.name}_count{_label_str(labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._series = defaultdict(float)
+
+    def inc(self, value=1, **labels):
+        self._series[tuple(sorted(labels.items()))] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_label_str(labels)} {value}")
+        return lines
+
+
+class RequestTrace:
+    """Timing spans of one request; use as a context manager around the request."""
+
+    def __init__(self, metrics, infer_mode, bucket_size="1", max_text_tokens_per_sentence=None):
+        self.metrics = metrics
+        self.request_id = uuid.uuid4().hex[:16]
+        self.infer_mode = infer_mode
+        self.bucket_size = str(bucket_size)
+        self.max_text_tokens_per_sentence = max_text_tokens_per_sentence
+        self.spans = defaultdict(float)
+        self.gpt_tokens = 0
+        self.sentences = None
+        self.audio_seconds = 0.0
+        self.status = "ok"
+        self._started = time.perf_counter()
+        self._dispatched_at = None
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] += time.perf_counter() - start
+
+    def dispatch(self):
+        """Mark the moment work is handed to the pool, to measure queue wait."""
+        self._dispatched_at = time.time()
+
+    def add_worker_timings(self, timings):
+        """Merge the stage timings reported by ``infer_stages.run_traced``."""
+        for name, seconds in timings["spans"].items():
+            self.spans[name] += seconds
+        self.gpt_tokens += timings["gpt_tokens"]
+        if self._dispatched_at is not None:
+            self.spans["queue_wait"] += max(0.0, timings["started_at"] - self._dispatched_at)
+            self._dispatched_at = None
+
+    def mark_first_audio(self):
+        if "time_to_first_audio" not in self.spans:
+            self.spans["time_to_first_audio"] = time.perf_counter() - self._started
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.status = exc_type.__name__
+        self.metrics.observe(self, time.perf_counter() - self._started)
+        return False
+
+
+class Metrics:
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self.request_seconds = Histogram(
+            "indextts_request_seconds", "End-to-end synthesis request latency.", SECONDS_BUCKETS)
+        self.stage_seconds = Histogram(
+            "indextts_stage_seconds", "Time spent per inference stage within a request.", SECONDS_BUCKETS)
+        self.rtf = Histogram(
+            "indextts_rtf", "Real-time factor: processing time / audio duration.", RTF_BUCKETS)
+        self.gpt_tokens_per_second = Histogram(
+            "indextts_gpt_tokens_per_second", "GPT decoding throughput in mel tokens per second.", TOKENS_PER_S_BUCKETS)
+        self.requests = Counter("indextts_requests_total", "Synthesis requests by outcome.")
+        self.audio_seconds = Counter("indextts_audio_seconds_total", "Seconds of audio synthesized.")
+
+    def trace(self, infer_mode, bucket_size="1", max_text_tokens_per_sentence=None):
+        return RequestTrace(self, infer_mode, bucket_size, max_text_tokens_per_sentence)
+
+    def observe(self, trace, total):
+        labels = {"infer_mode": trace.infer_mode, "bucket_size": trace.bucket_size}
+        decode = trace.spans.get("gpt_decode", 0.0)
+        record = {
+            "ts": time.time(),
+            "request_id": trace.request_id,
+            "status": trace.status,
+            **labels,
+            "max_text_tokens_per_sentence": trace.max_text_tokens_per_sentence,
+            "sentences": trace.sentences,
+            "total_s": round(total, 4),
+            "audio_s": round(trace.audio_seconds, 3),
+            "rtf": round(total / trace.audio_seconds, 4) if trace.audio_seconds else None,
+            "gpt_tokens": trace.gpt_tokens,
+            "gpt_tokens_per_s": round(trace.gpt_tokens / decode, 1) if decode else None,
+            "spans": {name: round(seconds, 4) for name, seconds in trace.spans.items()},
+        }
+        with self._lock:
+            self.requests.inc(status=trace.status, infer_mode=trace.infer_mode)
+            if trace.status == "ok":
+                self.request_seconds.observe(total, **labels)
+                for name, seconds in trace.spans.items():
+                    self.stage_seconds.observe(seconds, stage=name, **labels)
+                if record["rtf"] is not None:
+                    self.rtf.observe(record["rtf"], **labels)
+                    self.audio_seconds.inc(trace.audio_seconds, infer_mode=trace.infer_mode)
+                if record["gpt_tokens_per_s"] is not None:
+                    self.gpt_tokens_per_second.observe(record["gpt_tokens_per_s"], **labels)
+            if self.trace_path:
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.request_seconds, self.stage_seconds, self.rtf,
+                           self.gpt_tokens_per_second, self.requests, self.audio_seconds):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
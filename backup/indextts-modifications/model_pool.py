@@ -0,0 +1,418 @@
+"""Model worker pool with least-load dispatch and a fail-fast admission limit.
+
+A single shared ``IndexTTS`` instance cannot serve concurrent Gradio jobs: the
+calls interleave on the same GPU state and race on ``tts.gr_progress``. The
+pool owns N instances, either as threads in this process (one per CUDA device)
+or as separate worker processes (to spread CPU inference over cores), and runs
+each unit of work on the least loaded one.
+
+Work units are module-level functions called as ``fn(tts, *args, **kwargs)``
+so they can be shipped to worker processes. A function returning a generator
+is streamed back item by item through ``ModelPool.stream``.
+
+Worker processes are fresh interpreters running this module (not forks: the
+WebUI has server and sweeper threads by then, and a model may be loaded from a
+request thread, so a forked child could inherit a lock held mid-fork). The
+``prepare`` hook is sent to them pickled, so it must be module level too.
+"""
+import inspect
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when the admission limit is reached."""
+
+
+class WorkerError(RuntimeError):
+    """Raised in the caller when a worker process fails a call."""
+
+
+REQUIRED_FILES = ("bigvgan_generator.pth", "bpe.model", "gpt.pth", "config.yaml")
+_MMAP_LOCK = threading.Lock()
+
+
+def missing_model_files(model_dir):
+    """Paths of the checkpoint files ``load_index_tts`` needs that ``model_dir`` lacks."""
+    return [os.path.join(model_dir, name) for name in REQUIRED_FILES
+            if not os.path.exists(os.path.join(model_dir, name))]
+
+
+@contextmanager
+def mmap_weights():
+    """Have ``torch.load`` memory-map checkpoints while a model is constructed.
+
+    The weights are copied from the page cache into the modules instead of being
+    read into a second in-memory copy first, so loading peaks lower, and loading
+    a checkpoint again (e.g. after the registry evicted it) is mostly a copy
+    from pages the kernel still holds. Legacy non-zip checkpoints cannot be
+    mapped and load as before.
+    """
+    import torch
+
+    with _MMAP_LOCK:
+        original = torch.load
+
+        def load(f, *args, **kwargs):
+            # only files on disk can be mapped
+            if "mmap" not in kwargs and isinstance(f, (str, os.PathLike)):
+                try:
+                    return original(f, *args, mmap=True, **kwargs)
+                except (RuntimeError, TypeError, ValueError):
+                    pass
+            return original(f, *args, **kwargs)
+
+        torch.load = load
+        try:
+            yield
+        finally:
+            torch.load = original
+
+
+def load_index_tts(model_dir, device=None, prepare=None):
+    """Load one instance; ``prepare(tts)`` (e.g. ``cpu_perf.optimize``) may transform it in place."""
+    from indextts.infer import IndexTTS
+
+    with mmap_weights():
+        tts = IndexTTS(model_dir=model_dir, cfg_path=os.path.join(model_dir, "config.yaml"), device=device)
+    if prepare is not None:
+        prepare(tts)
+    return tts
+
+
+class TextFrontend:
+    """Tokenizer and config of a checkpoint, without loading any weights.
+
+    Used as the in-process ``tts`` when all model instances live in worker
+    processes, so the UI can still preview sentence splits.
+    """
+
+    def __init__(self, model_dir):
+        from omegaconf import OmegaConf
+        from indextts.utils.front import TextNormalizer, TextTokenizer
+
+        self.model_dir = model_dir
+        self.cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+        self.normalizer = TextNormalizer()
+        self.normalizer.load()
+        self.tokenizer = TextTokenizer(os.path.join(model_dir, self.cfg.dataset["bpe_model"]), self.normalizer)
+        self.device = "cpu"
+
+    @classmethod
+    def of(cls, tts):
+        """Frontend sharing a loaded instance's tokenizer, without keeping its weights alive."""
+        frontend = cls.__new__(cls)
+        frontend.model_dir = tts.model_dir
+        frontend.cfg = tts.cfg
+        frontend.model_version = tts.model_version
+        frontend.normalizer = tts.normalizer
+        frontend.tokenizer = tts.tokenizer
+        frontend.device = "cpu"
+        return frontend
+
+
+class _Worker:
+    def __init__(self, index, device):
+        self.index = index
+        self.device = device
+        self.inflight = 0
+        self.completed = 0
+        self.progress = (0.0, "")
+        self._lock = threading.Lock()
+
+    def _relay(self, progress):
+        self.progress = (0.0, "")
+
+        def report(value, desc=None):
+            self.progress = (value, desc or "")
+            if progress is not None:
+                progress(value, desc=desc)
+        return report
+
+    def stats(self):
+        return {
+            "worker": self.index,
+            "device": self.device,
+            "inflight": self.inflight,
+            "completed": self.completed,
+            "progress": round(float(self.progress[0] or 0.0), 3),
+            "stage": self.progress[1],
+        }
+
+
+class ThreadWorker(_Worker):
+    """An ``IndexTTS`` instance in this process; calls on it are serialized."""
+
+    def __init__(self, index, tts, device=None):
+        super().__init__(index, device or str(tts.device))
+        self.tts = tts
+
+    def exchange(self, fn, args, kwargs, progress=None):
+        with self._lock:
+            self.tts.gr_progress = self._relay(progress)
+            try:
+                result = fn(self.tts, *args, **kwargs)
+                if inspect.isgenerator(result):
+                    for item in result:
+                        yield "item", item
+                    result = None
+                yield "result", result
+            finally:
+                self.tts.gr_progress = None
+                self.completed += 1
+
+    def close(self):
+        pass
+
+
+def _cancel_requested(conn):
+    return conn.poll() and conn.recv() == ("cancel",)
+
+
+def _process_main(conn, model_dir, device, num_threads, prepare):
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+    tts = load_index_tts(model_dir, device, prepare)
+
+    def report(value, desc=None):
+        conn.send(("progress", value, desc))
+        # the caller answers a progress report it rejected with a cancel request
+        if _cancel_requested(conn):
+            raise RuntimeError("cancelled by caller")
+
+    tts.gr_progress = report
+    conn.send(("ready", tts.model_version))
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break  # the parent went away
+        if msg is None:
+            break
+        if msg == ("cancel",):
+            continue  # arrived after the call it was meant for had finished
+        fn, args, kwargs = msg
+        try:
+            result = fn(tts, *args, **kwargs)
+            if inspect.isgenerator(result):
+                for item in result:
+                    conn.send(("item", item))
+                    # the caller stopped consuming: do not synthesize the rest
+                    if _cancel_requested(conn):
+                        result.close()
+                        raise RuntimeError("cancelled by caller")
+                result = None
+            conn.send(("result", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _process_entry(fd):
+    """Body of a worker process started by ``ProcessWorker`` (``python model_pool.py <fd>``)."""
+    from multiprocessing.connection import Connection
+
+    conn = Connection(fd)
+    try:
+        model_dir, device, num_threads, prepare = conn.recv()
+    except EOFError:
+        return
+    _process_main(conn, model_dir, device, num_threads, prepare)
+
+
+class ProcessWorker(_Worker):
+    """An ``IndexTTS`` instance in a child process, driven over a pipe."""
+
+    def __init__(self, index, model_dir, device=None, num_threads=0, prepare=None):
+        super().__init__(index, device or "auto")
+        self._conn, child_conn = multiprocessing.Pipe()
+        env = dict(os.environ)
+        # the child must import what the parent can (indextts, the work unit modules)
+        env["PYTHONPATH"] = os.pathsep.join(os.path.abspath(p or os.curdir) for p in sys.path)
+        self._proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(child_conn.fileno())],
+                                      pass_fds=(child_conn.fileno(),), env=env)
+        child_conn.close()
+        try:
+            self._conn.send((model_dir, device, num_threads, prepare))
+            kind, _ = self._conn.recv()
+        except (EOFError, OSError):
+            kind = None
+        if kind != "ready":
+            self._proc.kill()
+            raise WorkerError(f"worker {index} failed to start")
+
+    def exchange(self, fn, args, kwargs, progress=None):
+        report = self._relay(progress)
+        with self._lock:
+            finished = False
+            rejected = None
+            cancelled = False
+            try:
+                self._conn.send((fn, args, kwargs))
+                while True:
+                    msg = self._conn.recv()
+                    if msg[0] == "progress":
+                        if rejected is None:
+                            try:
+                                report(msg[1], msg[2])
+                            except Exception as e:
+                                # e.g. a cancelled job: stop the child at its next report
+                                rejected = e
+                                cancelled = True
+                                self._conn.send(("cancel",))
+                    elif msg[0] == "item":
+                        yield msg
+                    elif msg[0] == "result":
+                        finished = True
+                        if rejected is not None:
+                            raise rejected
+                        yield msg
+                        return
+                    else:
+                        finished = True
+                        if rejected is not None:
+                            raise rejected
+                        raise WorkerError(f"worker {self.index}: {msg[1]}")
+            finally:
+                if not finished and not cancelled:
+                    # the caller stopped consuming (disconnect, cancelled job): the child
+                    # stops at its next sentence or progress report
+                    self._conn.send(("cancel",))
+                # replies sent until then must not be left in the pipe
+                while not finished:
+                    finished = self._conn.recv()[0] in ("result", "error")
+                self.completed += 1
+
+    def close(self):
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+        self._conn.close()
+
+
+class ModelPool:
+    """Dispatches work to the least loaded worker behind an admission limit."""
+
+    def __init__(self, workers, max_pending=8):
+        self.workers = workers
+        self.max_pending = max(1, int(max_pending))
+        self.pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, model_dir, num_workers=1, mode="thread", devices=None, max_pending=8, threads_per_worker=0,
+               prepare=None):
+        devices = devices or []
+        num_workers = max(1, int(num_workers))
+        if mode == "process" and os.name != "posix":
+            # the pipe is handed to the child as an inherited descriptor
+            print("⚠️ 当前平台不支持进程模式，回退为线程模式")
+            mode = "thread"
+        if mode == "thread" and threads_per_worker:
+            import torch
+
+            # intra-op parallelism is per calling thread, so this applies to each worker thread
+            torch.set_num_threads(threads_per_worker)
+        workers = []
+        for i in range(num_workers):
+            device = devices[i % len(devices)] if devices else None
+            if mode == "process":
+                workers.append(ProcessWorker(i, model_dir, device, threads_per_worker, prepare))
+            else:
+                workers.append(ThreadWorker(i, load_index_tts(model_dir, device, prepare), device))
+        return cls(workers, max_pending=max_pending)
+
+    def admit(self):
+        """Take one admission slot or raise ``PoolBusyError`` right away."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PoolBusyError(f"all {len(self.workers)} workers busy ({self.pending} requests in flight)")
+            self.pending += 1
+
+    def leave(self):
+        """Give back a slot taken by ``admit``."""
+        with self._lock:
+            self.pending -= 1
+
+    @contextmanager
+    def admission(self):
+        self.admit()
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def _acquire(self):
+        with self._lock:
+            worker = min(self.workers, key=lambda w: w.inflight)
+            worker.inflight += 1
+        return worker
+
+    def _release(self, worker):
+        with self._lock:
+            worker.inflight -= 1
+
+    def run(self, fn, *args, progress=None, **kwargs):
+        """Run ``fn(tts, *args, **kwargs)`` on the least loaded worker."""
+        worker = self._acquire()
+        try:
+            result = None
+            for kind, value in worker.exchange(fn, args, kwargs, progress):
+                if kind == "result":
+                    result = value
+            return result
+        finally:
+            self._release(worker)
+
+    def stream(self, fn, *args, progress=None, **kwargs):
+        """Like ``run`` for generator functions: yields their items as they arrive."""
+        worker = self._acquire()
+        try:
+            for kind, value in worker.exchange(fn, args, kwargs, progress):
+                if kind == "item":
+                    yield value
+        finally:
+            self._release(worker)
+
+    def run_each(self, fn, *args, **kwargs):
+        """Run ``fn`` once on every worker in parallel (e.g. a warm-up); returns their results."""
+
+        def run_on(worker):
+            result = None
+            for kind, value in worker.exchange(fn, args, kwargs):
+                if kind == "result":
+                    result = value
+            return result
+
+        with ThreadPoolExecutor(max_workers=len(self.workers)) as executor:
+            return list(executor.map(run_on, self.workers))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "rejected": self.rejected,
+                "workers": [w.stats() for w in self.workers],
+            }
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+if __name__ == "__main__":
+    _process_entry(int(sys.argv[1]))
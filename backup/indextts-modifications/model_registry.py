@@ -0,0 +1,339 @@
+"""Registry of several IndexTTS checkpoints served from one process.
+
+The WebUI used to load exactly one ``--model_dir`` at import time, so switching
+between IndexTTS 1.0 and 1.5 or per-customer fine-tunes meant a restart and a
+full model load. The registry knows every configured checkpoint by name and
+builds its ``ModelPool`` on first use. Requests lease a model with ``use`` (or
+``acquire``/``release``) so it cannot be evicted under them.
+
+Under a memory budget, loading a model first unloads the least recently used
+idle ones. Resident memory is measured from the parameters of in-process
+instances, counting shared tensors once, and estimated from checkpoint sizes
+for worker processes. Weights are memory-mapped while loading (see
+``model_pool.mmap_weights``), so a model evicted earlier reloads from the
+page cache.
+
+Checkpoints whose BPE model has the same content share one tokenizer and text
+normalizer. With in-process workers, instances on the same device whose BigVGAN
+weights are identical share one vocoder.
+"""
+import functools
+import gc
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from batch_scheduler import PooledBatchModel
+from cond_cache import file_content_hash
+from model_pool import ModelPool, PoolBusyError, TextFrontend, ThreadWorker
+
+
+def parse_model_dirs(spec):
+    """``"name=dir,name2=dir2"`` -> ``{name: dir}``."""
+    models = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, sep, model_dir = item.partition("=")
+        if not sep or not name.strip() or not model_dir.strip():
+            raise ValueError(f"expected name=model_dir, got {item!r}")
+        models[name.strip()] = model_dir.strip()
+    return models
+
+
+def _module_bytes(tts, seen):
+    """Bytes of the parameters and buffers of an instance's modules not in ``seen`` yet."""
+    total = 0
+    for value in vars(tts).values():
+        if not hasattr(value, "parameters") or not hasattr(value, "buffers"):
+            continue
+        for tensor in [*value.parameters(), *value.buffers()]:
+            if tensor.data_ptr() in seen:
+                continue
+            seen.add(tensor.data_ptr())
+            total += tensor.element_size() * tensor.nelement()
+    return total
+
+
+class RegisteredModel:
+    """One configured checkpoint; ``pool`` is ``None`` while it is not loaded."""
+
+    def __init__(self, name, model_dir, variant=""):
+        from omegaconf import OmegaConf
+
+        self.name = name
+        self.model_dir = model_dir
+        self.cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+        self.version = self.cfg.version if hasattr(self.cfg, "version") else None
+        self.bpe_path = os.path.join(model_dir, self.cfg.dataset["bpe_model"])
+        self.checkpoints = [os.path.join(model_dir, self.cfg.get(key, default)) for key, default in (
+            ("gpt_checkpoint", "gpt.pth"), ("bigvgan_checkpoint", "bigvgan_generator.pth"))]
+        gpt = os.stat(self.checkpoints[0])
+        # identity of the weights for cache keys: a replaced checkpoint gets a new key
+        self.key = f"{name}:{self.version or '1.0'}:{gpt.st_size}:{gpt.st_mtime_ns}"
+        if variant:
+            self.key += f":{variant}"
+        self.pool = None
+        self.frontend = None
+        self.batch_model = None
+        self.users = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self.load_seconds = 0.0
+
+    def checkpoint_bytes(self):
+        return sum(os.path.getsize(path) for path in self.checkpoints if os.path.exists(path))
+
+    def idle(self):
+        return self.users == 0 and self.pool.pending == 0 and all(w.inflight == 0 for w in self.pool.workers)
+
+
+class RegistryBatchModel:
+    """``BatchScheduler`` model running batches on one registered model, loading it if needed."""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def synthesize_batch(self, cond_mel, token_id_lists, gen_kwargs):
+        with self.registry.use(self.name) as model:
+            return PooledBatchModel(model.pool).synthesize_batch(cond_mel, token_id_lists, gen_kwargs)
+
+
+class ModelRegistry:
+    """Named checkpoints loaded on demand and evicted when idle under ``memory_budget_bytes``."""
+
+    def __init__(self, model_dirs, default=None, memory_budget_bytes=0, pool_kwargs=None, prepare=None,
+                 share_components=True, variant=""):
+        if not model_dirs:
+            raise ValueError("no models configured")
+        # ``variant`` tags every model key with settings that change what ``prepare``d weights produce
+        self.models = {name: RegisteredModel(name, model_dir, variant) for name, model_dir in model_dirs.items()}
+        self.default = default or next(iter(self.models))
+        if self.default not in self.models:
+            raise ValueError(f"default model {self.default!r} is not configured")
+        self.memory_budget_bytes = int(memory_budget_bytes)
+        self.pool_kwargs = dict(pool_kwargs or {})
+        self.prepare = prepare
+        # vocoders can only be shared by instances living in this process
+        self.share_components = share_components
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._file_keys = {}  # path -> (mtime_ns, size, digest)
+        self._frontends = {}  # BPE model digest -> TextFrontend
+        self._vocoders = weakref.WeakValueDictionary()  # (weights digest, config, device) -> BigVGAN
+        for model in self.models.values():
+            model.batch_model = RegistryBatchModel(self, model.name)
+
+    def names(self):
+        return list(self.models)
+
+    def resolve(self, name=None):
+        """Configured model name for ``name`` (empty = the default); raises ``KeyError`` if unknown."""
+        name = name or self.default
+        if name not in self.models:
+            raise KeyError(f"unknown model: {name}")
+        return name
+
+    def get(self, name=None):
+        return self.models[self.resolve(name)]
+
+    def loaded(self):
+        with self._lock:
+            return [model for model in self.models.values() if model.pool is not None]
+
+    def _file_key(self, path):
+        st = os.stat(path)
+        with self._lock:
+            known = self._file_keys.get(path)
+        if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            return known[2]
+        digest = file_content_hash(path)
+        with self._lock:
+            self._file_keys[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    # -- tokenizer -------------------------------------------------------
+
+    def frontend(self, name=None):
+        """Tokenizer/config of a model without loading its weights; shared by identical BPE models."""
+        model = self.get(name)
+        if model.frontend is None:
+            key = self._file_key(model.bpe_path)
+            with self._lock:
+                frontend = self._frontends.get(key)
+            if frontend is None:
+                frontend = TextFrontend(model.model_dir)
+                with self._lock:
+                    frontend = self._frontends.setdefault(key, frontend)
+            model.frontend = frontend
+        return model.frontend
+
+    # -- leasing ---------------------------------------------------------
+
+    def acquire(self, name=None):
+        """Lease a model, loading it first if needed; pair with ``release``.
+
+        Raises ``PoolBusyError`` when it does not fit the memory budget because
+        the other loaded models are in use.
+        """
+        model = self.get(name)
+        with self._lock:
+            # counted before loading, so it is never picked for eviction meanwhile
+            model.users += 1
+            if model.pool is not None:
+                return model
+        try:
+            with self._load_lock:
+                if model.pool is None:
+                    self._load(model)
+            self.frontend(model.name)
+        except BaseException:
+            self.release(model)
+            raise
+        return model
+
+    def release(self, model):
+        with self._lock:
+            model.users -= 1
+            model.last_used = time.monotonic()
+
+    @contextmanager
+    def use(self, name=None):
+        model = self.acquire(name)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    # -- loading and eviction --------------------------------------------
+
+    def _workers(self):
+        return max(1, int(self.pool_kwargs.get("num_workers", 1)))
+
+    def resident_bytes(self):
+        """Memory held by loaded models; tensors shared between instances count once."""
+        seen = set()
+        total = 0
+        for model in self.loaded():
+            for worker in model.pool.workers:
+                if isinstance(worker, ThreadWorker):
+                    total += _module_bytes(worker.tts, seen)
+                else:
+                    total += model.checkpoint_bytes()
+        return total
+
+    def _make_room(self, target):
+        if self.memory_budget_bytes <= 0:
+            return
+        need = target.checkpoint_bytes() * self._workers()
+        while True:
+            with self._lock:
+                resident = self.resident_bytes()
+                if resident + need <= self.memory_budget_bytes:
+                    return
+                others = [model for model in self.models.values() if model.pool is not None and model is not target]
+                idle = [model for model in others if model.idle()]
+                if not idle:
+                    if others:
+                        raise PoolBusyError(f"model memory budget reached ({resident / 2 ** 30:.1f} GB loaded) "
+                                            f"and every loaded model is in use")
+                    print(f"⚠️ 模型 {target.name} 超出内存预算 {self.memory_budget_bytes / 2 ** 30:.1f} GB，仍然加载")
+                    return
+                victim = min(idle, key=lambda model: model.last_used)
+                # detached under the lock: a new lease now waits for a reload instead of using it
+                pool, victim.pool = victim.pool, None
+                self.evictions += 1
+            print(f"♻️ 卸载空闲模型 {victim.name} 以释放内存")
+            self._close(pool)
+
+    def _close(self, pool):
+        pool.close()
+        del pool
+        gc.collect()
+        import torch
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _load(self, model):
+        self._make_room(model)
+        print(f"📦 加载模型 {model.name}（{model.model_dir}）")
+        start = time.perf_counter()
+        # worker processes get the plain (picklable) hook; they share nothing anyway
+        prepare = functools.partial(self._prepare, model) if self.share_components else self.prepare
+        pool = ModelPool.create(model.model_dir, prepare=prepare, **self.pool_kwargs)
+        with self._lock:
+            model.pool = pool
+            model.loads += 1
+            model.load_seconds = time.perf_counter() - start
+            model.last_used = time.monotonic()
+        print(f"✅ 模型 {model.name} 已加载，用时 {model.load_seconds:.1f} 秒")
+
+    def _prepare(self, model, tts):
+        if self.prepare is not None:
+            self.prepare(tts)
+        if not self.share_components:
+            return tts
+        key = self._file_key(model.bpe_path)
+        with self._lock:
+            frontend = self._frontends.setdefault(key, TextFrontend.of(tts))
+        tts.normalizer = frontend.normalizer
+        tts.tokenizer = frontend.tokenizer
+        vocoder_path = model.checkpoints[1]
+        if os.path.exists(vocoder_path):
+            key = (self._file_key(vocoder_path), str(model.cfg.get("bigvgan")), str(tts.device))
+            with self._lock:
+                shared = self._vocoders.get(key)
+                if shared is None:
+                    self._vocoders[key] = tts.bigvgan
+            if shared is not None:
+                tts.bigvgan = shared
+        return tts
+
+    def unload(self, name):
+        """Unload a model now if it is idle; returns whether it was unloaded."""
+        model = self.get(name)
+        with self._lock:
+            if model.pool is None or not model.idle():
+                return False
+            pool, model.pool = model.pool, None
+            self.evictions += 1
+        self._close(pool)
+        return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for model in self.models.values():
+                models[model.name] = {
+                    "model_dir": model.model_dir,
+                    "version": model.version,
+                    "loaded": model.pool is not None,
+                    "users": model.users,
+                    "loads": model.loads,
+                    "load_seconds": round(model.load_seconds, 2),
+                    "idle_s": round(now - model.last_used, 1) if model.last_used else None,
+                }
+                if model.pool is not None:
+                    models[model.name]["pool"] = model.pool.stats()
+            return {
+                "default": self.default,
+                "models": models,
+                "resident_mb": round(self.resident_bytes() / 2 ** 20, 1),
+                "budget_mb": round(self.memory_budget_bytes / 2 ** 20, 1),
+                "evictions": self.evictions,
+                "shared_tokenizers": len(self._frontends),
+                "shared_vocoders": len(self._vocoders),
+            }
+
+    def close(self):
+        for model in self.models.values():
+            with self._lock:
+                pool, model.pool = model.pool, None
+            if pool is not None:
+                pool.close()
@@ -0,0 +1,170 @@
+"""Output storage for synthesized audio.
+
+Outputs used to be written to ``outputs/spk_{int(time.time())}.wav``: two
+requests finishing in the same second overwrote each other and nothing ever
+removed old files. ``OutputStore`` hands out unique per-request paths in a
+sharded layout (``<root>/<id[:2]>/<id[2:4]>/<id>.<ext>``), re-encodes finished
+WAVs to FLAC, Opus or MP3 on its own thread pool so encoding never holds a
+model worker, and runs a background sweeper enforcing a TTL and a total-size cap.
+"""
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import torchaudio
+
+# format -> (file extension, ffmpeg output options)
+FORMATS = {
+    "wav": (".wav", None),
+    "flac": (".flac", {"acodec": "flac"}),
+    "opus": (".ogg", {"acodec": "libopus", "audio_bitrate": "64k"}),
+    "mp3": (".mp3", {"acodec": "libmp3lame", "audio_bitrate": "128k"}),
+}
+
+EXTENSIONS = {ext: fmt for fmt, (ext, _) in FORMATS.items()}
+_OUTPUT_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def output_id(path):
+    """Public id of a path from ``OutputStore.new_path``; clients never see server paths."""
+    return os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[-1]
+
+
+def available_formats():
+    """Formats that can be encoded here; Opus and MP3 need the ffmpeg binary."""
+    if shutil.which("ffmpeg"):
+        return list(FORMATS)
+    return ["wav", "flac"]
+
+
+def encode_file(src_path, dst_path, fmt):
+    """Encode the WAV at ``src_path`` into ``fmt`` at ``dst_path``."""
+    options = FORMATS[fmt][1]
+    if shutil.which("ffmpeg"):
+        import ffmpeg
+
+        ffmpeg.input(src_path).output(dst_path, **options).overwrite_output().run(quiet=True)
+    elif fmt == "flac":
+        wav, sr = torchaudio.load(src_path)
+        torchaudio.save(dst_path, wav, sr, format="flac")
+    else:
+        raise RuntimeError(f"encoding {fmt} requires ffmpeg")
+    return dst_path
+
+
+class OutputStore:
+    def __init__(self, root, ttl_s=24 * 3600, max_bytes=10 * 1024 ** 3, sweep_interval_s=300, encode_workers=2):
+        self.root = root
+        self.ttl_s = ttl_s
+        self.max_bytes = int(max_bytes)
+        self.sweep_interval_s = sweep_interval_s
+        os.makedirs(root, exist_ok=True)
+        self._encoder = ThreadPoolExecutor(max_workers=encode_workers, thread_name_prefix="output-encode")
+        self._stopped = threading.Event()
+        self._thread = None
+        self.swept_files = 0
+        self.swept_bytes = 0
+
+    def new_path(self, fmt="wav", prefix="spk"):
+        """A fresh, collision-free path for one output; its shard directory is created."""
+        uid = uuid.uuid4().hex
+        shard = os.path.join(self.root, uid[:2], uid[2:4])
+        os.makedirs(shard, exist_ok=True)
+        return os.path.join(shard, f"{prefix}_{uid}{FORMATS[fmt][0]}")
+
+    def resolve(self, output_id):
+        """``(path, format)`` of the output with ``output_id`` in whatever format it was finalized, or None."""
+        if not _OUTPUT_ID.fullmatch(output_id or ""):
+            return None
+        shard = os.path.join(self.root, output_id[:2], output_id[2:4])
+        try:
+            # while an encode runs the finished WAV is still there and the encoded file is partial
+            names = sorted(os.listdir(shard), key=lambda name: not name.endswith(".wav"))
+        except OSError:
+            return None
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if stem.endswith(f"_{output_id}") and ext in EXTENSIONS:
+                return os.path.join(shard, name), EXTENSIONS[ext]
+        return None
+
+    def encode(self, wav_path, fmt):
+        """Future of ``wav_path`` encoded to ``fmt`` next to it (the WAV is removed)."""
+        if fmt == "wav":
+            raise ValueError("wav needs no encoding")
+        dst_path = f"{os.path.splitext(wav_path)[0]}{FORMATS[fmt][0]}"
+
+        def job():
+            encode_file(wav_path, dst_path, fmt)
+            os.remove(wav_path)
+            return dst_path
+
+        return self._encoder.submit(job)
+
+    def finalize(self, wav_path, fmt="wav"):
+        """Path to serve for a finished WAV from ``new_path``, encoded to ``fmt``."""
+        if fmt == "wav":
+            return wav_path
+        return self.encode(wav_path, fmt).result()
+
+    def sweep(self):
+        """Remove outputs older than the TTL, then the oldest ones above the size cap."""
+        now = time.time()
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            expired = self.ttl_s > 0 and now - mtime > self.ttl_s
+            if not expired and (self.max_bytes <= 0 or total <= self.max_bytes):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            self.swept_files += 1
+            self.swept_bytes += size
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            # a just-created shard may be about to receive its first file
+            if dirpath != self.root and not dirnames and not filenames and now - os.stat(dirpath).st_mtime > 60:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+        return removed
+
+    def _sweep_loop(self):
+        # the first sweep runs right away, but off the startup path: a large tree takes a while
+        while True:
+            try:
+                self.sweep()
+            except OSError as e:
+                print(f"⚠️ 输出目录清理失败: {e}")
+            if self._stopped.wait(self.sweep_interval_s):
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sweep_loop, daemon=True, name="output-sweeper")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._encoder.shutdown(wait=True)
+
+    def stats(self):
+        return {"swept_files": self.swept_files, "swept_bytes": self.swept_bytes, "root": self.root}
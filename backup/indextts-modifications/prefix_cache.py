@@ -0,0 +1,312 @@
+"""Conditioning prefix reuse for GPT decoding.
+
+Every ``inference_speech`` call re-encodes the reference mel (conformer +
+perceiver) and then runs the whole GPT prompt ``[conditioning, text, start]``
+through all layers for each of the ``num_beams`` rows, although only the text
+changes from one sentence to the next. UnifiedVoice's GPT-2 has no position
+embedding of its own and the conditioning latents come first, so under causal
+attention their keys/values depend on the voice alone.
+
+``enable`` wraps a loaded instance so that, per voice, the conditioning latent
+and the per-layer key/value cache of the conditioning positions are computed
+once and kept in an LRU bounded by bytes. The first decoding step of every
+later sentence, beam and request of that voice only runs the text positions on
+top of the cached prefix (broadcast over the batch and the beams, not copied).
+Voices are keyed by the content of the conditioning mel, so cached library
+voices hit across requests.
+
+``python prefix_cache.py`` measures GPT decoding tokens/s with the cache off
+and on, and checks that greedy decoding yields identical codes both ways.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+
+class _Entry:
+    __slots__ = ("latent", "past", "nbytes")
+
+    def __init__(self, latent):
+        self.latent = latent
+        self.past = None  # per layer (key, value), each [1, heads, prefix, head_dim]
+        self.nbytes = _nbytes(latent)
+
+
+def _nbytes(*tensors):
+    return sum(t.element_size() * t.nelement() for t in tensors)
+
+
+def voice_key(cond_input, cond_lengths=None):
+    """Content key of a conditioning input (and its lengths)."""
+    digest = hashlib.sha1(cond_input.detach().float().cpu().contiguous().numpy().tobytes())
+    if cond_lengths is not None:
+        digest.update(str(cond_lengths.tolist() if torch.is_tensor(cond_lengths) else cond_lengths).encode())
+    return f"{digest.hexdigest()}:{tuple(cond_input.shape)}"
+
+
+def _legacy(past):
+    return past.to_legacy_cache() if hasattr(past, "to_legacy_cache") else tuple(past)
+
+
+def _past_length(past):
+    if past is None:
+        return 0
+    if hasattr(past, "get_seq_length"):
+        return past.get_seq_length()
+    return past[0][0].shape[-2] if len(past) else 0
+
+
+class PrefixCache:
+    """Per-instance LRU of voice -> conditioning latent and conditioning-prefix KV cache."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.enabled = self.max_bytes > 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.current = None  # entry of the voice the running call was conditioned on
+        self.hits = 0
+        self.misses = 0
+        self.prefix_reuses = 0
+        self.reused_tokens = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return entry
+
+    def insert(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            self._evict()
+
+    def grow(self, entry, nbytes):
+        """Account bytes added to an entry (its KV cache) after insertion."""
+        with self._lock:
+            entry.nbytes += nbytes
+            if any(e is entry for e in self._entries.values()):
+                self._bytes += nbytes
+                self._evict()
+
+    def _evict(self):
+        # the most recent entry stays even if it alone exceeds the budget; it is in use
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.current = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "prefix_reuses": self.prefix_reuses,
+                "reused_tokens": self.reused_tokens,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def _expanded_past(model, entry, rows, past):
+    """The cached prefix KV broadcast to ``rows``, as the cache object ``model`` expects."""
+    layers = [(k.expand(rows, -1, -1, -1), v.expand(rows, -1, -1, -1)) for k, v in entry.past]
+    if past is not None and hasattr(past, "update"):
+        # generate() already created an empty Cache object: fill it; update() concatenates, so the
+        # cached tensors are never written to
+        for layer, (k, v) in enumerate(layers):
+            past.update(k, v, layer)
+        return past
+    if getattr(model, "_supports_cache_class", False):
+        from transformers.cache_utils import DynamicCache
+
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return tuple(layers)
+
+
+def _wrap_get_conditioning(gpt, cache):
+    original = gpt.get_conditioning
+
+    @functools.wraps(original)
+    def get_conditioning(speech_conditioning_input, cond_mel_lengths=None):
+        if not cache.enabled:
+            cache.current = None
+            return original(speech_conditioning_input, cond_mel_lengths)
+        key = voice_key(speech_conditioning_input, cond_mel_lengths)
+        entry = cache.lookup(key)
+        if entry is None:
+            entry = _Entry(original(speech_conditioning_input, cond_mel_lengths))
+            cache.insert(key, entry)
+        cache.current = entry
+        return entry.latent
+
+    gpt.get_conditioning = get_conditioning
+
+
+def _wrap_inference_forward(model, cache):
+    original = model.forward
+
+    # generate() validates its kwargs against the signature of forward
+    @functools.wraps(original)
+    def forward(input_ids=None, past_key_values=None, **kwargs):
+        entry = cache.current
+        mel_emb = getattr(model, "cached_mel_emb", None)
+        if (not cache.enabled or entry is None or mel_emb is None or input_ids is None
+                or input_ids.shape[1] == 1 or _past_length(past_key_values) != 0):
+            return original(input_ids=input_ids, past_key_values=past_key_values, **kwargs)
+        n = entry.latent.shape[1]
+        prefix = mel_emb[:, :n]
+        if mel_emb.shape[1] <= n or not torch.equal(prefix, entry.latent.to(prefix.dtype).expand_as(prefix)):
+            # the prompt does not start with this voice's conditioning; decode it in full
+            return original(input_ids=input_ids, past_key_values=past_key_values, **kwargs)
+        if entry.past is None:
+            with torch.no_grad():
+                out = model.transformer(inputs_embeds=prefix[:1], use_cache=True, return_dict=True)
+            entry.past = tuple((k.detach(), v.detach()) for k, v in _legacy(out.past_key_values))
+            cache.grow(entry, sum(_nbytes(k, v) for k, v in entry.past))
+        rows = input_ids.shape[0]
+        for name in ("position_ids", "token_type_ids", "cache_position"):
+            value = kwargs.get(name)
+            if value is not None and value.shape[-1] == input_ids.shape[1]:
+                kwargs[name] = value[..., n:]
+        with cache._lock:
+            cache.prefix_reuses += 1
+            cache.reused_tokens += n * rows
+        # the prompt embedding minus the prefix makes the model embed only the text positions; the
+        # full one is restored for the decoding steps, which derive positions from its length
+        model.cached_mel_emb = mel_emb[:, n:]
+        try:
+            return original(input_ids=input_ids[:, n:], past_key_values=_expanded_past(model.transformer, entry, rows,
+                                                                                         past_key_values), **kwargs)
+        finally:
+            model.cached_mel_emb = mel_emb
+
+    model.forward = forward
+
+
+def enable(tts, max_mb=64):
+    """Install a ``PrefixCache`` of ``max_mb`` on a loaded ``IndexTTS`` (``tts.prefix_cache``)."""
+    gpt = tts.gpt
+    if not hasattr(gpt, "get_conditioning") or not hasattr(gpt, "inference_model"):
+        print("⚠️ 当前模型不支持条件前缀缓存，保持原样")
+        return tts
+    cache = PrefixCache(int(max_mb * 1024 * 1024))
+    _wrap_get_conditioning(gpt, cache)
+    _wrap_inference_forward(gpt.inference_model, cache)
+    tts.prefix_cache = cache
+    return tts
+
+
+def stats(tts):
+    cache = getattr(tts, "prefix_cache", None)
+    return cache.stats() if cache is not None else None
+
+
+def measure(tts, cases, enabled, **generation_kwargs):
+    """GPT decoding over ``cases`` with the cache on or off; ``(tokens/s, codes per case)``."""
+    import infer_stages
+    from cond_cache import compute_cond_mel
+
+    tts.prefix_cache.clear()
+    tts.prefix_cache.enabled = enabled
+    tokens = 0
+    seconds = 0.0
+    outputs = []
+    for case in cases:
+        cond_mel = compute_cond_mel(case["prompt_audio"]).to(tts.device)
+        codes = []
+        for ids in infer_stages.sentence_token_ids(tts, infer_stages.split_text(tts, case["text"])):
+            if torch.device(tts.device).type == "cuda":
+                torch.cuda.synchronize(tts.device)
+            start = time.perf_counter()
+            _, sentence_codes, code_lens = infer_stages.generate_codes(tts, cond_mel, [ids], **generation_kwargs)
+            if torch.device(tts.device).type == "cuda":
+                torch.cuda.synchronize(tts.device)
+            seconds += time.perf_counter() - start
+            tokens += int(code_lens.sum().item())
+            codes.append(sentence_codes[0, :int(code_lens[0].item())].tolist())
+        outputs.append(codes)
+    return tokens / seconds if seconds else 0.0, outputs
+
+
+def main(argv=None):
+    from benchmark import synthetic_long_text
+    from model_pool import load_index_tts
+
+    parser = argparse.ArgumentParser(description="GPT decoding tokens/s without and with the conditioning prefix cache")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("--device", type=str, default=None, help="Device of the instance (default: IndexTTS choice)")
+    parser.add_argument("--cases", type=str, default=os.path.join("tests", "cases.jsonl"), help="JSONL cases (prompt_audio/text)")
+    parser.add_argument("--long_texts", type=str, default="600", help="Character counts of synthetic long texts added per voice")
+    parser.add_argument("--num_beams", type=int, default=3, help="Beams per sentence")
+    parser.add_argument("--repeats", type=int, default=2, help="Runs per setting; the best run counts")
+    parser.add_argument("--out", type=str, default="prefix_cache_bench.json", help="Where to write the report")
+    args = parser.parse_args(argv)
+
+    cases = []
+    with open(args.cases, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                case = json.loads(line)
+                case["prompt_audio"] = os.path.join(os.path.dirname(args.cases), case.get("prompt_audio", "sample_prompt.wav"))
+                cases.append(case)
+    for prompt in sorted({case["prompt_audio"] for case in cases}):
+        for n in (int(v) for v in args.long_texts.split(",") if v.strip()):
+            cases.append({"prompt_audio": prompt, "text": synthetic_long_text(n, 1234)})
+    tts = enable(load_index_tts(args.model_dir, args.device))
+    if getattr(tts, "prefix_cache", None) is None:
+        sys.exit(1)
+    # greedy decoding, so both settings must produce the same codes
+    kwargs = {"do_sample": False, "num_beams": args.num_beams}
+    measure(tts, cases[:1], False, **kwargs)  # warm-up
+    results = {}
+    codes = {}
+    for name, enabled in (("off", False), ("on", True)):
+        runs = [measure(tts, cases, enabled, **kwargs) for _ in range(max(1, args.repeats))]
+        results[name] = round(max(rate for rate, _ in runs), 2)
+        codes[name] = runs[0][1]
+    report = {
+        "device": str(tts.device),
+        "num_beams": args.num_beams,
+        "cases": len(cases),
+        "tokens_per_s_off": results["off"],
+        "tokens_per_s_on": results["on"],
+        "speedup": round(results["on"] / results["off"], 3) if results["off"] else None,
+        "identical_codes": codes["off"] == codes["on"],
+        "prefix_cache": tts.prefix_cache.stats(),
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📊 GPT 解码 {report['tokens_per_s_off']} → {report['tokens_per_s_on']} tokens/s（{report['speedup']}x），"
+          f"结果{'一致' if report['identical_codes'] else '不一致'}，报告已写入 {args.out}")
+    sys.exit(0 if report["identical_codes"] else 1)
+
+
+if __name__ == "__main__":
+    main()
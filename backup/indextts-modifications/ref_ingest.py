@@ -0,0 +1,138 @@
+"""Ingest-time preprocessing of reference audio.
+
+Uploaded references arrive as mp3/m4a/aac/ogg at any sample rate and length,
+often with long leading and trailing silence, and every synthesis used to pay
+for decoding and resampling them again. Each clip is now processed once when it
+enters the library: decoded, downmixed, resampled to the model rate, trimmed of
+edge silence, loudness-normalized, capped in duration and stored as a canonical
+float32 ``.npy`` that the synthesis path memory-maps instead of decoding.
+
+Bulk import of an existing directory:
+    python ref_ingest.py input --workers 8
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+import torchaudio
+
+from cond_cache import PROMPT_SAMPLE_RATE
+
+TRIM_THRESHOLD_DB = -40.0  # frames this far below the loudest frame count as silence
+TRIM_PAD_S = 0.1
+FRAME_S = 0.02
+TARGET_DBFS = -20.0
+PEAK_LIMIT = 0.97
+MAX_DURATION_S = 15.0
+FADE_S = 0.05
+
+
+def ingest_tag(max_duration_s=MAX_DURATION_S, target_dbfs=TARGET_DBFS):
+    """Short hash of the preprocessing settings; canonical copies are named after it."""
+    settings = {"sr": PROMPT_SAMPLE_RATE, "trim_db": TRIM_THRESHOLD_DB, "pad": TRIM_PAD_S,
+                "dbfs": target_dbfs, "peak": PEAK_LIMIT, "max_s": max_duration_s}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:8]
+
+
+def _frame_db(audio, frame):
+    n = audio.shape[-1] // frame
+    if n == 0:
+        return torch.empty(0)
+    frames = audio[: n * frame].reshape(n, frame)
+    rms = frames.pow(2).mean(dim=1).sqrt()
+    return 20 * torch.log10(rms.clamp_min(1e-8))
+
+
+def trim_silence(audio, sr=PROMPT_SAMPLE_RATE):
+    """Cut leading/trailing frames quieter than ``TRIM_THRESHOLD_DB`` below the loudest frame."""
+    frame = int(sr * FRAME_S)
+    db = _frame_db(audio, frame)
+    if db.numel() == 0:
+        return audio
+    voiced = torch.nonzero(db > db.max() + TRIM_THRESHOLD_DB).squeeze(1)
+    if voiced.numel() == 0:
+        return audio
+    pad = int(sr * TRIM_PAD_S)
+    start = max(0, int(voiced[0]) * frame - pad)
+    end = min(audio.shape[-1], (int(voiced[-1]) + 1) * frame + pad)
+    return audio[start:end]
+
+
+def normalize_loudness(audio, target_dbfs=TARGET_DBFS):
+    """Scale to ``target_dbfs`` RMS over voiced frames, then limit the peak."""
+    db = _frame_db(audio, int(PROMPT_SAMPLE_RATE * FRAME_S))
+    if db.numel() == 0:
+        return audio
+    voiced = db[db > db.max() + TRIM_THRESHOLD_DB]
+    level = 10 * torch.log10(torch.pow(10, voiced / 10).mean())
+    audio = audio * float(10 ** ((target_dbfs - float(level)) / 20))
+    peak = float(audio.abs().max())
+    if peak > PEAK_LIMIT:
+        audio = audio * (PEAK_LIMIT / peak)
+    return audio
+
+
+def cap_duration(audio, max_duration_s=MAX_DURATION_S, sr=PROMPT_SAMPLE_RATE):
+    limit = int(max_duration_s * sr)
+    if max_duration_s <= 0 or audio.shape[-1] <= limit:
+        return audio
+    audio = audio[:limit].clone()
+    fade = min(limit, int(FADE_S * sr))
+    audio[-fade:] *= torch.linspace(1.0, 0.0, fade)
+    return audio
+
+
+def preprocess(audio, sr, max_duration_s=MAX_DURATION_S, target_dbfs=TARGET_DBFS):
+    """``[C, N]`` audio at ``sr`` -> canonical 1-D float32 mono at the model rate."""
+    audio = torch.mean(audio.float(), dim=0)
+    if sr != PROMPT_SAMPLE_RATE:
+        audio = torchaudio.functional.resample(audio, sr, PROMPT_SAMPLE_RATE)
+    audio = trim_silence(audio)
+    audio = normalize_loudness(audio, target_dbfs)
+    return cap_duration(audio, max_duration_s)
+
+
+def canonical_path(out_dir, digest, tag):
+    return os.path.join(out_dir, f"{digest}_{tag}.npy")
+
+
+def ingest_audio(path, out_dir, digest, max_duration_s=MAX_DURATION_S, target_dbfs=TARGET_DBFS):
+    """Write the canonical copy of ``path`` (once per content hash and settings).
+
+    Returns the original duration and sample rate plus the canonical path.
+    """
+    audio, sr = torchaudio.load(path)
+    out_path = canonical_path(out_dir, digest, ingest_tag(max_duration_s, target_dbfs))
+    if not os.path.exists(out_path):
+        canonical = preprocess(audio, sr, max_duration_s, target_dbfs).numpy().astype(np.float32)
+        tmp_path = f"{out_path}.tmp{os.getpid()}.npy"
+        np.save(tmp_path, canonical)
+        os.replace(tmp_path, out_path)
+    return {"duration": audio.shape[-1] / sr, "sample_rate": sr, "resampled_path": out_path}
+
+
+def load_canonical(path):
+    """Memory-map a canonical copy as a ``[1, N]`` tensor without copying it."""
+    # copy-on-write keeps the mapping shared while giving torch a writable array
+    return torch.from_numpy(np.load(path, mmap_mode="c")).unsqueeze(0)
+
+
+def main(argv=None):
+    from ref_library import ReferenceLibrary
+
+    parser = argparse.ArgumentParser(description="Preprocess every reference clip of a library directory")
+    parser.add_argument("input_dir", type=str, help="Reference audio directory (the WebUI --input_dir)")
+    parser.add_argument("--workers", type=int, default=4, help="Clips processed in parallel")
+    parser.add_argument("--max_seconds", type=float, default=MAX_DURATION_S, help="Cap on the canonical clip length")
+    parser.add_argument("--target_dbfs", type=float, default=TARGET_DBFS, help="Loudness target (RMS dBFS)")
+    args = parser.parse_args(argv)
+    library = ReferenceLibrary(args.input_dir, max_duration_s=args.max_seconds, target_dbfs=args.target_dbfs)
+    done, failed = library.ingest_all(workers=args.workers)
+    print(f"✅ 参考音频预处理完成: {done} 个，失败 {failed} 个")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""Indexed reference-audio library.
+
+Listing ``--input_dir`` and stat-ing files on every dropdown refresh, save and
+generate is slow once the library holds thousands of voices on network storage.
+``ReferenceLibrary`` keeps an SQLite index of the clips with per-clip size,
+mtime, duration, sample rate, content hash and a canonical preprocessed copy
+(see ``ref_ingest``). The index lives under ``outputs/`` rather than in the
+watched directory, where its own commits would look like library changes.
+Lookups by name are answered from an in-memory dict, dropdown pages and searches
+from SQL, and the index is updated incrementally: a cheap directory-mtime poll
+(or inotify through ``watchdog`` when installed) triggers a rescan that only
+probes new or changed files, in a background thread.
+"""
+import hashlib
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cond_cache import file_content_hash
+from ref_ingest import MAX_DURATION_S, TARGET_DBFS, ingest_audio, ingest_tag
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.flac', '.aac', '.ogg')
+INDEX_DIR = os.path.join("outputs", "ref_index")
+LEGACY_INDEX_FILENAME = ".ref_index.sqlite3"
+EVENT_DEBOUNCE_S = 0.5
+RESAMPLED_DIRNAME = ".resampled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration REAL,
+    sample_rate INTEGER,
+    sha256 TEXT,
+    resampled_path TEXT,
+    indexed_at REAL
+)
+"""
+_COLUMNS = ("name", "size", "mtime_ns", "duration", "sample_rate", "sha256", "resampled_path", "indexed_at")
+
+
+def is_audio_file(name):
+    return name.lower().endswith(AUDIO_EXTENSIONS)
+
+
+# a content hash or a prefix of one; anything else must not reach a LIKE pattern
+_HASH_PREFIX = re.compile(r"[0-9a-f]{8,64}")
+
+
+def _escape_like(text):
+    """``text`` as a literal inside a ``LIKE ... ESCAPE '\\'`` pattern."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def index_path_for(input_dir, index_dir=INDEX_DIR):
+    """Index file of a library directory: one per directory, outside of it."""
+    input_dir = os.path.abspath(input_dir)
+    digest = hashlib.sha1(input_dir.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(index_dir, f"{os.path.basename(input_dir) or 'root'}_{digest}.sqlite3")
+
+
+def probe_audio(path, resampled_dir, max_duration_s=MAX_DURATION_S, target_dbfs=TARGET_DBFS):
+    """Duration, sample rate, content hash and the canonical preprocessed copy of one clip."""
+    digest = file_content_hash(path)
+    meta = ingest_audio(path, resampled_dir, digest, max_duration_s, target_dbfs)
+    meta["sha256"] = digest
+    return meta
+
+
+class ReferenceLibrary:
+    def __init__(self, input_dir, poll_interval=5.0, max_duration_s=MAX_DURATION_S, target_dbfs=TARGET_DBFS,
+                 index_path=None):
+        self.input_dir = input_dir
+        self.resampled_dir = os.path.join(input_dir, RESAMPLED_DIRNAME)
+        os.makedirs(self.resampled_dir, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.max_duration_s = max_duration_s
+        self.target_dbfs = target_dbfs
+        self.ingest_tag = ingest_tag(max_duration_s, target_dbfs)
+        self._lock = threading.RLock()
+        self.index_path = index_path or index_path_for(input_dir)
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        legacy_path = os.path.join(input_dir, LEGACY_INDEX_FILENAME)
+        if os.path.exists(legacy_path) and not os.path.exists(self.index_path):
+            # keep what was probed when the index lived next to the clips
+            try:
+                shutil.move(legacy_path, self.index_path)
+            except OSError as e:
+                print(f"⚠️ 旧参考音频索引迁移失败，将重新建立: {e}")
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+        self._entries = {
+            row[0]: dict(zip(_COLUMNS, row))
+            for row in self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM refs")
+        }
+        self._dir_mtime_ns = None
+        self._changed = threading.Event()  # set by watchdog events for audio files
+        self._probe_queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._threads = []
+        self.on_change = []  # callbacks(path) fired when a clip is added, replaced or re-processed
+
+    # -- lookups ---------------------------------------------------------
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def resolve(self, name):
+        """Full path of a library clip by file name, or None. No filesystem access."""
+        if not name:
+            return None
+        with self._lock:
+            if name in self._entries:
+                return os.path.join(self.input_dir, name)
+        return None
+
+    def resolve_voice(self, voice):
+        """Full path of a clip by file name or by content hash (full or a prefix of 8+ hex digits)."""
+        path = self.resolve(voice)
+        if path is not None or not voice or not _HASH_PREFIX.fullmatch(voice.lower()):
+            return path
+        with self._lock:
+            row = self._db.execute("SELECT name FROM refs WHERE sha256 LIKE ? ORDER BY name LIMIT 1",
+                                   (f"{voice.lower()}%",)).fetchone()
+        return os.path.join(self.input_dir, row[0]) if row else None
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry) if entry else None
+
+    def resampled_path(self, path):
+        """Canonical preprocessed copy of a library clip, once it has been ingested."""
+        name = os.path.basename(path)
+        if self.resolve(name) != path:
+            return None
+        entry = self.get(name)
+        return entry["resampled_path"] if entry else None
+
+    def search(self, query="", offset=0, limit=100):
+        """One page of clip names matching ``query`` (substring), plus the total count."""
+        pattern = f"%{_escape_like(query.strip())}%" if query and query.strip() else "%"
+        with self._lock:
+            total = self._db.execute("SELECT COUNT(*) FROM refs WHERE name LIKE ? ESCAPE '\\'",
+                                     (pattern,)).fetchone()[0]
+            names = [row[0] for row in self._db.execute(
+                "SELECT name FROM refs WHERE name LIKE ? ESCAPE '\\' ORDER BY name LIMIT ? OFFSET ?",
+                (pattern, int(limit), int(offset)))]
+        return names, total
+
+    def paths(self):
+        with self._lock:
+            return [os.path.join(self.input_dir, name) for name in sorted(self._entries)]
+
+    # -- maintenance -----------------------------------------------------
+
+    def _store(self, entry):
+        self._entries[entry["name"]] = entry
+        self._db.execute(
+            f"INSERT OR REPLACE INTO refs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            tuple(entry[c] for c in _COLUMNS))
+
+    def upsert(self, path, probe=False):
+        """(Re)index one clip right away, e.g. after it was saved.
+
+        Ingest runs inline with ``probe=True`` (uploads, so the first synthesis
+        already uses the canonical copy) and on the background thread otherwise.
+        """
+        name = os.path.basename(path)
+        st = os.stat(path)
+        with self._lock:
+            self._store({"name": name, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "duration": None,
+                         "sample_rate": None, "sha256": None, "resampled_path": None, "indexed_at": time.time()})
+            self._db.commit()
+        for callback in self.on_change:
+            callback(path)
+        if probe:
+            self._probe(name)
+        else:
+            self._probe_queue.put(name)
+
+    def _needs_ingest(self, entry):
+        canonical = entry["resampled_path"]
+        return (entry["sha256"] is None or not canonical
+                or not canonical.endswith(f"_{self.ingest_tag}.npy") or not os.path.exists(canonical))
+
+    def _probe(self, name):
+        """Ingest one clip and record the result; returns False when it failed."""
+        path = os.path.join(self.input_dir, name)
+        try:
+            meta = probe_audio(path, self.resampled_dir, self.max_duration_s, self.target_dbfs)
+        except Exception as e:
+            print(f"⚠️ 参考音频索引失败: {path} ({e})")
+            return False
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return False
+            entry.update(meta)
+            self._store(entry)
+            self._db.commit()
+        # anything derived from the raw clip before ingest is stale now
+        for callback in self.on_change:
+            callback(path)
+        return True
+
+    def ingest_all(self, workers=4):
+        """Bulk import: index the directory and ingest every clip lacking a current canonical copy."""
+        self.refresh(force=True)
+        with self._lock:
+            pending = [name for name, entry in self._entries.items() if self._needs_ingest(entry)]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(self._probe, pending))
+        return sum(results), len(results) - sum(results)
+
+    def refresh(self, force=False):
+        """Rescan the directory if its mtime changed; returns True when it did."""
+        try:
+            dir_mtime = os.stat(self.input_dir).st_mtime_ns
+        except OSError:
+            return False
+        if not force and dir_mtime == self._dir_mtime_ns:
+            return False
+        self._dir_mtime_ns = dir_mtime
+        seen = set()
+        changed = []
+        with os.scandir(self.input_dir) as it:
+            for de in it:
+                if not de.is_file() or not is_audio_file(de.name):
+                    continue
+                seen.add(de.name)
+                st = de.stat()
+                with self._lock:
+                    entry = self._entries.get(de.name)
+                if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+                    changed.append(de.path)
+        with self._lock:
+            removed = [name for name in self._entries if name not in seen]
+            for name in removed:
+                del self._entries[name]
+                self._db.execute("DELETE FROM refs WHERE name = ?", (name,))
+            self._db.commit()
+        for path in changed:
+            self.upsert(path)
+        return bool(changed or removed)
+
+    def _probe_loop(self):
+        while not self._stopped.is_set():
+            try:
+                name = self._probe_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            self._probe(name)
+
+    def _watch_loop(self):
+        polls = 0
+        while not self._stopped.wait(self.poll_interval):
+            polls += 1
+            try:
+                # in-place overwrites do not touch the directory mtime; catch them with a periodic full scan
+                self.refresh(force=polls % 60 == 0)
+            except OSError as e:
+                print(f"⚠️ 参考音频目录扫描失败: {e}")
+
+    def notify(self, *paths):
+        """Note filesystem events; only audio files schedule a rescan, coalesced by ``_event_loop``."""
+        if any(path and is_audio_file(os.fsdecode(path)) for path in paths):
+            self._changed.set()
+
+    def _event_loop(self):
+        while not self._stopped.is_set():
+            if not self._changed.wait(timeout=1.0):
+                continue
+            # a bulk copy fires one event per file: rescan once per burst
+            self._stopped.wait(EVENT_DEBOUNCE_S)
+            self._changed.clear()
+            try:
+                self.refresh(force=True)
+            except OSError as e:
+                print(f"⚠️ 参考音频目录扫描失败: {e}")
+
+    def _start_inotify(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+        library = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    library.notify(event.src_path, getattr(event, "dest_path", None))
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.input_dir, recursive=False)
+        observer.daemon = True
+        observer.start()
+        return True
+
+    def start(self):
+        """Index the directory once, then keep the index current in the background."""
+        self.refresh(force=True)
+        with self._lock:
+            for name, entry in self._entries.items():
+                # also re-ingests clips processed with other settings
+                if self._needs_ingest(entry):
+                    self._probe_queue.put(name)
+        targets = [self._probe_loop]
+        targets.append(self._event_loop if self._start_inotify() else self._watch_loop)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True, name=f"ref-library-{target.__name__.strip('_')}")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,179 @@
+"""Content-addressed cache of synthesis results.
+
+Deterministic requests (``do_sample=False`` or a fixed seed) with the same
+reference clip, text and parameters always produce the same audio, yet each one
+re-ran GPT decoding and BigVGAN. Results are stored on disk under a canonical
+hash of (reference hash + model version, sentence token ids, generation kwargs)
+at two levels: whole outputs, served instantly on a repeat, and single
+sentences, so a text that differs from a cached one by a sentence only
+re-synthesizes that sentence. Entries are evicted by age and by total size.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import torch
+
+FULL_DIRNAME = "full"
+SENTENCE_DIRNAME = "sentences"
+
+
+def make_key(**parts):
+    """Canonical sha256 of JSON-serializable key parts."""
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(gen_kwargs):
+    return not gen_kwargs.get("do_sample", True) or gen_kwargs.get("seed") is not None
+
+
+class ResultCache:
+    """Disk store of whole outputs (``full/<key>.wav``) and sentences (``sentences/<key>.pt``)."""
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, max_age_s=7 * 86400, sweep_interval_s=60):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.max_age_s = max_age_s
+        self.sweep_interval_s = sweep_interval_s
+        for dirname in (FULL_DIRNAME, SENTENCE_DIRNAME):
+            os.makedirs(os.path.join(root, dirname), exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = {}  # path -> [size, last_used]
+        self._bytes = 0
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.sentence_hits = 0
+        self.sentence_misses = 0
+
+    def load(self):
+        """Index the entries already on disk, then sweep; until then they miss.
+
+        Slow on a large cache, so the WebUI runs it in the background at startup.
+        """
+        for dirname in (FULL_DIRNAME, SENTENCE_DIRNAME):
+            with os.scandir(os.path.join(self.root, dirname)) as it:
+                for de in it:
+                    if de.is_file() and ".tmp" not in de.name:
+                        st = de.stat()
+                        with self._lock:
+                            # entries written since startup are indexed already
+                            if de.path not in self._index:
+                                self._index[de.path] = [st.st_size, st.st_mtime]
+                                self._bytes += st.st_size
+        self.sweep()
+        return self
+
+    def _path(self, dirname, key, ext):
+        return os.path.join(self.root, dirname, f"{key}{ext}")
+
+    def _touch(self, path):
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(path)
+            if entry is None:
+                return False
+            entry[1] = now
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            return False
+        return True
+
+    def _add(self, path):
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._index.get(path)
+            if old:
+                self._bytes -= old[0]
+            self._index[path] = [size, time.time()]
+            self._bytes += size
+        if time.time() - self._last_sweep > self.sweep_interval_s or self._bytes > self.max_bytes:
+            self.sweep()
+
+    def copy_result(self, key, dest_path):
+        """Copy a cached whole output to ``dest_path``; returns False on a miss.
+
+        A sweep may delete the entry between the lookup and the copy, which
+        counts as a miss as well.
+        """
+        path = self._path(FULL_DIRNAME, key, ".wav")
+        hit = self._touch(path)
+        if hit:
+            try:
+                shutil.copyfile(path, dest_path)
+            except FileNotFoundError:
+                hit = False
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit
+
+    def put_result(self, key, src_path):
+        """Copy a finished output into the cache; returns ``src_path``."""
+        path = self._path(FULL_DIRNAME, key, ".wav")
+        tmp_path = f"{path}.tmp{threading.get_ident()}"
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        self._add(path)
+        return src_path
+
+    def get_sentence(self, key):
+        """Cached ``[1, N]`` waveform of one sentence, or None."""
+        path = self._path(SENTENCE_DIRNAME, key, ".pt")
+        wav = None
+        if self._touch(path):
+            try:
+                wav = torch.load(path, map_location="cpu")
+            except Exception:
+                wav = None
+        with self._lock:
+            if wav is None:
+                self.sentence_misses += 1
+            else:
+                self.sentence_hits += 1
+        return wav
+
+    def put_sentence(self, key, wav):
+        path = self._path(SENTENCE_DIRNAME, key, ".pt")
+        tmp_path = f"{path}.tmp{threading.get_ident()}"
+        torch.save(wav, tmp_path)
+        os.replace(tmp_path, path)
+        self._add(path)
+
+    def sweep(self):
+        """Drop entries older than ``max_age_s``, then the least recently used over ``max_bytes``."""
+        now = time.time()
+        with self._lock:
+            self._last_sweep = now
+            by_age = sorted(self._index.items(), key=lambda item: item[1][1])
+            victims = []
+            for path, (size, last_used) in by_age:
+                if now - last_used > self.max_age_s or self._bytes > self.max_bytes:
+                    victims.append(path)
+                    self._bytes -= size
+                    del self._index[path]
+        for path in victims:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(victims)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "sentence_hits": self.sentence_hits,
+                "sentence_misses": self.sentence_misses,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,96 @@
+"""Startup phase timing and readiness tracking for the WebUI.
+
+Loading the checkpoints takes long enough that orchestrator health checks time
+out if the port is only bound afterwards. The WebUI can instead bind right away
+and load models in a background thread; ``Readiness`` tells ``/healthz`` (process
+up) apart from ``/readyz`` (models loaded and warmed) and ``StartupTimer``
+records how long each startup phase took.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class NotReadyError(RuntimeError):
+    """Raised by ``Readiness.check`` while models are loading or after loading failed."""
+
+
+class StartupTimer:
+    def __init__(self, started_at=None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.phases = OrderedDict()  # name -> seconds
+        self.current = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        self.current = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = round(time.perf_counter() - start, 3)
+            self.current = None
+
+    def mark(self, name, since=None):
+        """Record a phase that ran from ``since`` (default: process start) until now."""
+        with self._lock:
+            self.phases[name] = round(time.perf_counter() - (since if since is not None else self.started_at), 3)
+
+    def report(self):
+        with self._lock:
+            return {
+                "phases": dict(self.phases),
+                "current": self.current,
+                "elapsed": round(time.perf_counter() - self.started_at, 3),
+            }
+
+
+class Readiness:
+    def __init__(self, timer):
+        self.timer = timer
+        self.error = None
+        self._ready = threading.Event()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def run(self, load_fn):
+        """Run ``load_fn`` in this thread; raises if it fails."""
+        try:
+            load_fn()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            raise
+        self.timer.mark("ready")
+        self._ready.set()
+
+    def start(self, load_fn):
+        """Run ``load_fn`` in a background thread; failures are kept for ``/readyz``."""
+
+        def target():
+            try:
+                self.run(load_fn)
+            except Exception as e:
+                print(f"❌ 模型加载失败: {e}")
+
+        thread = threading.Thread(target=target, daemon=True, name="model-loader")
+        thread.start()
+        return thread
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def check(self):
+        if self.ready:
+            return
+        if self.error:
+            raise NotReadyError(f"模型加载失败：{self.error}")
+        phase = self.timer.current or "starting"
+        raise NotReadyError(f"模型加载中（{phase}），请稍后重试")
+
+    def status(self):
+        return {"ready": self.ready, "error": self.error, **self.timer.report()}
@@ -0,0 +1,103 @@
+"""CPU stand-ins for IndexTTS, for exercising the WebUI extensions without checkpoints.
+
+The stubs sleep for a time that grows with the padded batch size, the same way
+GPT decoding does, and return sine tones whose length follows the token count.
+That is enough to check scheduling, routing and concurrency behaviour on a
+laptop or in CI.
+"""
+import math
+import time
+import wave
+
+import torch
+
+from infer_stages import SAMPLING_RATE
+
+
+class StubBatchModel:
+    """Drop-in for ``batch_scheduler.PooledBatchModel``."""
+
+    def __init__(self, base_latency=0.05, per_token_latency=0.002, samples_per_token=960):
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.samples_per_token = samples_per_token
+        self.calls = []
+
+    def _tone(self, n_tokens, pitch=220.0):
+        n = max(1, n_tokens) * self.samples_per_token
+        t = torch.arange(n, dtype=torch.float32) / SAMPLING_RATE
+        return (0.3 * 32767 * torch.sin(2 * math.pi * pitch * t)).unsqueeze(0)
+
+    def synthesize_batch(self, cond_mel, token_id_lists, gen_kwargs):
+        longest = max(len(ids) for ids in token_id_lists)
+        self.calls.append([len(ids) for ids in token_id_lists])
+        # padded decoding: the whole batch costs as much as its longest row
+        time.sleep(self.base_latency + self.per_token_latency * longest)
+        return [self._tone(len(ids)) for ids in token_id_lists]
+
+
+class StubIndexTTS:
+    """Drop-in for ``IndexTTS`` exposing ``infer``/``infer_fast`` with a modelled cost.
+
+    Text is split into one-token-per-character sentences; each GPT decoding
+    batch sleeps in proportion to ``num_beams`` and to its longest row (text plus
+    generated mel tokens, capped by ``max_mel_tokens``), and a silent 16-bit WAV
+    of the matching length is written. Costs are deterministic, so benchmark
+    numbers from the stub are stable enough for CI regression thresholds.
+    """
+
+    MEL_TOKENS_PER_TEXT_TOKEN = 5
+    SAMPLES_PER_MEL_TOKEN = 1024
+
+    def __init__(self, base_latency=0.005, per_token_latency=0.00005, batch_overhead=0.15):
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.batch_overhead = batch_overhead
+        self.device = "cpu"
+        self.model_version = "stub"
+        self.gr_progress = None
+
+    @staticmethod
+    def split(text, max_text_tokens_per_sentence):
+        sentences, current = [], ""
+        for ch in text.strip():
+            current += ch
+            if ch in "。！？!?.；;\n" or len(current) >= max_text_tokens_per_sentence:
+                if current.strip():
+                    sentences.append(current.strip())
+                current = ""
+        if current.strip():
+            sentences.append(current.strip())
+        return sentences
+
+    def _decode(self, lengths, num_beams, max_mel_tokens):
+        """Sleep for one padded decoding batch; returns each row's mel token count."""
+        mel = [min(max_mel_tokens, n * self.MEL_TOKENS_PER_TEXT_TOKEN) for n in lengths]
+        longest = max(n + m for n, m in zip(lengths, mel))
+        batch_factor = 1 + self.batch_overhead * (len(lengths) - 1)
+        time.sleep(self.base_latency + self.per_token_latency * num_beams * longest * batch_factor)
+        return mel
+
+    def _write(self, output_path, mel_tokens):
+        with wave.open(output_path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLING_RATE)
+            f.writeframes(b"\0\0" * (sum(mel_tokens) * self.SAMPLES_PER_MEL_TOKEN))
+        return output_path
+
+    def infer(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_sentence=120,
+              num_beams=3, max_mel_tokens=600, **generation_kwargs):
+        mel = []
+        for sentence in self.split(text, max_text_tokens_per_sentence):
+            mel += self._decode([len(sentence)], num_beams, max_mel_tokens)
+        return self._write(output_path, mel)
+
+    def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_sentence=100,
+                   sentences_bucket_max_size=4, num_beams=3, max_mel_tokens=600, **generation_kwargs):
+        lengths = sorted(len(s) for s in self.split(text, max_text_tokens_per_sentence))
+        size = max(1, int(sentences_bucket_max_size))
+        mel = []
+        for i in range(0, len(lengths), size):
+            mel += self._decode(lengths[i:i + size], num_beams, max_mel_tokens)
+        return self._write(output_path, mel)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the WebUI extensions are top-level modules next to webui.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+import json
+
+from adaptive_bucket import DEFAULT_MB_PER_UNIT, OOM_HISTORY, BucketProfile, bin_key, plan_buckets
+
+GEN_KWARGS = {"num_beams": 1, "max_mel_tokens": 100}
+
+
+def run(bucket_size, tokens, peak_mb):
+    cost = bucket_size * (tokens // bucket_size + 100)
+    return {"bucket_size": bucket_size, "tokens": tokens, "cost": cost, "free_mb": 8000.0, "seconds": 1.0,
+            "peak_mb": peak_mb}
+
+
+def oom(bucket_size, tokens, free_mb):
+    return {"bucket_size": bucket_size, "tokens": tokens, "cost": bucket_size * (tokens // bucket_size + 100),
+            "free_mb": free_mb, "oom": True}
+
+
+def test_oom_bounds_only_its_own_bin(tmp_path):
+    profile = BucketProfile(str(tmp_path / "profile.json"))
+    profile.record([run(2, 128, 100.0), run(4, 256, 200.0)])
+    measured = profile.mb_per_unit()
+    # free memory was misread as huge: the implied cost per unit is absurd
+    profile.record([oom(8, 512, 100000.0)])
+    params = profile.planner_params()
+    assert params["mb_per_unit"] == measured
+    assert params["bin_mb_per_unit"][bin_key(8, 512)] > 100 * measured
+    assert params["bin_mb_per_unit"][bin_key(2, 128)] == 100.0 / run(2, 128, 0)["cost"]
+    # persisted that way too
+    assert BucketProfile(profile.path).planner_params() == params
+
+
+def test_oom_bounds_expire_with_successful_runs():
+    profile = BucketProfile()
+    profile.record([oom(8, 512, 100000.0) for _ in range(OOM_HISTORY + 3)])
+    assert len(profile.table[bin_key(8, 512)]["oom_mb_per_unit"]) == OOM_HISTORY
+    profile.record([run(8, 512, 900.0) for _ in range(OOM_HISTORY)])
+    assert profile.bin_mb_per_unit()[bin_key(8, 512)] == 900.0 / run(8, 512, 0)["cost"]
+    assert profile.stats()["oom_bins"] == 0
+
+
+def test_legacy_profile_drops_values_mixed_with_ooms(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps({
+        "4:256": {"runs": 3, "seconds": 3.0, "tokens": 768, "peak_mb": 200.0, "mb_per_unit": 0.3, "ooms": 0},
+        "8:512": {"runs": 0, "seconds": 0.0, "tokens": 0, "peak_mb": 0.0, "mb_per_unit": 500.0, "ooms": 1},
+    }))
+    profile = BucketProfile(str(path))
+    assert profile.mb_per_unit() == 0.3
+    assert bin_key(8, 512) not in profile.bin_mb_per_unit()
+
+
+def test_plan_uses_per_bin_cost():
+    lengths = [60] * 8
+    cheap = plan_buckets(lengths, GEN_KWARGS, cap=8, budget_mb=1000.0, unit_mb=lambda rows, tokens: DEFAULT_MB_PER_UNIT)
+    assert [len(bucket) for bucket in cheap] == [8]
+    # batches of more than 4 rows are known to be expensive; smaller ones are not
+    costly = plan_buckets(lengths, GEN_KWARGS, cap=8, budget_mb=1000.0,
+                          unit_mb=lambda rows, tokens: 10.0 if rows > 4 else DEFAULT_MB_PER_UNIT)
+    assert [len(bucket) for bucket in costly] == [4, 4]
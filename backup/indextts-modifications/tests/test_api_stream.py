@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from api_stream import Lease, LeasedStreamingResponse, RequestCancelled, cancel_progress, iterate_in_thread
+
+SCOPE = {"type": "http", "asgi": {"spec_version": "2.4"}}
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+def run_stream(fail_on, items=10):
+    """Serve a leased sentence stream to a client whose ``send`` fails at message ``fail_on``."""
+    returned = threading.Event()
+    produced = []
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def sentences():
+        for i in range(items):
+            time.sleep(0.01)
+            produced.append(i)
+            yield b"x"
+
+    async def main():
+        lease = Lease(returned.set)
+        cancel = threading.Event()
+
+        async def body():
+            try:
+                async for chunk in iterate_in_thread(sentences, cancel, executor, lease):
+                    yield chunk
+            finally:
+                cancel.set()
+
+        sent = []
+
+        async def send(message):
+            if len(sent) == fail_on:
+                raise OSError("client went away")
+            sent.append(message)
+
+        response = LeasedStreamingResponse(body(), lease, media_type="audio/wav")
+        try:
+            await response(SCOPE, receive, send)
+        except ClientDisconnect:
+            pass
+        return sent
+
+    sent = asyncio.run(main())
+    assert returned.wait(5), "lease was not returned"
+    executor.shutdown()
+    return sent, produced
+
+
+def test_lease_returned_after_complete_stream():
+    sent, produced = run_stream(fail_on=None, items=3)
+    assert len(produced) == 3
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_lease_returned_when_client_leaves_before_first_chunk():
+    _, produced = run_stream(fail_on=1)
+    # synthesis stopped at the next sentence instead of running to the end
+    assert len(produced) < 10
+
+
+def test_lease_returned_when_body_never_iterated():
+    _, produced = run_stream(fail_on=0)
+    assert produced == []
+
+
+def test_lease_waits_for_every_holder():
+    returned = []
+    lease = Lease(lambda: returned.append(True))
+    lease.hold()
+    lease.release()
+    assert not lease.returned
+    lease.release()
+    assert lease.returned and returned == [True]
+    with pytest.raises(RuntimeError):
+        lease.hold()
+
+
+def test_cancel_progress_raises_once_cancelled():
+    cancel = threading.Event()
+    progress = cancel_progress(cancel)
+    progress(0.5, desc="合成分句 1/2")
+    cancel.set()
+    with pytest.raises(RequestCancelled):
+        progress(1.0)
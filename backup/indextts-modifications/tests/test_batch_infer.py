@@ -0,0 +1,91 @@
+import argparse
+import json
+import threading
+
+import torch
+
+from batch_infer import BatchRunner, split_rows
+from stub_tts import StubIndexTTS
+
+
+class CountingTTS(StubIndexTTS):
+    def __init__(self):
+        super().__init__(base_latency=0.02, per_token_latency=0)
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def infer(self, *args, **kwargs):
+        with self._lock:
+            self.rows += 1
+        return super().infer(*args, **kwargs)
+
+
+def make_runner(tmp_path, rows, workers):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("\n".join(json.dumps(row, ensure_ascii=False) for row in rows), encoding="utf-8")
+    (tmp_path / "narrator.wav").write_bytes(b"RIFF")
+    args = argparse.Namespace(manifest=str(manifest), out_dir=str(tmp_path / "out"), prompt_dir=str(tmp_path),
+                              window=100, cond_cache_mb=16, verbose=False)
+    (tmp_path / "out").mkdir()
+    runner = BatchRunner(args, [CountingTTS() for _ in range(workers)])
+    runner.cond_cache.compute_fn = lambda path: torch.zeros(1, 100, 8)
+    return runner
+
+
+def test_split_rows():
+    assert split_rows(list(range(7)), 3) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert split_rows([1], 4) == [[1]]
+    assert split_rows([], 2) == []
+
+
+def test_single_voice_uses_every_worker(tmp_path):
+    rows = [{"id": f"r{i}", "prompt_audio": "narrator.wav", "text": f"第{i}句。"} for i in range(8)]
+    runner = make_runner(tmp_path, rows, workers=2)
+    assert runner.run()
+    assert runner.done == 8
+    assert [tts.rows for tts in runner.models] == [4, 4]
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    rows = [
+        {"id": "a", "prompt_audio": "narrator.wav", "text": "第一句。"},
+        {"id": "a", "prompt_audio": "narrator.wav", "text": "另一句。"},
+        {"id": "a", "prompt_audio": "narrator.wav", "text": "第一句。"},
+        {"id": "b", "prompt_audio": "narrator.wav", "text": "第二句。"},
+    ]
+    runner = make_runner(tmp_path, rows, workers=1)
+    assert not runner.run()
+    assert (runner.done, runner.skipped, runner.failed) == (2, 1, 1)
+    ledger = [json.loads(line) for line in (tmp_path / "out" / "_done.jsonl").read_text().splitlines()]
+    assert sorted(entry["line"] for entry in ledger) == [1, 4]
+
+
+def test_worker_survives_a_failing_ledger(tmp_path, monkeypatch):
+    rows = [{"id": f"r{i}", "prompt_audio": f"voice{i}.wav", "text": f"第{i}句。"} for i in range(6)]
+    for i in range(6):
+        (tmp_path / f"voice{i}.wav").write_bytes(b"RIFF")
+    runner = make_runner(tmp_path, rows, workers=1)
+
+    def is_done(key, output_path):
+        raise OSError("ledger unreadable")
+
+    monkeypatch.setattr(runner.ledger, "is_done", is_done)
+    # more groups than the bounded queue holds: a dead worker would block run() forever
+    done = threading.Event()
+    result = []
+    thread = threading.Thread(target=lambda: (result.append(runner.run()), done.set()), daemon=True)
+    thread.start()
+    assert done.wait(10)
+    assert result == [False] and runner.failed == 6
+
+
+def test_unexpected_group_error_fails_its_rows(tmp_path, monkeypatch):
+    rows = [{"id": f"r{i}", "prompt_audio": "narrator.wav", "text": f"第{i}句。"} for i in range(3)]
+    runner = make_runner(tmp_path, rows, workers=1)
+
+    def broken(tts, voice, rows):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(runner, "_synthesize_group", broken)
+    assert not runner.run()
+    assert runner.failed == 3
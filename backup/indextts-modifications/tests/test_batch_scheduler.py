@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from batch_scheduler import BatchScheduler, _Segment
+from stub_tts import StubBatchModel
+
+GEN_KWARGS = {"num_beams": 1, "max_mel_tokens": 100}
+
+
+class VoiceModel(StubBatchModel):
+    """Stub whose latency and failures depend on the voice (``cond_mel`` is the voice name here)."""
+
+    def __init__(self, slow=(), failing=()):
+        super().__init__(base_latency=0.01, per_token_latency=0)
+        self.slow = slow
+        self.failing = failing
+        self.voices = []
+
+    def synthesize_batch(self, cond_mel, token_id_lists, gen_kwargs):
+        self.voices.append(cond_mel)
+        if cond_mel in self.failing:
+            raise RuntimeError(f"{cond_mel} failed")
+        if cond_mel in self.slow:
+            time.sleep(1.0)
+        return super().synthesize_batch(cond_mel, token_id_lists, gen_kwargs)
+
+
+def segment(voice, length, **gen_kwargs):
+    gen_kwargs = {**GEN_KWARGS, **gen_kwargs}
+    return _Segment((voice, tuple(sorted(gen_kwargs.items())), 0), voice, [1] * length, gen_kwargs)
+
+
+def test_plan_groups_by_voice_and_params():
+    scheduler = BatchScheduler(StubBatchModel(), max_batch_size=8)
+    segments = [segment("a", 5), segment("b", 5), segment("a", 7), segment("a", 6, temperature=0.5),
+                segment("b", 3)]
+    batches = scheduler.plan_batches(segments)
+    shapes = sorted((batch[0].cond_mel, batch[0].gen_kwargs.get("temperature", 1.0), [len(s.token_ids) for s in batch])
+                    for batch in batches)
+    assert shapes == [("a", 0.5, [6]), ("a", 1.0, [5, 7]), ("b", 1.0, [3, 5])]
+
+
+def test_plan_splits_at_max_batch_tokens():
+    # each row costs 1 beam * (10 text + 100 mel) = 110 units
+    scheduler = BatchScheduler(StubBatchModel(), max_batch_size=8, max_batch_tokens=250)
+    batches = scheduler.plan_batches([segment("a", 10) for _ in range(5)])
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    model = StubBatchModel(base_latency=0, per_token_latency=0)
+    scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=100).start()
+    try:
+        start = time.monotonic()
+        futures = scheduler.submit("a", None, [[1, 2], [3]], GEN_KWARGS)
+        assert all(f.result(timeout=5) is not None for f in futures)
+        assert time.monotonic() - start >= 0.09
+        assert model.calls == [[1, 2]]
+    finally:
+        scheduler.stop()
+
+
+def test_full_batch_does_not_wait():
+    scheduler = BatchScheduler(StubBatchModel(base_latency=0, per_token_latency=0), max_batch_size=2,
+                               max_wait_ms=10000).start()
+    try:
+        futures = scheduler.submit("a", None, [[1], [2]], GEN_KWARGS)
+        assert all(f.result(timeout=5) is not None for f in futures)
+    finally:
+        scheduler.stop()
+
+
+def test_exception_reaches_only_its_batch():
+    scheduler = BatchScheduler(VoiceModel(failing=("bad",)), max_wait_ms=50)
+    good = scheduler.submit("good", "good", [[1], [2]], GEN_KWARGS)
+    bad = scheduler.submit("bad", "bad", [[1]], GEN_KWARGS)
+    scheduler.start()
+    try:
+        assert all(f.result(timeout=5) is not None for f in good)
+        with pytest.raises(RuntimeError, match="bad failed"):
+            bad[0].result(timeout=5)
+    finally:
+        scheduler.stop()
+
+
+def test_cancelled_futures_are_not_synthesized():
+    model = StubBatchModel(base_latency=0, per_token_latency=0)
+    scheduler = BatchScheduler(model, max_wait_ms=50)
+    futures = scheduler.submit("a", None, [[1], [1, 2], [1, 2, 3]], GEN_KWARGS)
+    assert futures[1].cancel()
+    scheduler.start()
+    try:
+        assert futures[0].result(timeout=5) is not None and futures[2].result(timeout=5) is not None
+        assert futures[1].cancelled()
+        assert model.calls == [[1, 3]]
+    finally:
+        scheduler.stop()
+
+
+def test_long_batch_does_not_block_new_segments():
+    model = VoiceModel(slow=("slow",))
+    scheduler = BatchScheduler(model, max_wait_ms=10, concurrency=2).start()
+    try:
+        slow = scheduler.submit("slow", "slow", [[1]], GEN_KWARGS)
+        time.sleep(0.2)  # the slow batch is running now
+        fast = scheduler.submit("fast", "fast", [[1]], GEN_KWARGS)
+        assert fast[0].result(timeout=0.8) is not None
+        assert not slow[0].done()
+        slow[0].result(timeout=5)
+    finally:
+        scheduler.stop()
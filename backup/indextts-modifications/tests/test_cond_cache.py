@@ -0,0 +1,87 @@
+import os
+import time
+
+import torch
+
+from cond_cache import ConditioningCache
+
+
+def make_cache(tmp_path, **kwargs):
+    calls = []
+
+    def compute(path):
+        calls.append(path)
+        with open(path, "rb") as f:
+            return torch.full((1, 100, 8), float(len(f.read())))
+
+    cache = ConditioningCache(str(tmp_path / "store"), "1.0", compute_fn=compute, **kwargs)
+    return cache, calls
+
+
+def clip(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_memory_lru_is_bounded_by_bytes(tmp_path):
+    # each mel is 1 * 100 * 8 float32 = 3200 bytes
+    cache, calls = make_cache(tmp_path, max_bytes=7000)
+    a, b, c = (clip(tmp_path, f"{n}.wav", n.encode() * 10) for n in "abc")
+    cache.get(a)
+    cache.get(b)
+    cache.get(a)  # a is now the most recently used
+    cache.get(c)
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] == 6400
+    cache.get(a)
+    assert cache.stats()["hits"] == 2
+    cache.get(b)  # evicted from memory, still on disk
+    assert cache.stats()["disk_hits"] == 1
+    assert len(calls) == 3
+
+
+def test_disk_hit_survives_restart(tmp_path):
+    cache, calls = make_cache(tmp_path)
+    path = clip(tmp_path, "voice.wav", b"x" * 40)
+    first = cache.get(path)
+    restarted, restarted_calls = make_cache(tmp_path)
+    assert torch.equal(restarted.get(path), first)
+    assert restarted.stats()["disk_hits"] == 1 and restarted_calls == []
+
+
+def test_same_content_shares_an_entry(tmp_path):
+    cache, calls = make_cache(tmp_path)
+    cache.get(clip(tmp_path, "a.wav", b"same"))
+    cache.get(clip(tmp_path, "b.wav", b"same"))
+    assert len(calls) == 1
+
+
+def test_invalidate_after_restart(tmp_path):
+    cache, _ = make_cache(tmp_path)
+    path = clip(tmp_path, "voice.wav", b"old content")
+    key = cache.key_for(path)
+    cache.get(path)
+    # the clip is replaced while the WebUI is down; the new process never hashed the old content
+    restarted, calls = make_cache(tmp_path)
+    clip(tmp_path, "voice.wav", b"new content")
+    restarted.invalidate(path)
+    assert not os.path.exists(restarted._disk_path(key))
+    assert restarted.get(path)[0, 0, 0].item() == len(b"new content")
+    assert calls == [path]
+
+
+def test_sweep_caps_disk_bytes_and_age(tmp_path):
+    cache, _ = make_cache(tmp_path, max_disk_bytes=0, max_age_s=3600, sweep_interval_s=3600)
+    paths = [clip(tmp_path, f"{i}.wav", bytes([i]) * (i + 1)) for i in range(4)]
+    for path in paths:
+        cache.get(path)
+    disk = [cache._disk_path(cache.key_for(path)) for path in paths]
+    old = time.time() - 7200
+    os.utime(disk[0], (old, old))
+    for i, stale in enumerate(disk[1:], start=1):
+        os.utime(stale, (old + 3600 + i * 60,) * 2)
+    entry_bytes = os.path.getsize(disk[1])
+    cache.max_disk_bytes = 2 * entry_bytes
+    # the expired entry goes, then the least recently used one above the cap
+    assert cache.sweep() == 2
+    assert [os.path.exists(p) for p in disk] == [False, False, True, True]
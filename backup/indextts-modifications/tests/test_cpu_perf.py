@@ -0,0 +1,74 @@
+import numpy as np
+import torch
+
+import cpu_perf
+
+
+class Conv1D(torch.nn.Module):
+    """Same layout as the HF GPT-2 projection: ``x @ W + b`` with ``W`` of shape [in, out]."""
+
+    def __init__(self, n_out, n_in):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.randn(n_in, n_out))
+        self.bias = torch.nn.Parameter(torch.randn(n_out))
+
+    def forward(self, x):
+        return x @ self.weight + self.bias
+
+
+def fake_tts(device="cpu"):
+    gpt = torch.nn.Module()
+    gpt.gpt = torch.nn.Sequential(Conv1D(32, 16), torch.nn.GELU(), torch.nn.Sequential(Conv1D(8, 32)))
+    return type("TTS", (), {"device": device, "gpt": gpt})()
+
+
+def naive_dtw(a, b):
+    cost = np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).mean(axis=2))
+    acc = np.full((len(a) + 1, len(b) + 1), np.inf)
+    acc[0, 0] = 0.0
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            acc[i, j] = cost[i - 1, j - 1] + min(acc[i - 1, j - 1], acc[i - 1, j], acc[i, j - 1])
+    return acc[-1, -1] / max(len(a), len(b))
+
+
+def test_conv1d_projections_become_equivalent_linears():
+    torch.manual_seed(0)
+    tts = fake_tts()
+    x = torch.randn(4, 16)
+    expected = tts.gpt.gpt(x)
+    cpu_perf._conv1d_to_linear(tts.gpt.gpt)
+    assert isinstance(tts.gpt.gpt[0], torch.nn.Linear) and isinstance(tts.gpt.gpt[2][0], torch.nn.Linear)
+    assert torch.allclose(tts.gpt.gpt(x), expected, atol=1e-5)
+
+
+def test_quantized_gpt_stays_close():
+    torch.manual_seed(0)
+    tts = fake_tts()
+    x = torch.randn(4, 16)
+    with torch.no_grad():
+        expected = tts.gpt.gpt(x)
+        cpu_perf.optimize(tts, "quantize")
+        assert isinstance(tts.gpt.gpt[2][0], torch.ao.nn.quantized.dynamic.Linear)
+        assert float((tts.gpt.gpt(x) - expected).abs().max()) < 0.1 * float(expected.abs().max())
+
+
+def test_optimize_leaves_other_modes_and_devices_alone():
+    for tts in (cpu_perf.optimize(fake_tts(), "none"), cpu_perf.optimize(fake_tts("cuda:0"), "full")):
+        assert isinstance(tts.gpt.gpt[0], Conv1D)
+
+
+def test_dtw_distance_matches_the_quadratic_recurrence():
+    rng = np.random.default_rng(0)
+    for n, m in ((1, 5), (7, 7), (12, 9), (9, 15)):
+        a, b = rng.normal(size=(n, 4)), rng.normal(size=(m, 4))
+        assert np.isclose(cpu_perf.dtw_spectral_distance(a, b), naive_dtw(a, b))
+
+
+def test_dtw_distance_ignores_timing_changes():
+    rng = np.random.default_rng(0)
+    a = rng.normal(size=(20, 80))
+    stretched = np.repeat(a, 2, axis=0)
+    assert cpu_perf.dtw_spectral_distance(a, stretched) == 0.0
+    assert cpu_perf.spectral_distance(a, stretched) > 1.0
+    assert cpu_perf.spectral_distance(a, a + 1.0) == 1.0
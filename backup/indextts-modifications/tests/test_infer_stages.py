@@ -0,0 +1,67 @@
+import struct
+
+import numpy as np
+import torch
+
+import infer_stages
+from adaptive_bucket import adaptive_wavs
+
+
+def test_stream_header_and_pcm_chunks_form_a_wav():
+    sentences = [torch.tensor([[0.0, 1000.0, -1000.0]]), torch.tensor([[32767.0, -32767.0]])]
+    body = infer_stages.wav_stream_header() + b"".join(infer_stages.to_pcm16(wav).tobytes() for wav in sentences)
+    riff, _, wave, fmt, fmt_size, pcm, channels, rate, byte_rate, align, bits, data, data_size = struct.unpack(
+        "<4sI4s4sIHHIIHH4sI", body[:44])
+    assert (riff, wave, fmt, data) == (b"RIFF", b"WAVE", b"fmt ", b"data")
+    assert (pcm, channels, rate, bits, align) == (1, 1, infer_stages.SAMPLING_RATE, 16, 2)
+    assert byte_rate == rate * align and data_size == 0xFFFFFFFF  # length unknown while streaming
+    samples = np.frombuffer(body[44:], dtype="<i2")
+    assert samples.tolist() == [0, 1000, -1000, 32767, -32767]
+
+
+def test_sentences_are_yielded_as_they_are_vocoded(monkeypatch):
+    synthesized = []
+
+    def synthesize_batch(tts, cond_mel, token_id_lists, seed=None, **kwargs):
+        synthesized.append(token_id_lists)
+        return [torch.zeros(1, len(ids)) for ids in token_id_lists]
+
+    monkeypatch.setattr(infer_stages, "synthesize_batch", synthesize_batch)
+    tts = type("TTS", (), {"device": "cpu"})()
+    wavs = infer_stages.iter_sentence_wavs(tts, torch.zeros(1, 100, 8), [[1], [2, 3], [4, 5, 6]])
+    first = next(wavs)
+    # only the first sentence has been synthesized when its audio is handed out
+    assert first.shape == (1, 1) and synthesized == [[[1]]]
+    assert [wav.shape[-1] for wav in wavs] == [2, 3]
+
+
+def sampling_stubs(monkeypatch):
+    """GPT decoding that samples from the global torch RNG, one row of "codes" per sentence."""
+
+    def generate_codes(tts, cond_mel, token_id_lists, **kwargs):
+        codes = torch.rand(len(token_id_lists), 4)
+        return [torch.tensor([ids]) for ids in token_id_lists], codes, torch.full((len(token_id_lists),), 4)
+
+    monkeypatch.setattr(infer_stages, "generate_codes", generate_codes)
+    monkeypatch.setattr(infer_stages, "codes_to_latent", lambda tts, cond_mel, tokens, codes, code_len: codes)
+    monkeypatch.setattr(infer_stages, "vocode", lambda tts, cond_mel, latent: latent)
+    tts = type("TTS", (), {"device": "cpu", "_set_gr_progress": lambda self, value, desc=None: None})()
+    return tts, torch.zeros(1, 100, 8)
+
+
+def test_seeded_sentence_audio_does_not_depend_on_its_batch(monkeypatch):
+    tts, cond_mel = sampling_stubs(monkeypatch)
+    sentences = [[1, 2], [3], [4, 5, 6], [7, 8]]
+    cold = infer_stages.synthesize_batch(tts, cond_mel, sentences, seed=42, do_sample=True)
+    # a partial result-cache hit only synthesizes the missing sentences
+    partial = infer_stages.synthesize_batch(tts, cond_mel, [sentences[1], sentences[3]], seed=42, do_sample=True)
+    assert torch.equal(partial[0], cold[1]) and torch.equal(partial[1], cold[3])
+    routes = [
+        list(infer_stages.iter_sentence_wavs(tts, cond_mel, sentences, seed=42, do_sample=True)),
+        infer_stages.synthesize_buckets(tts, cond_mel, sentences, 3, seed=42, do_sample=True),
+        adaptive_wavs(tts, cond_mel, sentences, seed=42, do_sample=True)[0],
+    ]
+    for wavs in routes:
+        assert all(torch.equal(a, b) for a, b in zip(wavs, cold))
+    other_seed = infer_stages.synthesize_batch(tts, cond_mel, sentences, seed=7, do_sample=True)
+    assert not torch.equal(other_seed[0], cold[0])
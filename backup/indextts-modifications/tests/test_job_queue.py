@@ -0,0 +1,128 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import job_queue
+from job_queue import JobQueue
+
+
+def wait_for(queue, job_id, status, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] == status:
+            return job
+        queue.wait(job_id, timeout=0.05)
+    raise AssertionError(f"job {job_id} is {queue.get(job_id)['status']}, expected {status}")
+
+
+def test_cancel_job_left_running_by_a_crash(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    job_id = JobQueue(db_path, run_fn=None).submit({"text": "你好"}, 2)
+    with sqlite3.connect(db_path) as db:
+        db.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+
+    ran = []
+    queue = JobQueue(db_path, run_fn=lambda job, progress: ran.append(job["id"]) or ("out.wav", 1.0),
+                     poll_interval=0.05)
+    assert queue.cancel(job_id)
+    assert queue.get(job_id)["status"] == "cancelled"
+    assert not queue.cancel(job_id)
+    queue.start()
+    try:
+        time.sleep(0.2)
+    finally:
+        queue.stop()
+    assert ran == []
+
+
+def test_pending_encode_does_not_hold_the_runner(tmp_path):
+    encodes = {}
+    second_ran = threading.Event()
+
+    def run_fn(job, progress):
+        if job["payload"]["name"] == "second":
+            second_ran.set()
+            return "second.wav", 1.0
+        encodes[job["id"]] = Future()
+        return encodes[job["id"]], 2.0
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), run_fn, poll_interval=0.05)
+    first = queue.submit({"name": "first"}, 10)
+    second = queue.submit({"name": "second"}, 10)
+    queue.start(concurrency=1)
+    try:
+        # the only runner went on to the next job while the first one is still encoding
+        assert second_ran.wait(5)
+        wait_for(queue, second, "done")
+        assert queue.get(first)["status"] == "running"
+        encodes[first].set_result("first.mp3")
+        job = wait_for(queue, first, "done")
+        assert (job["result_path"], job["audio_seconds"]) == ("first.mp3", 2.0)
+    finally:
+        queue.stop()
+
+
+def test_failed_encode_fails_the_job(tmp_path):
+    encode = Future()
+    encode.set_exception(RuntimeError("encoding mp3 requires ffmpeg"))
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lambda job, progress: (encode, 1.0), poll_interval=0.05)
+    job_id = queue.submit({}, 1)
+    queue.start()
+    try:
+        assert "ffmpeg" in wait_for(queue, job_id, "failed")["error"]
+    finally:
+        queue.stop()
+
+
+def test_waiters_wake_only_for_their_own_job(tmp_path):
+    release = threading.Event()
+    reports = threading.Event()
+
+    def run(job, progress):
+        while not release.is_set():
+            progress(0.5, "合成分句")
+            reports.set()
+            time.sleep(0.005)
+        return "out.wav", 1.0
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), run, poll_interval=0.05).start()
+    try:
+        running = queue.submit({"text": "a"}, 1, priority="bulk")
+        queued = queue.submit({"text": "b"}, 1, priority="bulk")
+        wait_for(queue, running, "running")
+        assert reports.wait(5)
+        start = time.monotonic()
+        job = queue.wait(running, timeout=5)
+        assert time.monotonic() - start < 1 and job["stage"] == "合成分句"
+        # hundreds of progress reports of the running job do not wake the queued job's waiter
+        start = time.monotonic()
+        job = queue.wait(queued, timeout=0.3)
+        assert time.monotonic() - start >= 0.29
+        assert (job["status"], job["position"]) == ("queued", 0)
+        release.set()
+        wait_for(queue, queued, "done")
+        assert queue._watchers == {}
+    finally:
+        release.set()
+        queue.stop()
+
+
+def test_queue_positions_are_computed_at_a_bounded_rate(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "POSITION_REFRESH_S", 60)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), run_fn=None)
+    computed = []
+    compute = queue._compute_positions
+    queue._compute_positions = lambda: computed.append(1) or compute()
+    ids = [queue.submit({"text": "x" * n}, n, priority="bulk") for n in (40, 10, 20)]
+    jobs = [queue.get(job_id) for job_id in ids]
+    assert [job["position"] for job in jobs] == [0, 1, 2]
+    assert jobs[0]["eta_s"] == 0 and jobs[1]["eta_s"] < jobs[2]["eta_s"]
+    for _ in range(100):
+        for job_id in ids:
+            queue.get(job_id)
+    assert len(computed) == 1
+    # a job submitted after the snapshot gets a fresh one
+    assert queue.get(queue.submit({"text": "y"}, 1, priority="bulk"))["position"] == 3
+    assert len(computed) == 2
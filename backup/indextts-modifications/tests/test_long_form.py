@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import torch
+
+from long_form import ChapterCheckpoint, CrossfadeWriter, prune_jobs, split_chapters, synthesize_document
+
+
+def test_chapters_break_at_headings_and_lines():
+    text = "序言\n\n第一章 开始\n第一行。\n第二行。\n第二章 继续\n结尾。"
+    assert split_chapters(text, max_chars=100) == ["序言", "第一章 开始\n第一行。\n第二行。", "第二章 继续\n结尾。"]
+
+
+def test_unbroken_text_is_cut_at_sentence_ends():
+    sentence = "他说：“今天天气很好。”我们出去走走吧！"
+    text = sentence * 50
+    chapters = split_chapters(text, max_chars=100)
+    assert len(chapters) > 1
+    assert all(len(chapter) <= 100 for chapter in chapters)
+    assert all(chapter.endswith("吧！") for chapter in chapters)
+    assert "".join(chapters) == text
+
+
+def test_english_sentences_keep_decimals():
+    text = "Pi is about 3.14 and that is fine. " * 20
+    chapters = split_chapters(text, max_chars=80)
+    assert all(len(chapter) <= 80 and chapter.endswith("fine. ") for chapter in chapters)
+    assert "".join(chapters) == text
+
+
+def test_sentence_longer_than_a_chapter_is_hard_cut():
+    text = "好" * 250
+    assert [len(chapter) for chapter in split_chapters(text, max_chars=100)] == [100, 100, 50]
+
+
+def write_tone(path, value, frames=2400):
+    writer = CrossfadeWriter(path)
+    writer.write(torch.full((1, frames), float(value)))
+    return writer.close()
+
+
+def test_concurrent_writers_of_one_path_do_not_collide(tmp_path):
+    path = str(tmp_path / "chapter.wav")
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def write(value):
+        try:
+            writer = CrossfadeWriter(path)
+            barrier.wait(5)
+            writer.write(torch.full((1, 2400), float(value)))
+            writer.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert os.listdir(tmp_path) == ["chapter.wav"]
+
+
+def test_identical_documents_share_their_checkpoint(tmp_path):
+    root = str(tmp_path / "jobs")
+    chapters = ["第一章", "第二章", "第三章"]
+    synthesized = []
+    errors = []
+    both_running = threading.Barrier(2)
+
+    def synthesize_chapter(index, text, chapter_path):
+        synthesized.append(index)
+        time.sleep(0.05)
+        write_tone(chapter_path, index + 1)
+
+    def request(name):
+        try:
+            with ChapterCheckpoint(root, "same-key") as checkpoint:
+                both_running.wait(5)
+                synthesize_document(checkpoint, chapters, synthesize_chapter, str(tmp_path / name))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request, args=(f"out{i}.wav",)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    # the second request reused the chapters of the first instead of racing it
+    assert sorted(synthesized) == [0, 1, 2]
+    assert (tmp_path / "out0.wav").read_bytes() == (tmp_path / "out1.wav").read_bytes()
+    assert os.listdir(root) == []
+
+
+def test_checkpoint_kept_while_another_request_holds_it(tmp_path):
+    root = str(tmp_path / "jobs")
+    first = ChapterCheckpoint(root, "key")
+    with ChapterCheckpoint(root, "key") as second:
+        write_tone(second.chapter_path(0), 1)
+        synthesize_document(second, ["一"], lambda *args: None, str(tmp_path / "out.wav"))
+    assert first.done(0)
+    assert prune_jobs(root, max_age_s=1e-9) == 0
+    first.release()
+    assert not os.path.exists(first.dir)
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from metrics import Histogram, Metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency", "Latency.", (1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe(value, mode="infer")
+    assert histogram.render() == [
+        "# HELP latency Latency.",
+        "# TYPE latency histogram",
+        'latency_bucket{mode="infer",le="1"} 1',
+        'latency_bucket{mode="infer",le="5"} 2',
+        'latency_bucket{mode="infer",le="+Inf"} 3',
+        'latency_sum{mode="infer"} 12.5',
+        'latency_count{mode="infer"} 3',
+    ]
+
+
+def test_request_trace_renders_and_logs(tmp_path):
+    trace_path = tmp_path / "traces.jsonl"
+    metrics = Metrics(str(trace_path))
+    with metrics.trace("infer_fast", 4, 120) as trace:
+        with trace.span("tokenize"):
+            pass
+        trace.add_worker_timings({"spans": {"gpt_decode": 0.5}, "gpt_tokens": 100, "started_at": 0.0})
+        trace.audio_seconds = 2.0
+    with pytest.raises(ValueError):
+        with metrics.trace("infer"):
+            raise ValueError("text is empty")
+
+    text = metrics.render()
+    assert text.endswith("\n")
+    labels = 'bucket_size="4",infer_mode="infer_fast"'
+    assert f"indextts_request_seconds_count{{{labels}}} 1" in text
+    assert f'indextts_stage_seconds_count{{{labels},stage="gpt_decode"}} 1' in text
+    assert f"indextts_gpt_tokens_per_second_sum{{{labels}}} 200.0" in text
+    assert 'indextts_requests_total{infer_mode="infer_fast",status="ok"} 1.0' in text
+    assert 'indextts_requests_total{infer_mode="infer",status="ValueError"} 1.0' in text
+    assert 'indextts_audio_seconds_total{infer_mode="infer_fast"} 2.0' in text
+    # failed requests are counted, not timed
+    assert 'bucket_size="1"' not in text
+
+    records = [json.loads(line) for line in trace_path.read_text(encoding="utf-8").splitlines()]
+    assert [r["status"] for r in records] == ["ok", "ValueError"]
+    assert records[0]["gpt_tokens_per_s"] == 200.0 and records[0]["sentences"] is None
+    assert set(records[0]["spans"]) == {"tokenize", "gpt_decode"}
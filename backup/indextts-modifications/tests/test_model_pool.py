@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from model_pool import ModelPool, PoolBusyError, ThreadWorker
+from stub_tts import StubIndexTTS
+
+
+def make_pool(workers=2, max_pending=2):
+    return ModelPool([ThreadWorker(i, StubIndexTTS()) for i in range(workers)], max_pending=max_pending)
+
+
+def blocking_call(tts, started, release):
+    started.set()
+    release.wait(5)
+    return id(tts)
+
+
+def test_admission_limit_fails_fast():
+    pool = make_pool(max_pending=2)
+    pool.admit()
+    with pool.admission():
+        with pytest.raises(PoolBusyError):
+            pool.admit()
+    pool.admit()  # the context manager gave its slot back
+    pool.leave()
+    pool.leave()
+    stats = pool.stats()
+    assert (stats["pending"], stats["rejected"]) == (0, 1)
+
+
+def test_work_goes_to_the_least_loaded_worker():
+    pool = make_pool(workers=2)
+    started, release = threading.Event(), threading.Event()
+    busy = []
+    thread = threading.Thread(target=lambda: busy.append(pool.run(blocking_call, started, release)))
+    thread.start()
+    assert started.wait(5)
+    # worker 0 is busy, so the next call runs on worker 1 without waiting for it
+    free = pool.run(lambda tts: id(tts))
+    assert free == id(pool.workers[1].tts)
+    assert [w.inflight for w in pool.workers] == [1, 0]
+    release.set()
+    thread.join()
+    assert busy == [id(pool.workers[0].tts)]
+    assert [w.completed for w in pool.workers] == [1, 1]
+
+
+def test_stream_and_progress_relay():
+    pool = make_pool(workers=1)
+    reports = []
+
+    def sentences(tts, n):
+        for i in range(n):
+            tts.gr_progress(i / n, desc=f"{i}")
+            yield i
+
+    items = list(pool.stream(sentences, 3, progress=lambda value, desc=None: reports.append(desc)))
+    assert items == [0, 1, 2] and reports == ["0", "1", "2"]
+    assert pool.workers[0].tts.gr_progress is None
+
+
+def test_rejected_progress_aborts_the_call():
+    pool = make_pool(workers=1)
+
+    def reject(value, desc=None):
+        raise RuntimeError("cancelled")
+
+    def slow(tts):
+        tts.gr_progress(0.5)
+        return "finished"
+
+    with pytest.raises(RuntimeError, match="cancelled"):
+        pool.run(slow, progress=reject)
+    assert pool.run(lambda tts: "reusable") == "reusable"
+    assert pool.workers[0].inflight == 0
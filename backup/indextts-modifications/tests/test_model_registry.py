@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+import torch
+
+pytest.importorskip("omegaconf")
+
+import model_registry
+from model_pool import ModelPool, PoolBusyError, ThreadWorker
+from model_registry import ModelRegistry
+
+WEIGHTS = 250  # float32 parameters per loaded stand-in instance: 1000 bytes
+
+
+class StubFrontend:
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+
+
+class StubPool(ModelPool):
+    closed = []
+
+    @classmethod
+    def create(cls, model_dir, prepare=None, **kwargs):
+        tts = type("TTS", (), {})()
+        tts.device = "cpu"
+        tts.gpt = torch.nn.Linear(WEIGHTS - 1, 1)
+        pool = cls([ThreadWorker(0, tts)])
+        pool.model_dir = model_dir
+        return pool
+
+    def close(self):
+        StubPool.closed.append(self.model_dir)
+
+
+def make_model_dir(root, name):
+    model_dir = root / name
+    model_dir.mkdir()
+    (model_dir / "config.yaml").write_text("version: 1.5\ndataset:\n  bpe_model: bpe.model\n", encoding="utf-8")
+    (model_dir / "bpe.model").write_bytes(b"bpe")
+    # checkpoint sizes are the estimate of what a load adds
+    (model_dir / "gpt.pth").write_bytes(b"\0" * 900)
+    (model_dir / "bigvgan_generator.pth").write_bytes(b"\0" * 100)
+    return str(model_dir)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, "ModelPool", StubPool)
+    monkeypatch.setattr(model_registry, "TextFrontend", StubFrontend)
+    StubPool.closed = []
+    dirs = {name: make_model_dir(tmp_path, name) for name in ("a", "b", "c")}
+    registry = ModelRegistry(dirs, memory_budget_bytes=2500)
+    yield registry
+    registry.close()
+
+
+def loaded(registry):
+    return sorted(model.name for model in registry.loaded())
+
+
+def test_least_recently_used_idle_model_is_evicted(registry):
+    with registry.use("a"):
+        pass
+    time.sleep(0.01)
+    with registry.use("b"):
+        pass
+    assert loaded(registry) == ["a", "b"] and registry.resident_bytes() == 2000
+    with registry.use("c") as model:
+        assert model.pool is not None
+    assert loaded(registry) == ["b", "c"]
+    assert [os.path.basename(path) for path in StubPool.closed] == ["a"]
+    assert registry.evictions == 1 and registry.resident_bytes() <= registry.memory_budget_bytes
+    # touching b makes c the oldest
+    with registry.use("b"):
+        pass
+    with registry.use("a"):
+        pass
+    assert loaded(registry) == ["a", "b"] and registry.get("a").loads == 2
+
+
+def test_leased_models_are_never_evicted(registry):
+    a = registry.acquire("a")
+    b = registry.acquire("b")
+    with pytest.raises(PoolBusyError):
+        registry.acquire("c")
+    assert registry.get("c").users == 0 and loaded(registry) == ["a", "b"]
+    registry.release(a)
+    with registry.use("c"):
+        assert loaded(registry) == ["b", "c"]
+    assert not registry.unload("b")  # still leased
+    registry.release(b)
+    assert registry.unload("b") and loaded(registry) == ["c"]
+
+
+def test_models_with_one_bpe_share_a_frontend(registry):
+    assert registry.frontend("a") is registry.frontend("b")
+    assert registry.stats()["shared_tokenizers"] == 1
@@ -0,0 +1,67 @@
+import os
+import time
+
+from output_store import OutputStore, output_id
+
+
+def write_output(store, size, age_s):
+    path = store.new_path()
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    stamp = time.time() - age_s
+    os.utime(path, (stamp, stamp))
+    return path
+
+
+def test_paths_are_unique_and_sharded(tmp_path):
+    store = OutputStore(str(tmp_path), encode_workers=1)
+    paths = {store.new_path() for _ in range(100)}
+    assert len(paths) == 100
+    path = paths.pop()
+    uid = os.path.basename(path)[len("spk_"):-len(".wav")]
+    assert os.path.dirname(path) == os.path.join(str(tmp_path), uid[:2], uid[2:4])
+    store.stop()
+
+
+def test_sweep_enforces_ttl_then_size_cap(tmp_path):
+    store = OutputStore(str(tmp_path), ttl_s=3600, max_bytes=250, encode_workers=1)
+    expired = write_output(store, 10, age_s=7200)
+    oldest = write_output(store, 100, age_s=300)
+    older = write_output(store, 100, age_s=200)
+    newest = write_output(store, 100, age_s=100)
+    assert store.sweep() == 2
+    assert not os.path.exists(expired) and not os.path.exists(oldest)
+    assert os.path.exists(older) and os.path.exists(newest)
+    assert store.stats()["swept_files"] == 2 and store.stats()["swept_bytes"] == 110
+    assert store.sweep() == 0
+    store.stop()
+
+
+def test_sweep_prunes_only_stale_empty_shards(tmp_path):
+    store = OutputStore(str(tmp_path), ttl_s=3600, max_bytes=0, encode_workers=1)
+    stale = os.path.dirname(write_output(store, 10, age_s=7200))
+    fresh_shard = os.path.dirname(store.new_path())  # about to receive its first file
+    old = time.time() - 120
+    store.sweep()
+    os.utime(stale, (old, old))
+    store.sweep()
+    assert not os.path.exists(stale)
+    assert os.path.isdir(fresh_shard)
+    store.stop()
+
+
+def test_outputs_resolve_by_public_id(tmp_path):
+    store = OutputStore(str(tmp_path), encode_workers=1)
+    path = write_output(store, 10, age_s=0)
+    uid = output_id(path)
+    assert str(tmp_path) not in uid and len(uid) == 32
+    assert store.resolve(uid) == (path, "wav")
+    encoded = path[:-len(".wav")] + ".flac"
+    with open(encoded, "wb") as f:
+        f.write(b"fLaC")
+    assert store.resolve(uid) == (path, "wav")  # encode still running
+    os.remove(path)
+    assert store.resolve(uid) == (encoded, "flac")
+    for bad in ("0" * 32, "../" + uid[3:], uid.upper(), ""):
+        assert store.resolve(bad) is None
+    store.stop()
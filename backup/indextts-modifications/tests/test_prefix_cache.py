@@ -0,0 +1,122 @@
+import math
+from types import SimpleNamespace
+
+import torch
+
+import prefix_cache
+from prefix_cache import PrefixCache, _Entry
+
+DIM = 8
+
+
+class ToyTransformer(torch.nn.Module):
+    """One causal attention layer returning a legacy ``((key, value),)`` cache, like GPT-2."""
+
+    def __init__(self):
+        super().__init__()
+        self.q, self.k, self.v = (torch.nn.Linear(DIM, DIM) for _ in range(3))
+
+    def forward(self, inputs_embeds, past_key_values=None, use_cache=True, return_dict=True, **kwargs):
+        q, k, v = (proj(inputs_embeds).unsqueeze(1) for proj in (self.q, self.k, self.v))
+        if past_key_values:
+            k = torch.cat([past_key_values[0][0], k], dim=-2)
+            v = torch.cat([past_key_values[0][1], v], dim=-2)
+        offset = k.shape[-2] - q.shape[-2]
+        scores = q @ k.transpose(-1, -2) / math.sqrt(DIM)
+        visible = torch.arange(k.shape[-2])[None, :] <= torch.arange(q.shape[-2])[:, None] + offset
+        out = torch.softmax(scores.masked_fill(~visible, float("-inf")), dim=-1) @ v
+        return SimpleNamespace(last_hidden_state=out.squeeze(1), past_key_values=((k, v),))
+
+
+class ToyInferenceModel(torch.nn.Module):
+    """UnifiedVoice's inference wrapper: the prompt embedding is ``cached_mel_emb``."""
+
+    def __init__(self):
+        super().__init__()
+        self.transformer = ToyTransformer()
+        self.mel_embedding = torch.nn.Embedding(16, DIM)
+        self.cached_mel_emb = None
+
+    def forward(self, input_ids=None, past_key_values=None, **kwargs):
+        prompt = self.cached_mel_emb.shape[1]
+        emb = torch.cat([self.cached_mel_emb.expand(input_ids.shape[0], -1, -1),
+                         self.mel_embedding(input_ids[:, prompt:])], dim=1)
+        return self.transformer(inputs_embeds=emb, past_key_values=past_key_values)
+
+
+def toy_tts():
+    torch.manual_seed(0)
+    gpt = torch.nn.Module()
+    gpt.inference_model = ToyInferenceModel()
+    gpt.conditioning_calls = []
+
+    def get_conditioning(cond_input, cond_mel_lengths=None):
+        gpt.conditioning_calls.append(cond_input)
+        return cond_input.mean(dim=-1, keepdim=True).expand(-1, -1, DIM) * torch.linspace(0, 1, DIM)
+
+    gpt.get_conditioning = get_conditioning
+    return prefix_cache.enable(SimpleNamespace(gpt=gpt))
+
+
+def first_step(tts, cond_input, text_emb, rows):
+    """Hidden states of the text and start positions in the first decoding step of ``rows`` beams.
+
+    With the prefix reused only those positions are computed, and generate only reads the last one.
+    """
+    latent = tts.gpt.get_conditioning(cond_input)
+    model = tts.gpt.inference_model
+    model.cached_mel_emb = torch.cat([latent, text_emb], dim=1)
+    input_ids = torch.zeros(rows, model.cached_mel_emb.shape[1] + 1, dtype=torch.long)
+    return model(input_ids=input_ids, past_key_values=None).last_hidden_state[:, -(text_emb.shape[1] + 1):]
+
+
+def test_prefix_reuse_matches_full_decoding():
+    tts = toy_tts()
+    voice = torch.randn(1, 5, 3)
+    texts = [torch.randn(1, n, DIM) for n in (4, 7)]
+    tts.prefix_cache.enabled = False
+    expected = [first_step(tts, voice, text, rows=3) for text in texts]
+    tts.prefix_cache.enabled = True
+    for text, full in zip(texts, expected):
+        assert torch.allclose(first_step(tts, voice, text, rows=3), full, atol=1e-6)
+    stats = tts.prefix_cache.stats()
+    # conditioning encoded once (plus the uncached runs); the prefix ran for every beam of both sentences
+    assert len(tts.gpt.conditioning_calls) == 3
+    assert (stats["hits"], stats["misses"], stats["prefix_reuses"]) == (1, 1, 2)
+    assert stats["reused_tokens"] == 2 * 3 * 5
+
+
+def test_other_voice_is_not_served_from_the_cache():
+    tts = toy_tts()
+    text = torch.randn(1, 4, DIM)
+    first_step(tts, torch.randn(1, 5, 3), text, rows=1)
+    other = torch.randn(1, 5, 3)
+    tts.prefix_cache.enabled = False
+    expected = first_step(tts, other, text, rows=2)
+    tts.prefix_cache.enabled = True
+    assert torch.allclose(first_step(tts, other, text, rows=2), expected, atol=1e-6)
+    assert tts.prefix_cache.stats()["entries"] == 2
+
+
+def test_lru_is_bounded_by_bytes():
+    cache = PrefixCache(max_bytes=3 * 4 * 100)
+    entries = [_Entry(torch.zeros(100)) for _ in range(4)]
+    for i, entry in enumerate(entries[:3]):
+        cache.insert(f"voice{i}", entry)
+    assert cache.lookup("voice0") is entries[0]
+    cache.insert("voice3", entries[3])
+    assert cache.lookup("voice1") is None and cache.lookup("voice0") is entries[0]
+    # a KV cache added later counts against the budget too
+    cache.grow(entries[0], 4 * 100)
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] == 3 * 4 * 100
+    huge = _Entry(torch.zeros(1000))
+    cache.insert("huge", huge)
+    assert cache.lookup("huge") is huge and cache.stats()["entries"] == 1
+    assert cache.stats()["evictions"] == 4
+
+
+def test_voice_key_follows_content():
+    a = torch.randn(1, 5, 3)
+    assert prefix_cache.voice_key(a) == prefix_cache.voice_key(a.clone())
+    assert prefix_cache.voice_key(a) != prefix_cache.voice_key(a + 1)
+    assert prefix_cache.voice_key(a, torch.tensor([5])) != prefix_cache.voice_key(a, torch.tensor([4]))
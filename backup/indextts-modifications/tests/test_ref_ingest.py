@@ -0,0 +1,57 @@
+import math
+import os
+
+import numpy as np
+import torch
+
+import ref_ingest
+from cond_cache import PROMPT_SAMPLE_RATE as SR
+from ref_ingest import TARGET_DBFS, TRIM_PAD_S, load_canonical, preprocess
+
+
+def synthetic_clip(lead_s=1.0, voiced_s=2.0, tail_s=1.5, amplitude=0.05, channels=2):
+    """Quiet tone between stretches of near-silence, as ``[C, N]`` at the model rate."""
+    t = torch.arange(int(voiced_s * SR)) / SR
+    tone = amplitude * torch.sin(2 * math.pi * 220 * t)
+    hiss = lambda seconds: torch.full((int(seconds * SR),), 1e-5)
+    return torch.cat([hiss(lead_s), tone, hiss(tail_s)]).repeat(channels, 1)
+
+
+def rms_dbfs(audio):
+    return 20 * math.log10(float(audio.pow(2).mean().sqrt()))
+
+
+def test_edge_silence_is_trimmed_and_loudness_normalized():
+    out = preprocess(synthetic_clip(), SR)
+    assert out.dim() == 1 and out.dtype == torch.float32
+    # the tone plus at most one padding (and one frame) on each side
+    assert 2.0 * SR <= out.shape[-1] <= (2.0 + 2 * TRIM_PAD_S + 0.04) * SR
+    assert abs(rms_dbfs(out) - TARGET_DBFS) < 0.5
+    assert float(out.abs().max()) <= ref_ingest.PEAK_LIMIT
+
+
+def test_long_clip_is_capped_with_a_fade():
+    out = preprocess(synthetic_clip(lead_s=0, voiced_s=20, tail_s=0, amplitude=0.5), SR, max_duration_s=5)
+    assert out.shape[-1] == 5 * SR
+    assert float(out[-1]) == 0.0
+    assert preprocess(synthetic_clip(voiced_s=20), SR, max_duration_s=0).shape[-1] > 20 * SR
+
+
+def test_canonical_copy_written_once_per_content(tmp_path, monkeypatch):
+    def load(path):
+        return synthetic_clip(), SR
+
+    monkeypatch.setattr(ref_ingest.torchaudio, "load", load, raising=False)
+    meta = ref_ingest.ingest_audio("voice.mp3", str(tmp_path), "ab" * 32)
+    assert meta["sample_rate"] == SR and meta["duration"] == 4.5
+    assert os.path.basename(meta["resampled_path"]).startswith("ab" * 32)
+    mtime = os.stat(meta["resampled_path"]).st_mtime_ns
+    assert ref_ingest.ingest_audio("copy.mp3", str(tmp_path), "ab" * 32) == meta
+    assert os.stat(meta["resampled_path"]).st_mtime_ns == mtime
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(meta["resampled_path"])]
+    canonical = load_canonical(meta["resampled_path"])
+    assert canonical.shape[0] == 1
+    assert np.allclose(canonical[0].numpy(), preprocess(synthetic_clip(), SR).numpy())
+    # other settings get their own copy
+    other = ref_ingest.ingest_audio("voice.mp3", str(tmp_path), "ab" * 32, target_dbfs=-16.0)
+    assert other["resampled_path"] != meta["resampled_path"]
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+
+import ref_library
+from ref_library import LEGACY_INDEX_FILENAME, ReferenceLibrary
+
+
+def make_library(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir(exist_ok=True)
+    return ReferenceLibrary(str(input_dir), index_path=str(tmp_path / "index" / "refs.sqlite3"))
+
+
+def test_index_lives_outside_the_library(tmp_path):
+    library = make_library(tmp_path)
+    assert not os.path.abspath(library.index_path).startswith(os.path.abspath(library.input_dir) + os.sep)
+    (tmp_path / "input" / "a.wav").write_bytes(b"RIFF")
+    assert library.refresh()
+    assert library.resolve("a.wav")
+    # committing the index must not look like a directory change
+    assert not library.refresh()
+    assert sorted(os.listdir(library.input_dir)) == [".resampled", "a.wav"]
+
+
+def test_legacy_index_is_moved_out(tmp_path):
+    library = make_library(tmp_path)
+    (tmp_path / "input" / "a.wav").write_bytes(b"RIFF")
+    library.refresh()
+    library._db.close()
+    os.replace(library.index_path, tmp_path / "input" / LEGACY_INDEX_FILENAME)
+    library = make_library(tmp_path)
+    assert library.resolve("a.wav")
+    assert not (tmp_path / "input" / LEGACY_INDEX_FILENAME).exists()
+
+
+def test_only_audio_events_schedule_a_rescan(tmp_path):
+    library = make_library(tmp_path)
+    library.notify(os.path.join(library.input_dir, ".ref_index.sqlite3-journal"), None)
+    library.notify(os.path.join(library.input_dir, "notes.txt"))
+    assert not library._changed.is_set()
+    library.notify(os.path.join(library.input_dir, "tmp.part"), os.path.join(library.input_dir, "voice.MP3"))
+    assert library._changed.is_set()
+
+
+def test_event_bursts_are_coalesced(tmp_path, monkeypatch):
+    monkeypatch.setattr(ref_library, "EVENT_DEBOUNCE_S", 0.2)
+    library = make_library(tmp_path)
+    scans = []
+    library.refresh = lambda force=False: scans.append(force)
+    thread = threading.Thread(target=library._event_loop, daemon=True)
+    thread.start()
+    for i in range(50):
+        library.notify(os.path.join(library.input_dir, f"{i}.wav"))
+    time.sleep(0.6)
+    library.stop()
+    thread.join()
+    assert scans == [True]
+
+
+def index_clips(library, clips):
+    with library._lock:
+        for name, digest in clips.items():
+            library._store({"name": name, "size": 4, "mtime_ns": 0, "duration": None, "sample_rate": None,
+                            "sha256": digest, "resampled_path": None, "indexed_at": 0.0})
+        library._db.commit()
+
+
+def test_voice_hash_prefix_is_not_a_pattern(tmp_path):
+    library = make_library(tmp_path)
+    index_clips(library, {"alice.wav": "ab12cd34" + "0" * 56, "bob.wav": "ff" * 32})
+    assert library.resolve_voice("AB12CD34").endswith("alice.wav")
+    assert library.resolve_voice("f" * 64).endswith("bob.wav")
+    for wildcard in ("%%%%%%%%", "________", "ab12cd3%", "ab12____", "ab12cd34" + "0" * 57):
+        assert library.resolve_voice(wildcard) is None
+
+
+def test_search_treats_wildcards_literally(tmp_path):
+    library = make_library(tmp_path)
+    index_clips(library, {"a_b.wav": None, "axb.wav": None, "100%.wav": None, "1000.wav": None, "c\\d.wav": None})
+    assert library.search("a_b") == (["a_b.wav"], 1)
+    assert library.search("100%") == (["100%.wav"], 1)
+    assert library.search("%") == (["100%.wav"], 1)
+    assert library.search("_") == (["a_b.wav"], 1)
+    assert library.search("c\\d") == (["c\\d.wav"], 1)
+    assert library.search("")[1] == 5
@@ -0,0 +1,73 @@
+import os
+
+import torch
+
+import infer_stages
+from result_cache import ResultCache, make_key
+
+
+def test_copy_result(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    src = tmp_path / "out.wav"
+    src.write_bytes(b"RIFF....WAVE")
+    key = make_key(text="你好")
+    assert not cache.copy_result(key, str(tmp_path / "a.wav"))
+    cache.put_result(key, str(src))
+    assert cache.copy_result(key, str(tmp_path / "a.wav"))
+    assert (tmp_path / "a.wav").read_bytes() == src.read_bytes()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entry_swept_between_lookup_and_copy_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    src = tmp_path / "out.wav"
+    src.write_bytes(b"RIFF....WAVE")
+    key = make_key(text="你好")
+    cache.put_result(key, str(src))
+    touch = cache._touch
+
+    def touch_then_sweep(path):
+        hit = touch(path)
+        # a concurrent sweep deletes the file right after the lookup passed
+        os.remove(path)
+        return hit
+
+    cache._touch = touch_then_sweep
+    assert not cache.copy_result(key, str(tmp_path / "a.wav"))
+    assert not (tmp_path / "a.wav").exists()
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+class _FakeTTS:
+    device = "cpu"
+
+    def _set_gr_progress(self, value, desc=None):
+        pass
+
+
+def test_uncached_sentences_keep_infer_fast_buckets(monkeypatch):
+    batches = []
+
+    def synthesize_batch(tts, cond_mel, token_id_lists, seed=None, **kwargs):
+        batches.append([len(ids) for ids in token_id_lists])
+        return [torch.full((1, len(ids)), float(len(ids))) for ids in token_id_lists]
+
+    monkeypatch.setattr(infer_stages, "synthesize_batch", synthesize_batch)
+    token_ids = [[1] * n for n in (5, 1, 4, 2, 3)]
+    wavs = infer_stages.synthesize_buckets(_FakeTTS(), torch.zeros(1, 100, 8), token_ids, 2)
+    assert batches == [[1, 2], [3, 4], [5]]
+    assert [wav.shape[-1] for wav in wavs] == [5, 1, 4, 2, 3]
+
+
+def test_entries_on_disk_are_indexed_by_load(tmp_path):
+    src = tmp_path / "out.wav"
+    src.write_bytes(b"RIFF....WAVE")
+    ResultCache(str(tmp_path / "cache")).put_result(make_key(n=1), str(src))
+    # a restart: constructing the cache does not walk the tree
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert cache.stats()["entries"] == 0
+    cache.put_result(make_key(n=2), str(src))
+    cache.load()
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == 2 * src.stat().st_size
+    assert cache.copy_result(make_key(n=1), str(tmp_path / "a.wav"))
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from startup import NotReadyError, Readiness, StartupTimer
+
+
+def test_not_ready_while_loading_then_ready():
+    timer = StartupTimer()
+    readiness = Readiness(timer)
+    in_phase, finish = threading.Event(), threading.Event()
+
+    def load():
+        with timer.phase("load_models"):
+            in_phase.set()
+            finish.wait(5)
+
+    thread = readiness.start(load)
+    assert in_phase.wait(5)
+    with pytest.raises(NotReadyError, match="load_models"):
+        readiness.check()
+    assert readiness.status()["current"] == "load_models"
+    finish.set()
+    assert readiness.wait(5)
+    thread.join()
+    readiness.check()
+    status = readiness.status()
+    assert status["ready"] and status["error"] is None and status["current"] is None
+    assert list(status["phases"]) == ["load_models", "ready"]
+
+
+def test_failed_load_is_reported():
+    readiness = Readiness(StartupTimer())
+
+    def load():
+        raise FileNotFoundError("gpt.pth")
+
+    readiness.start(load).join()
+    assert not readiness.wait(0)
+    with pytest.raises(NotReadyError, match="FileNotFoundError: gpt.pth"):
+        readiness.check()
+    assert readiness.status()["error"] == "FileNotFoundError: gpt.pth"
+    with pytest.raises(FileNotFoundError):
+        Readiness(StartupTimer()).run(load)
@@ -0,0 +1,50 @@
+from text_split_cache import SentenceSplitCache
+
+
+class FakeTokenizer:
+    """Context-dependent like the real frontend: a line break ends a sentence."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def tokenize(self, text):
+        self.calls += 1
+        return text.replace("\n", " . ").split()
+
+    def split_sentences(self, tokens, max_tokens_per_sentence=120):
+        sentences, current = [], []
+        for token in tokens:
+            current.append(token)
+            if token == "." or len(current) >= max_tokens_per_sentence:
+                sentences.append(current)
+                current = []
+        if current:
+            sentences.append(current)
+        return sentences
+
+
+TEXT = "Chapter One\nIt was a dark night . The end\n\nChapter Two\nMorning came"
+
+
+def test_split_matches_whole_text_tokenization():
+    tokenizer = FakeTokenizer()
+    cache = SentenceSplitCache(tokenizer)
+    for max_tokens in (120, 3):
+        tokens, sentences = cache.split(TEXT, max_tokens)
+        expected = tokenizer.tokenize(TEXT)
+        assert tokens == expected
+        assert sentences == tokenizer.split_sentences(expected, max_tokens_per_sentence=max_tokens)
+    # the heading stays its own sentence instead of fusing with the paragraph after it
+    assert cache.split(TEXT, 120)[1][0] == ["Chapter", "One", "."]
+
+
+def test_tokens_reused_across_slider_values():
+    tokenizer = FakeTokenizer()
+    cache = SentenceSplitCache(tokenizer)
+    cache.split(TEXT, 120)
+    cache.split(TEXT, 40)
+    cache.split(TEXT, 120)
+    assert tokenizer.calls == 1
+    stats = cache.stats()
+    assert (stats["token_misses"], stats["result_misses"], stats["result_hits"]) == (1, 2, 1)
+    assert cache.tokenize(TEXT) == tokenizer.tokenize(TEXT)
@@ -0,0 +1,89 @@
+"""Memoized tokenization for the sentence-split preview.
+
+Text normalization and BPE tokenization dominate the cost of the preview, and
+the preview re-runs on every change of the text or of the sentence length
+slider. The text is tokenized as a whole, exactly like ``infer`` does (splitting
+it per paragraph first would fuse an unpunctuated heading with the next
+paragraph and normalize zh/en mixes differently), with an LRU of text hash ->
+tokens so moving the slider does not re-tokenize, and the split result is
+memoized on (text hash, max tokens per sentence). The same token lists are then
+reused at generate time so the text is not tokenized a second time.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class SentenceSplitCache:
+    def __init__(self, tokenizer, max_texts=64, max_results=64):
+        self.tokenizer = tokenizer
+        self.max_texts = max_texts
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()  # text hash -> tokens
+        self._results = OrderedDict()  # (text hash, max tokens) -> (tokens, sentences)
+        self.token_hits = 0
+        self.token_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+
+    @staticmethod
+    def _lru_get(store, key):
+        value = store.get(key)
+        if value is not None:
+            store.move_to_end(key)
+        return value
+
+    @staticmethod
+    def _lru_put(store, key, value, limit):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > limit:
+            store.popitem(last=False)
+
+    @staticmethod
+    def _text_key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _tokenize(self, text, key):
+        with self._lock:
+            tokens = self._lru_get(self._tokens, key)
+            if tokens is not None:
+                self.token_hits += 1
+                return tokens
+        tokens = self.tokenizer.tokenize(text)
+        with self._lock:
+            self.token_misses += 1
+            self._lru_put(self._tokens, key, tokens, self.max_texts)
+        return tokens
+
+    def tokenize(self, text):
+        """Tokens of ``text``, identical to ``tokenizer.tokenize(text)``."""
+        return self._tokenize(text, self._text_key(text))
+
+    def split(self, text, max_tokens_per_sentence):
+        """Return ``(tokens, sentences)`` for ``text``, memoized on its hash."""
+        text_key = self._text_key(text)
+        key = (text_key, int(max_tokens_per_sentence))
+        with self._lock:
+            result = self._lru_get(self._results, key)
+            if result is not None:
+                self.result_hits += 1
+                return result
+        tokens = self._tokenize(text, text_key)
+        sentences = self.tokenizer.split_sentences(tokens, max_tokens_per_sentence=int(max_tokens_per_sentence))
+        result = (tokens, sentences)
+        with self._lock:
+            self.result_misses += 1
+            self._lru_put(self._results, key, result, self.max_results)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "token_hits": self.token_hits,
+                "token_misses": self.token_misses,
+                "result_hits": self.result_hits,
+                "result_misses": self.result_misses,
+                "texts_cached": len(self._tokens),
+            }
@@ -1,9 +1,12 @@
+import asyncio
+import functools
 import json
 import os
 import sys
 import threading
 import time
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import re
 
@@ -11,6 +14,8 @@ import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
+process_started_at = time.perf_counter()
+
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 sys.path.append(os.path.join(current_dir, "indextts"))
@@ -21,52 +26,255 @@ parser.add_argument("--verbose", action="store_true", default=False, help="Enabl
 parser.add_argument("--port", type=int, default=7860, help="Port to run the web UI on")
 parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to run the web UI on")
 parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+parser.add_argument("--models", type=str, default="", help="More checkpoints served by name and loaded on first use, e.g. v1.5=checkpoints-1.5,acme=finetunes/acme")
+parser.add_argument("--default_model", type=str, default="indextts", help="Name of --model_dir; requests that name no model use it")
+parser.add_argument("--model_memory_gb", type=float, default=0, help="Memory budget of loaded models; idle ones are unloaded beyond it (0 = unlimited)")
 parser.add_argument("--input_dir", type=str, default="input", help="Directory to save uploaded reference audio files")
+parser.add_argument("--cond_cache_mb", type=int, default=256, help="Memory budget (MB) of the speaker-conditioning cache")
+parser.add_argument("--cond_cache_disk_mb", type=int, default=1024, help="Disk budget (MB) of the speaker-conditioning cache")
+parser.add_argument("--cond_cache_days", type=float, default=30, help="Drop cached conditioning unused for this many days")
+parser.add_argument("--batch_scheduler", action="store_true", default=False, help="Batch sentences across concurrent requests")
+parser.add_argument("--batch_max_size", type=int, default=8, help="Max sentences per cross-request batch")
+parser.add_argument("--batch_max_wait_ms", type=int, default=30, help="Max time to wait for a batch to fill")
+parser.add_argument("--batch_max_tokens", type=int, default=20000, help="Memory ceiling: rows * num_beams * (text + mel tokens)")
+parser.add_argument("--workers", type=int, default=1, help="Number of IndexTTS model instances")
+parser.add_argument("--worker_mode", type=str, default="thread", choices=["thread", "process"], help="Run model workers as threads (one per device) or as processes (CPU scaling)")
+parser.add_argument("--devices", type=str, default="", help="Comma separated devices for the workers, e.g. cuda:0,cuda:1")
+parser.add_argument("--threads_per_worker", type=int, default=0, help="torch threads per worker (0 = torch default)")
+parser.add_argument("--cpu_mode", type=str, default="none", choices=["none", "quantize", "compile", "full"],
+                    help="CPU performance mode: int8 GPT (quantize), compiled BigVGAN (compile) or both (full); check quality with cpu_perf.py")
+parser.add_argument("--prefix_cache_mb", type=int, default=64, help="Per-worker memory (MB) for reused GPT conditioning prefixes (0 = disabled); measure with prefix_cache.py")
+parser.add_argument("--max_pending", type=int, default=8, help="Admission limit: requests beyond this fail fast with a busy error")
+parser.add_argument("--result_cache_mb", type=int, default=1024, help="Disk budget (MB) of the synthesis result cache (0 = disabled)")
+parser.add_argument("--result_cache_days", type=float, default=7, help="Drop cached results unused for this many days")
+parser.add_argument("--output_format", type=str, default="wav", choices=["wav", "flac", "opus", "mp3"], help="Default format of generated audio")
+parser.add_argument("--output_ttl_hours", type=float, default=24, help="Delete generated audio older than this (0 = keep)")
+parser.add_argument("--output_max_gb", type=float, default=10, help="Total size cap of generated audio (0 = unlimited)")
+parser.add_argument("--encode_workers", type=int, default=2, help="Threads encoding FLAC/Opus/MP3 outputs")
+parser.add_argument("--lazy_load", action="store_true", default=False, help="Bind the port first and load models in the background (see /healthz, /readyz)")
+parser.add_argument("--warmup_text", type=str, default="你好，欢迎使用语音合成。", help="Text synthesized once per worker at startup (empty = no warm-up)")
+parser.add_argument("--warmup_prompt", type=str, default="", help="Reference audio for the warm-up (default: tests/sample_prompt.wav or the first library clip)")
+parser.add_argument("--trace_log", type=str, default="", help="Append a JSON timing trace per request to this file")
+parser.add_argument("--job_history_days", type=float, default=7, help="Forget finished synthesis jobs after this many days")
+parser.add_argument("--chapter_chars", type=int, default=4000, help="Characters per checkpointed chapter in long-form mode")
+parser.add_argument("--long_form_keep_days", type=float, default=7, help="Drop checkpoints of unfinished long-form jobs after this many days")
+parser.add_argument("--ref_max_seconds", type=float, default=15, help="Reference clips are trimmed to this length at ingest (0 = no cap)")
+parser.add_argument("--ref_target_dbfs", type=float, default=-20, help="Loudness reference clips are normalized to at ingest (RMS dBFS)")
+parser.add_argument("--ref_page_size", type=int, default=100, help="Reference audio entries shown per dropdown page")
 cmd_args = parser.parse_args()
 
-if not os.path.exists(cmd_args.model_dir):
-    print(f"Model directory {cmd_args.model_dir} does not exist. Please download the model first.")
-    sys.exit(1)
+from model_pool import missing_model_files
+from model_registry import parse_model_dirs
+
+model_dirs = {cmd_args.default_model: cmd_args.model_dir}
+model_dirs.update(parse_model_dirs(cmd_args.models))
+for model_dir in model_dirs.values():
+    if not os.path.exists(model_dir):
+        print(f"Model directory {model_dir} does not exist. Please download the model first.")
+        sys.exit(1)
 
 # Create input directory for reference audio files
 os.makedirs(cmd_args.input_dir, exist_ok=True)
 
-for file in [
-    "bigvgan_generator.pth",
-    "bpe.model",
-    "gpt.pth",
-    "config.yaml",
-]:
-    file_path = os.path.join(cmd_args.model_dir, file)
-    if not os.path.exists(file_path):
+for model_dir in model_dirs.values():
+    for file_path in missing_model_files(model_dir):
         print(f"Required file {file_path} does not exist. Please download it.")
         sys.exit(1)
 
 import gradio as gr
+import pandas as pd
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel
 
-from indextts.infer import IndexTTS
 from tools.i18n.i18n import I18nAuto
 
+import infer_stages
+import long_form
+import prefix_cache
+from adaptive_bucket import BucketProfile, adaptive_wavs, synthesize_adaptive
+from api_stream import (Lease, LeasedStreamingResponse, RequestCancelled, cancel_on_disconnect, cancel_progress,
+                        iterate_in_thread)
+from batch_scheduler import BatchScheduler
+from cond_cache import CACHE_DIRNAME, ConditioningCache, compute_cond_mel
+from job_queue import PRIORITIES, JobQueue
+from metrics import Metrics
+from model_pool import PoolBusyError, ThreadWorker
+from model_registry import ModelRegistry
+from output_store import OutputStore, available_formats, output_id
+from ref_library import ReferenceLibrary
+from result_cache import ResultCache, is_deterministic, make_key
+from startup import NotReadyError, Readiness, StartupTimer
+from text_split_cache import SentenceSplitCache
+
+timer = StartupTimer(started_at=process_started_at)
+timer.mark("imports")
+readiness = Readiness(timer)
+setup_started_at = time.perf_counter()
+
 i18n = I18nAuto(language="zh_CN")
 MODE = 'local'
-tts = IndexTTS(model_dir=cmd_args.model_dir, cfg_path=os.path.join(cmd_args.model_dir, "config.yaml"),)
+
+
+# Only the configs are needed to build the UI; models are loaded on first use
+# (the default one by load_models())
+registry = ModelRegistry(
+    model_dirs,
+    default=cmd_args.default_model,
+    memory_budget_bytes=cmd_args.model_memory_gb * 1024 ** 3,
+    pool_kwargs=dict(
+        num_workers=cmd_args.workers,
+        mode=cmd_args.worker_mode,
+        devices=[d.strip() for d in cmd_args.devices.split(",") if d.strip()],
+        max_pending=cmd_args.max_pending,
+        threads_per_worker=cmd_args.threads_per_worker,
+    ),
+    # applied to every model instance once it is loaded, in its worker
+    prepare=functools.partial(infer_stages.prepare_instance, cpu_mode=cmd_args.cpu_mode,
+                              prefix_cache_mb=cmd_args.prefix_cache_mb),
+    share_components=cmd_args.worker_mode == "thread",
+    # int8 / compiled weights synthesize slightly different audio: cache their results apart
+    variant=f"cpu-{cmd_args.cpu_mode}" if cmd_args.cpu_mode != "none" else "",
+)
+model_cfg = registry.get().cfg
+model_version = registry.get().version
+split_caches = {}  # shared tokenizer frontend -> its SentenceSplitCache
+split_caches_lock = threading.Lock()
+batch_scheduler = None
+library = ReferenceLibrary(cmd_args.input_dir, max_duration_s=cmd_args.ref_max_seconds,
+                           target_dbfs=cmd_args.ref_target_dbfs)
+cond_cache = ConditioningCache(
+    os.path.join(cmd_args.input_dir, CACHE_DIRNAME),
+    # conditioning mels are extracted the same way for every registered model and
+    # every CPU mode, but depend on the ingest settings
+    model_version=f"{model_version or '1.0'}+{library.ingest_tag}",
+    max_bytes=cmd_args.cond_cache_mb * 1024 * 1024,
+    max_disk_bytes=cmd_args.cond_cache_disk_mb * 1024 * 1024,
+    max_age_s=cmd_args.cond_cache_days * 86400,
+    # library clips are encoded from their canonical ingest copy when available
+    compute_fn=lambda path: compute_cond_mel(library.resampled_path(path) or path),
+)
+# an added or replaced clip must not be served stale conditioning
+library.on_change.append(cond_cache.invalidate)
+# retention sweeps, including the first one, run on the store's sweeper thread
+output_store = OutputStore(
+    os.path.join("outputs", "audio"),
+    ttl_s=cmd_args.output_ttl_hours * 3600,
+    max_bytes=cmd_args.output_max_gb * 1024 ** 3,
+    encode_workers=cmd_args.encode_workers,
+).start()
+output_formats = available_formats()
+if cmd_args.output_format not in output_formats:
+    print(f"⚠️ 未找到 ffmpeg，无法输出 {cmd_args.output_format}，改用 wav")
+    cmd_args.output_format = "wav"
+metrics = Metrics(trace_path=cmd_args.trace_log or None)
+long_form_root = os.path.join("outputs", "long_form")
+# measured bucket timings and memory, for 分桶容量 0 (adaptive)
+bucket_profile = BucketProfile(os.path.join("outputs", "bucket_profile.json"))
+result_cache = None
+if cmd_args.result_cache_mb > 0:
+    result_cache = ResultCache(
+        os.path.join("outputs", "result_cache"),
+        max_bytes=cmd_args.result_cache_mb * 1024 * 1024,
+        max_age_s=cmd_args.result_cache_days * 86400,
+    )
+timer.mark("setup", since=setup_started_at)
+
+
+def split_cache_for(model):
+    """Sentence split cache of a model's tokenizer; models sharing a BPE model share it."""
+    frontend = registry.frontend(model.name)
+    with split_caches_lock:
+        if frontend not in split_caches:
+            split_caches[frontend] = SentenceSplitCache(frontend.tokenizer)
+        return split_caches[frontend]
+
+
+def warm_up(model):
+    """One short synthesis on every worker, so CUDA kernels, autotuning and the
+    conditioning cache are ready before /readyz reports ready."""
+    candidates = [cmd_args.warmup_prompt, os.path.join("tests", "sample_prompt.wav")] + library.paths()[:1]
+    prompt = next((p for p in candidates if p and os.path.exists(p)), None)
+    if prompt is None:
+        print("⚠️ 未找到预热用参考音频，跳过预热")
+        return
+    _, sentences = split_cache_for(model).split(cmd_args.warmup_text, 120)
+    token_ids = infer_stages.sentence_token_ids(model.frontend, sentences)
+    model.pool.run_each(infer_stages.synthesize_batch, cond_cache.get(prompt), token_ids)
+
+
+def load_result_cache():
+    """Index and sweep the result cache; it walks a large tree, so it runs beside model loading."""
+    started_at = time.perf_counter()
+    try:
+        result_cache.load()
+    except OSError as e:
+        print(f"⚠️ 结果缓存扫描失败: {e}")
+    timer.mark("result_cache_scan", since=started_at)
+
+
+def load_models():
+    """Scan the library, load the default model and its tokenizer, then warm up.
+
+    Other registered models load on their first request.
+    """
+    global batch_scheduler
+    if result_cache is not None:
+        # entries on disk miss until indexed; nothing waits for it
+        threading.Thread(target=load_result_cache, daemon=True, name="result-cache-scan").start()
+    with timer.phase("prune"):
+        # before the job queue starts, so no resumed long-form job races it
+        long_form.prune_jobs(long_form_root, cmd_args.long_form_keep_days * 86400)
+    with timer.phase("library_index"):
+        library.start()
+    with timer.phase("model_load"):
+        model = registry.acquire()
+    try:
+        # one job runner per model instance; queued jobs survive restarts
+        job_queue.start(concurrency=len(model.pool.workers))
+        with timer.phase("tokenizer"):
+            split_cache_for(model)
+        if cmd_args.batch_scheduler:
+            batch_scheduler = BatchScheduler(
+                model.batch_model,
+                max_batch_size=cmd_args.batch_max_size,
+                max_wait_ms=cmd_args.batch_max_wait_ms,
+                max_batch_tokens=cmd_args.batch_max_tokens,
+                concurrency=len(model.pool.workers),
+            ).start()
+        if cmd_args.warmup_text.strip():
+            with timer.phase("warmup"):
+                warm_up(model)
+    finally:
+        registry.release(model)
+    print(f"⏱️ 启动耗时: {timer.report()}")
 
 # Log startup information
 print("=" * 50)
 print("🎙️ IndexTTS WebUI 启动成功")
 print(f"📁 参考音频输入目录: {cmd_args.input_dir}")
 print(f"💾 上传的音频文件将自动保存到: {cmd_args.input_dir}/")
+print(f"🧠 已注册模型: {', '.join(registry.names())}（默认 {registry.default}，其余首次使用时加载）")
 
 # Check existing reference audio files
 def get_reference_audio_files():
-    """Get list of audio files in the input directory"""
-    audio_extensions = ['.wav', '.mp3', '.m4a', '.flac', '.aac', '.ogg']
-    audio_files = []
-    if os.path.exists(cmd_args.input_dir):
-        for file in os.listdir(cmd_args.input_dir):
-            if any(file.lower().endswith(ext) for ext in audio_extensions):
-                audio_files.append(os.path.join(cmd_args.input_dir, file))
-    return sorted(audio_files)
+    """Get list of audio files in the input directory (served from the library index)"""
+    return library.paths()
+
+def reference_page(query="", page=0):
+    """One dropdown page of library clip names matching `query`.
+
+    Returns (names, summary, page) with `page` clamped to the last page.
+    """
+    size = cmd_args.ref_page_size
+    page = max(0, int(page or 0))
+    names, total = library.search(query, offset=page * size, limit=size)
+    pages = max(1, -(-total // size))
+    if page >= pages:
+        page = pages - 1
+        names, total = library.search(query, offset=page * size, limit=size)
+    return names, f"共 {total} 个参考音频，第 {page + 1}/{pages} 页", page
 
 def _sanitize_filename(name: str) -> str:
     """Sanitize filename to avoid dangerous characters and paths."""
@@ -119,6 +327,7 @@ def save_uploaded_audio(audio_file, custom_name: str | None = None):
             dest_path = os.path.join(cmd_args.input_dir, f"{base_no_ext}_{timestamp}{ext}")
 
         shutil.copy2(audio_file, dest_path)
+        library.upsert(dest_path, probe=True)
         print(f"📁 参考音频已保存: {dest_path}")
         return dest_path
     except Exception as e:
@@ -141,54 +350,352 @@ print("=" * 50)
 os.makedirs("outputs/tasks",exist_ok=True)
 os.makedirs("prompts",exist_ok=True)
 
-with open("tests/cases.jsonl", "r", encoding="utf-8") as f:
-    example_cases = []
-    for line in f:
-        line = line.strip()
-        if not line:
-            continue
-        example = json.loads(line)
-        example_cases.append([os.path.join("tests", example.get("prompt_audio", "sample_prompt.wav")),
-                              example.get("text"), ["普通推理", "批次推理"][example.get("infer_mode", 0)]])
+example_cases = []
+if os.path.exists("tests/cases.jsonl"):
+    with open("tests/cases.jsonl", "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            example = json.loads(line)
+            example_cases.append([os.path.join("tests", example.get("prompt_audio", "sample_prompt.wav")),
+                                  example.get("text"), ["普通推理", "批次推理"][example.get("infer_mode", 0)]])
 
-def gen_single(prompt, selected_reference, text, infer_mode, max_text_tokens_per_sentence=120, sentences_bucket_max_size=4,
-                *args, progress=gr.Progress()):
-    # Determine which audio to use for generation
-    final_prompt = get_final_prompt_audio(prompt, selected_reference)
-    
-    if final_prompt is None:
-        raise gr.Error("请上传参考音频或选择已有的参考音频文件")
-    
-    output_path = None
-    if not output_path:
-        output_path = os.path.join("outputs", f"spk_{int(time.time())}.wav")
-    # set gradio progress
-    tts.gr_progress = progress
-    do_sample, top_p, top_k, temperature, \
-        length_penalty, num_beams, repetition_penalty, max_mel_tokens = args
+def require_ready():
+    """Fail the request with a friendly message until the models are loaded."""
+    try:
+        readiness.check()
+    except NotReadyError as e:
+        raise gr.Error(str(e))
+
+def build_generation_kwargs(do_sample, top_p, top_k, temperature,
+                            length_penalty, num_beams, repetition_penalty, max_mel_tokens, seed=-1):
+    """Map the `advanced_params` widget values to IndexTTS generation kwargs"""
     kwargs = {
         "do_sample": bool(do_sample),
         "top_p": float(top_p),
         "top_k": int(top_k) if int(top_k) > 0 else None,
         "temperature": float(temperature),
         "length_penalty": float(length_penalty),
-        "num_beams": num_beams,
+        "num_beams": int(num_beams),
         "repetition_penalty": float(repetition_penalty),
         "max_mel_tokens": int(max_mel_tokens),
         # "typical_sampling": bool(typical_sampling),
         # "typical_mass": float(typical_mass),
     }
-    if infer_mode == "普通推理":
-        output = tts.infer(final_prompt, text, output_path, verbose=cmd_args.verbose,
-                           max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
-                           **kwargs)
+    if seed is not None and int(seed) >= 0:
+        kwargs["seed"] = int(seed)
+    return kwargs
+
+def traced_run(trace, model, fn, *args, progress=None, **kwargs):
+    """``model.pool.run`` with worker-side stage timing merged into ``trace``."""
+    trace.dispatch()
+    result, timings = model.pool.run(infer_stages.run_traced, fn, *args, progress=progress, **kwargs)
+    trace.add_worker_timings(timings)
+    return result
+
+def traced_stream(trace, model, fn, *args, **kwargs):
+    """``model.pool.stream`` with worker-side stage timing merged into ``trace``."""
+    trace.dispatch()
+    for kind, value in model.pool.stream(infer_stages.stream_traced, fn, *args, **kwargs):
+        if kind == "timings":
+            trace.add_worker_timings(value)
+        else:
+            yield value
+
+def fresh_sentence_wavs(model, prompt_path, token_ids, kwargs, trace, route, progress=None):
+    """Waveforms of ``token_ids`` in order, synthesized on ``route`` (a ``trace_labels`` pair)."""
+    mode, bucket_size = route
+    with trace.span("conditioning"):
+        cond_mel = cond_cache.get(prompt_path)
+    if mode == "scheduler":
+        futures = batch_scheduler.submit(cond_cache.key_for(prompt_path), cond_mel, token_ids, kwargs,
+                                         model=model.batch_model)
+        return (future.result() for future in futures)
+    if mode == "infer_fast" and bucket_size == "auto":
+        wavs, observations = traced_run(trace, model, adaptive_wavs, cond_mel, token_ids, progress=progress,
+                                        **bucket_profile.planner_params(), **kwargs)
+        bucket_profile.record(observations)
+        return iter(wavs)
+    if mode == "infer_fast":
+        return iter(traced_run(trace, model, infer_stages.synthesize_buckets, cond_mel, token_ids, int(bucket_size),
+                               progress=progress, **kwargs))
+    return traced_stream(trace, model, infer_stages.iter_sentence_wavs, cond_mel, token_ids, **kwargs)
+
+def cached_sentence_wavs(model, prompt_path, token_ids, kwargs, trace, route, progress=None):
+    """Yield sentence waveforms in order; only those not in the result cache are synthesized, on ``route``."""
+    ref_key = cond_cache.key_for(prompt_path)
+    keys = [make_key(ref=ref_key, model=model.key, sentence=ids, params=kwargs) for ids in token_ids]
+    with trace.span("result_cache"):
+        wavs = [result_cache.get_sentence(key) for key in keys]
+    missing = [ids for ids, wav in zip(token_ids, wavs) if wav is None]
+    fresh = fresh_sentence_wavs(model, prompt_path, missing, kwargs, trace, route, progress) if missing else None
+    try:
+        for key, wav in zip(keys, wavs):
+            if wav is None:
+                wav = next(fresh)
+                result_cache.put_sentence(key, wav)
+            yield wav
+        if fresh is not None:
+            # drain the timings report that follows the last sentence
+            for _ in fresh:
+                pass
+    finally:
+        if hasattr(fresh, "close"):
+            fresh.close()
+
+def synthesize_cached(model, prompt_path, token_ids, output_path, kwargs, trace, progress, route):
+    """Serve a repeated request from the result cache; otherwise synthesize only uncached sentences, on ``route``."""
+    full_key = make_key(ref=cond_cache.key_for(prompt_path), model=model.key, sentences=token_ids, params=kwargs)
+    with trace.span("result_cache"):
+        if result_cache.copy_result(full_key, output_path):
+            return output_path
+    wavs = cached_sentence_wavs(model, prompt_path, token_ids, kwargs, trace, route, progress)
+    save_sentence_wavs(wavs, len(token_ids), output_path, trace, progress)
+    return result_cache.put_result(full_key, output_path)
+
+def save_sentence_wavs(wavs, count, output_path, trace, progress):
+    """Collect ``count`` sentence waveforms, reporting each one, and write them to ``output_path``."""
+    collected = []
+    for i, wav in enumerate(wavs):
+        collected.append(wav)
+        progress((i + 1) / count, desc=f"合成分句 {i + 1}/{count}")
+    with trace.span("file_write"):
+        return infer_stages.save_wav(output_path, collected)
+
+def stream_sentences(model, prompt_path, text, max_text_tokens_per_sentence, kwargs, trace):
+    """Yield each sentence's waveform as soon as it has been vocoded."""
+    with trace.span("tokenize"):
+        _, sentences = split_cache_for(model).split(text, max_text_tokens_per_sentence)
+        token_ids = infer_stages.sentence_token_ids(model.frontend, sentences)
+    trace.sentences = len(token_ids)
+    route = ("scheduler", "dynamic") if batch_scheduler is not None else ("infer", "1")
+    if result_cache is not None and is_deterministic(kwargs):
+        wavs = cached_sentence_wavs(model, prompt_path, token_ids, kwargs, trace, route)
+    else:
+        wavs = fresh_sentence_wavs(model, prompt_path, token_ids, kwargs, trace, route)
+    for wav in wavs:
+        trace.mark_first_audio()
+        trace.audio_seconds += wav.shape[-1] / infer_stages.SAMPLING_RATE
+        yield wav
+
+def synthesize_with_scheduler(model, prompt_path, token_ids, output_path, kwargs, trace, progress):
+    """Submit every sentence to the cross-request scheduler and stitch the results."""
+    futures = batch_scheduler.submit(cond_cache.key_for(prompt_path), cond_cache.get(prompt_path), token_ids, kwargs,
+                                     model=model.batch_model)
+    wavs = []
+    with trace.span("batched_synthesis"):
+        for i, future in enumerate(futures):
+            wavs.append(future.result())
+            progress((i + 1) / len(futures), desc=f"合成分句 {i + 1}/{len(futures)}")
+    with trace.span("file_write"):
+        return infer_stages.save_wav(output_path, wavs)
+
+def synthesize_long_form(model, prompt_path, text, max_text_tokens_per_sentence, kwargs, output_path, trace, progress):
+    """Synthesize chapter by chapter on the pipelined path, resuming from chapters already on disk."""
+    with trace.span("conditioning"):
+        cond_mel = cond_cache.get(prompt_path)
+    chapters = long_form.split_chapters(text, cmd_args.chapter_chars)
+    if not chapters:
+        raise ValueError("text is empty")
+    # the chapter lengths pin the split, so checkpoints of another split are never mixed in
+    job_key = make_key(ref=cond_cache.key_for(prompt_path), model=model.key, text=text,
+                       max_text_tokens=int(max_text_tokens_per_sentence), params=kwargs,
+                       chapters=[len(chapter) for chapter in chapters])
+    trace.sentences = 0
+
+    def synthesize_chapter(index, chapter, chapter_path):
+        # tokenized per chapter, so memory does not grow with the document
+        with trace.span("tokenize"):
+            _, sentences = split_cache_for(model).split(chapter, max_text_tokens_per_sentence)
+            token_ids = infer_stages.sentence_token_ids(model.frontend, sentences)
+        trace.sentences += len(token_ids)
+
+        def chapter_progress(value, desc=None):
+            progress((index + value) / len(chapters), desc=f"章节 {index + 1}/{len(chapters)} {desc or ''}")
+
+        traced_run(trace, model, long_form.synthesize_pipelined, cond_mel, token_ids, chapter_path,
+                   progress=chapter_progress, **kwargs)
+
+    with long_form.ChapterCheckpoint(long_form_root, job_key) as checkpoint:
+        return long_form.synthesize_document(checkpoint, chapters, synthesize_chapter, output_path, progress)
+
+INFER_MODES = {"普通推理": "infer", "批次推理": "infer_fast", "长文本流水线": "long_form"}
+
+def trace_labels(infer_method, sentences_bucket_max_size):
+    """(infer_mode, bucket_size) metric labels for the path a request will take."""
+    if infer_method == "long_form":
+        return "long_form", "1"
+    if batch_scheduler is not None:
+        return "scheduler", "dynamic"
+    if infer_method == "infer":
+        return "infer", "1"
+    if int(sentences_bucket_max_size) <= 0:
+        return "infer_fast", "auto"
+    return "infer_fast", str(int(sentences_bucket_max_size))
+
+def synthesize_to_file(model, prompt_path, text, infer_method, max_text_tokens_per_sentence, sentences_bucket_max_size,
+                       kwargs, output_path, trace, progress=None):
+    """Synthesize ``text`` into ``output_path`` on the path ``trace.infer_mode`` names.
+
+    Shared by the Gradio handler and the HTTP API; the caller holds a lease on
+    ``model`` and an admission slot of its pool.
+    """
+    progress = progress or (lambda value, desc=None: None)
+    if trace.infer_mode == "long_form":
+        output = synthesize_long_form(model, prompt_path, text, max_text_tokens_per_sentence, kwargs, output_path,
+                                      trace, progress)
+        trace.audio_seconds = infer_stages.wav_seconds(output)
+        return output
+    with trace.span("conditioning"):
+        cond_mel = cond_cache.get(prompt_path)
+    with trace.span("tokenize"):
+        # reuse the tokens computed by the sentence preview
+        text_tokens, sentences = split_cache_for(model).split(text, max_text_tokens_per_sentence)
+    trace.sentences = len(sentences)
+    if not sentences:
+        raise ValueError("text is empty")
+    if cmd_args.verbose:
+        print(f"条件缓存: {cond_cache.stats()}")
+    if result_cache is not None and is_deterministic(kwargs):
+        # deterministic output: reuse whole results and unchanged sentences, synthesize
+        # the rest on the path this request chose
+        token_ids = infer_stages.sentence_token_ids(model.frontend, sentences)
+        output = synthesize_cached(model, prompt_path, token_ids, output_path, kwargs, trace, progress,
+                                   (trace.infer_mode, trace.bucket_size))
+    elif trace.infer_mode == "scheduler":
+        # the scheduler buckets across requests, which subsumes both modes
+        token_ids = infer_stages.sentence_token_ids(model.frontend, sentences)
+        output = synthesize_with_scheduler(model, prompt_path, token_ids, output_path, kwargs, trace, progress)
+    elif "seed" in kwargs:
+        # tts.infer/infer_fast draw every sentence from one random stream; seeding each sentence
+        # on its own gives the same audio as the cached path, with or without the result cache
+        token_ids = infer_stages.sentence_token_ids(model.frontend, sentences)
+        wavs = fresh_sentence_wavs(model, prompt_path, token_ids, kwargs, trace,
+                                   (trace.infer_mode, trace.bucket_size), progress)
+        output = save_sentence_wavs(wavs, len(token_ids), output_path, trace, progress)
+    elif infer_method == "infer":
+        output = traced_run(trace, model, infer_stages.run_infer, "infer", prompt_path, cond_mel, text, output_path,
+                            text_tokens=text_tokens, verbose=cmd_args.verbose,
+                            max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
+                            progress=progress, **kwargs)
+    elif trace.bucket_size == "auto":
+        # 批次推理, buckets planned from sentence lengths, free memory and past runs
+        token_ids = infer_stages.sentence_token_ids(model.frontend, sentences)
+        output, observations = traced_run(trace, model, synthesize_adaptive, cond_mel, token_ids, output_path,
+                                          progress=progress, **bucket_profile.planner_params(), **kwargs)
+        bucket_profile.record(observations)
     else:
         # 批次推理
-        output = tts.infer_fast(final_prompt, text, output_path, verbose=cmd_args.verbose,
-            max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
-            sentences_bucket_max_size=(sentences_bucket_max_size),
-            **kwargs)
-    return gr.update(value=output,visible=True)
+        output = traced_run(trace, model, infer_stages.run_infer, "infer_fast", prompt_path, cond_mel, text, output_path,
+                            text_tokens=text_tokens, verbose=cmd_args.verbose,
+                            max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
+                            sentences_bucket_max_size=int(sentences_bucket_max_size),
+                            progress=progress, **kwargs)
+    trace.audio_seconds = infer_stages.wav_seconds(output)
+    return output
+
+def run_job(job, progress):
+    """Job queue runner: synthesize one persisted request into its output format."""
+    params = job["payload"]
+    mode, bucket_size = trace_labels(params["infer_method"], params["sentences_bucket_max_size"])
+    output_path = output_store.new_path()
+    # jobs queued before models had names run on the default one
+    with registry.use(params.get("model")) as model, model.pool.admission(), \
+            metrics.trace(mode, bucket_size, params["max_text_tokens_per_sentence"]) as trace:
+        output = synthesize_to_file(model, params["prompt_path"], params["text"], params["infer_method"],
+                                    params["max_text_tokens_per_sentence"], params["sentences_bucket_max_size"],
+                                    params["kwargs"], output_path, trace, progress)
+    if params["output_format"] == "wav":
+        return output, trace.audio_seconds
+    # encoded on the store's threads; the job is done once that finishes, and this runner moves on
+    return output_store.encode(output, params["output_format"]), trace.audio_seconds
+
+job_queue = JobQueue(os.path.join("outputs", "jobs.sqlite3"), run_job, retry_on=(PoolBusyError,))
+job_queue.prune(cmd_args.job_history_days * 86400)
+
+def job_payload(prompt_path, text, infer_method, max_text_tokens_per_sentence, sentences_bucket_max_size,
+                output_format, kwargs, model_name=None):
+    return {
+        "model": registry.resolve(model_name),
+        "prompt_path": prompt_path,
+        "text": text,
+        "infer_method": infer_method,
+        "max_text_tokens_per_sentence": int(max_text_tokens_per_sentence),
+        "sentences_bucket_max_size": int(sentences_bucket_max_size),
+        "output_format": output_format,
+        "kwargs": kwargs,
+    }
+
+def job_status_text(job):
+    if job["status"] == "queued":
+        return f"⏳ 排队中：前面还有 {job['position']} 个任务，预计 {job['eta_s']:.0f} 秒后开始"
+    if job["status"] == "running":
+        return f"🔊 合成中 {job['progress'] * 100:.0f}%" + (f"（{job['stage']}）" if job["stage"] else "")
+    return {"done": "✅ 合成完成", "cancelled": "🚫 已取消"}.get(job["status"], f"❌ 合成失败：{job['error']}")
+
+def gen_single(prompt, selected_reference, text, infer_mode, max_text_tokens_per_sentence=120, sentences_bucket_max_size=4,
+                output_format="wav", model_name=None, *args, progress=gr.Progress()):
+    require_ready()
+    # Determine which audio to use for generation
+    final_prompt = get_final_prompt_audio(prompt, selected_reference)
+    
+    if final_prompt is None:
+        raise gr.Error("请上传参考音频或选择已有的参考音频文件")
+    if not text or not text.strip():
+        raise gr.Error("请输入目标文本")
+    
+    kwargs = build_generation_kwargs(*args)
+    infer_method = INFER_MODES.get(infer_mode, "infer")
+    payload = job_payload(final_prompt, text, infer_method, max_text_tokens_per_sentence, sentences_bucket_max_size,
+                          output_format, kwargs, model_name)
+    job_id = job_queue.submit(payload, len(text), priority="interactive")
+    try:
+        while True:
+            job = job_queue.wait(job_id, timeout=1.0)
+            if job["status"] == "done":
+                yield gr.update(value=job["result_path"], visible=True), job_id, job_status_text(job)
+                return
+            if job["status"] == "failed":
+                raise gr.Error(job_status_text(job))
+            if job["status"] == "running":
+                progress(job["progress"], desc=job["stage"] or "合成中")
+            yield gr.update(), job_id, job_status_text(job)
+            if job["status"] == "cancelled":
+                return
+    finally:
+        # the tab was closed or the event cancelled: do not keep the job burning GPU time
+        job_queue.cancel(job_id)
+
+def cancel_job(job_id):
+    if job_id and job_queue.cancel(job_id):
+        return "🚫 正在取消，当前分句完成后停止"
+    return gr.update()
+
+def gen_single_stream(prompt, selected_reference, text, infer_mode, max_text_tokens_per_sentence=120, sentences_bucket_max_size=4,
+                      output_format="wav", model_name=None, *args):
+    """Streaming variant of gen_single: plays sentences as they finish, then
+    hands the assembled WAV to the regular output component."""
+    require_ready()
+    final_prompt = get_final_prompt_audio(prompt, selected_reference)
+    if final_prompt is None:
+        raise gr.Error("请上传参考音频或选择已有的参考音频文件")
+    if not text or not text.strip():
+        raise gr.Error("请输入目标文本")
+    output_path = output_store.new_path()
+    kwargs = build_generation_kwargs(*args)
+    wavs = []
+    try:
+        with registry.use(model_name) as model, model.pool.admission(), \
+                metrics.trace("stream", "1", int(max_text_tokens_per_sentence)) as trace:
+            for wav in stream_sentences(model, final_prompt, text, max_text_tokens_per_sentence, kwargs, trace):
+                wavs.append(wav)
+                yield (infer_stages.SAMPLING_RATE, infer_stages.to_pcm16(wav)), gr.update()
+            with trace.span("file_write"):
+                infer_stages.save_wav(output_path, wavs)
+    except PoolBusyError as e:
+        raise gr.Error(f"服务繁忙，请稍后重试（{e}）")
+    yield gr.update(), gr.update(value=output_store.finalize(output_path, output_format), visible=True)
 
 def update_prompt_audio(audio_file, custom_name):
     """Handle uploaded audio and save it to input directory, then refresh list.
@@ -202,32 +709,31 @@ def update_prompt_audio(audio_file, custom_name):
 
         saved_path = save_uploaded_audio(audio_file, custom_name)
         # refresh dropdown choices
-        files = get_reference_audio_files()
-        choices = [os.path.basename(f) for f in files] if files else []
-        value = os.path.basename(saved_path) if saved_path and os.path.exists(saved_path) else (choices[0] if choices else None)
+        choices, _, _ = reference_page()
+        value = os.path.basename(saved_path) if saved_path and library.resolve(os.path.basename(saved_path)) else (choices[0] if choices else None)
         # also update the textbox to reflect the final saved filename
         filename_value = os.path.basename(saved_path) if saved_path else custom_name
         # Important: cannot programmatically set file input value in browsers;
         # clear the upload field and guide users to the dropdown/reference.
         return None, gr.update(choices=choices, value=value), gr.update(value=filename_value), os.path.basename(saved_path)
     # no file uploaded; keep as is
-    files = get_reference_audio_files()
-    choices = [os.path.basename(f) for f in files] if files else []
+    choices, _, _ = reference_page()
     return audio_file, gr.update(choices=choices), gr.update(), ""
 
-def refresh_reference_list():
+def refresh_reference_list(query="", page=0):
     """Refresh the reference audio dropdown list"""
-    reference_files = get_reference_audio_files()
-    reference_choices = [os.path.basename(f) for f in reference_files] if reference_files else []
-    return gr.update(choices=reference_choices, value=reference_choices[0] if reference_choices else None)
+    library.refresh(force=True)
+    reference_choices, summary, _ = reference_page(query, page)
+    return gr.update(choices=reference_choices, value=reference_choices[0] if reference_choices else None, info=summary)
+
+def search_reference_list(query, page, step):
+    """Filter the dropdown by name and move `step` pages from `page`"""
+    reference_choices, summary, page = reference_page(query, max(0, int(page or 0) + step))
+    return gr.update(choices=reference_choices, value=reference_choices[0] if reference_choices else None, info=summary), page
 
 def select_reference_audio(selected_filename):
     """Load selected reference audio file"""
-    if selected_filename:
-        full_path = os.path.join(cmd_args.input_dir, selected_filename)
-        if os.path.exists(full_path):
-            return full_path
-    return None
+    return library.resolve(selected_filename)
 
 def get_final_prompt_audio(uploaded_audio, selected_reference):
     """Determine which audio to use for generation.
@@ -235,16 +741,36 @@ def get_final_prompt_audio(uploaded_audio, selected_reference):
     Prefer selected reference (from library) over transient uploaded audio, so
     users can rename and pick from the library explicitly.
     """
-    if selected_reference:
-        full_path = os.path.join(cmd_args.input_dir, selected_reference)
-        if os.path.exists(full_path):
-            return full_path
+    full_path = library.resolve(selected_reference)
+    if full_path:
+        return full_path
     if uploaded_audio is not None:
         return uploaded_audio
     return None
 
+def get_cache_stats():
+    """Hit/miss counters of the speaker-conditioning cache"""
+    stats = {"startup": readiness.status(), "conditioning": cond_cache.stats(), "output_store": output_store.stats(),
+             "adaptive_buckets": bucket_profile.stats(), "job_queue": job_queue.stats()}
+    if not readiness.ready:
+        return stats
+    with split_caches_lock:
+        stats["sentence_split"] = [cache.stats() for cache in split_caches.values()]
+    stats["models"] = registry.stats()
+    stats["prefix_cache"] = {}
+    for model in registry.loaded():
+        pool = model.pool
+        if pool is not None:
+            # worker processes keep theirs to themselves
+            stats["prefix_cache"][model.name] = [prefix_cache.stats(w.tts) for w in pool.workers
+                                                 if isinstance(w, ThreadWorker)]
+    if result_cache is not None:
+        stats["result_cache"] = result_cache.stats()
+    if batch_scheduler is not None:
+        stats["batch_scheduler"] = batch_scheduler.stats()
+    return stats
+
 with gr.Blocks(title="IndexTTS Demo") as demo:
-    mutex = threading.Lock()
     gr.HTML('''
     <h2><center>IndexTTS: An Industrial-Level Controllable and Efficient Zero-Shot Text-To-Speech System</h2>
     <h2><center>(一款工业级可控且高效的零样本文本转语音系统)</h2>
@@ -278,25 +804,48 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                     key="saved_filename",
                 )
                 
-                # Reference audio selection from input folder
-                reference_files = get_reference_audio_files()
-                reference_choices = [os.path.basename(f) for f in reference_files] if reference_files else []
+                # Reference audio selection from the indexed library (paged, searchable)
+                reference_choices, reference_summary, _ = reference_page()
+                reference_search = gr.Textbox(
+                    label="搜索参考音频",
+                    placeholder="输入文件名关键字",
+                    key="reference_search",
+                )
+                reference_page_index = gr.State(0)
                 reference_dropdown = gr.Dropdown(
                     choices=reference_choices,
                     label="或选择已有参考音频",
                     value=reference_choices[0] if reference_choices else None,
+                    info=reference_summary,
                     interactive=True,
                     key="reference_dropdown"
                 )
+                with gr.Row():
+                    prev_page_button = gr.Button("⬅️ 上一页", size="sm")
+                    next_page_button = gr.Button("下一页 ➡️", size="sm")
                 
                 refresh_button = gr.Button("🔄 刷新音频列表", size="sm")
                 
             with gr.Column(scale=2):
-                input_text_single = gr.TextArea(label="文本",key="input_text_single", placeholder="请输入目标文本", info="当前模型版本{}".format(tts.model_version or "1.0"))
-                infer_mode = gr.Radio(choices=["普通推理", "批次推理"], label="推理模式",info="批次推理：更适合长句，性能翻倍",value="普通推理")        
-                gen_button = gr.Button("生成语音", key="gen_button",interactive=True, variant="primary")
+                input_text_single = gr.TextArea(label="文本",key="input_text_single", placeholder="请输入目标文本", info="当前模型版本{}".format(model_version or "1.0"))
+                infer_mode = gr.Radio(choices=list(INFER_MODES), label="推理模式",info="批次推理：更适合长句，性能翻倍；长文本流水线：整本书/长文档，分章节断点续合成",value="普通推理")        
+                model_choice = gr.Dropdown(choices=registry.names(), value=registry.default, label="模型",
+                                           info="未加载的模型在首次使用时加载", visible=len(registry.names()) > 1,
+                                           key="model_choice")
+                with gr.Row():
+                    gen_button = gr.Button("生成语音", key="gen_button",interactive=True, variant="primary")
+                    stream_button = gr.Button("流式生成", key="stream_button", interactive=True)
+                    cancel_button = gr.Button("取消任务", key="cancel_button", interactive=True)
+                job_status = gr.Markdown("", key="job_status")
+                job_id_state = gr.State("")
+                output_format = gr.Radio(choices=output_formats, value=cmd_args.output_format, label="输出格式",
+                                         info="FLAC 无损压缩；Opus/MP3 体积最小，适合慢速网络", key="output_format")
             
+        stream_audio = gr.Audio(label="流式播放（逐句）", streaming=True, autoplay=True, key="stream_audio")
         output_audio = gr.Audio(label="生成结果", visible=True,key="output_audio")
+        with gr.Accordion("缓存统计", open=False):
+            cache_stats = gr.JSON(label="缓存、批处理与模型工作进程", key="cache_stats")
+            refresh_stats_button = gr.Button("📊 刷新统计", size="sm")
         with gr.Accordion("高级生成参数设置", open=False):
             with gr.Row():
                 with gr.Column(scale=1):
@@ -311,7 +860,8 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                     with gr.Row():
                         repetition_penalty = gr.Number(label="repetition_penalty", precision=None, value=10.0, minimum=0.1, maximum=20.0, step=0.1)
                         length_penalty = gr.Number(label="length_penalty", precision=None, value=0.0, minimum=-2.0, maximum=2.0, step=0.1)
-                    max_mel_tokens = gr.Slider(label="max_mel_tokens", value=600, minimum=50, maximum=tts.cfg.gpt.max_mel_tokens, step=10, info="生成Token最大数量，过小导致音频被截断", key="max_mel_tokens")
+                    max_mel_tokens = gr.Slider(label="max_mel_tokens", value=600, minimum=50, maximum=model_cfg.gpt.max_mel_tokens, step=10, info="生成Token最大数量，过小导致音频被截断", key="max_mel_tokens")
+                    seed = gr.Number(label="seed", value=-1, precision=0, info="≥0 时固定随机种子，结果可复现并会被缓存；关闭 do_sample 时同样会被缓存")
                     # with gr.Row():
                     #     typical_sampling = gr.Checkbox(label="typical_sampling", value=False, info="不建议使用")
                     #     typical_mass = gr.Slider(label="typical_mass", value=0.9, minimum=0.0, maximum=1.0, step=0.1)
@@ -319,12 +869,12 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                     gr.Markdown("**分句设置** _参数会影响音频质量和生成速度_")
                     with gr.Row():
                         max_text_tokens_per_sentence = gr.Slider(
-                            label="分句最大Token数", value=120, minimum=20, maximum=tts.cfg.gpt.max_text_tokens, step=2, key="max_text_tokens_per_sentence",
+                            label="分句最大Token数", value=120, minimum=20, maximum=model_cfg.gpt.max_text_tokens, step=2, key="max_text_tokens_per_sentence",
                             info="建议80~200之间，值越大，分句越长；值越小，分句越碎；过小过大都可能导致音频质量不高",
                         )
                         sentences_bucket_max_size = gr.Slider(
-                            label="分句分桶的最大容量（批次推理生效）", value=4, minimum=1, maximum=16, step=1, key="sentences_bucket_max_size",
-                            info="建议2-8之间，值越大，一批次推理包含的分句数越多，过大可能导致内存溢出",
+                            label="分句分桶的最大容量（批次推理生效）", value=4, minimum=0, maximum=16, step=1, key="sentences_bucket_max_size",
+                            info="建议2-8之间，值越大，一批次推理包含的分句数越多，过大可能导致内存溢出；设为 0 时按分句长度与可用显存自动分桶",
                         )
                     with gr.Accordion("预览分句结果", open=True) as sentences_settings:
                         sentences_preview = gr.Dataframe(
@@ -334,7 +884,7 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                         )
             advanced_params = [
                 do_sample, top_p, top_k, temperature,
-                length_penalty, num_beams, repetition_penalty, max_mel_tokens,
+                length_penalty, num_beams, repetition_penalty, max_mel_tokens, seed,
                 # typical_sampling, typical_mass,
             ]
         
@@ -357,11 +907,9 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                     inputs=[prompt_audio, input_text_single, infer_mode],
                 )
 
-    def on_input_text_change(text, max_tokens_per_sentence):
-        if text and len(text) > 0:
-            text_tokens_list = tts.tokenizer.tokenize(text)
-
-            sentences = tts.tokenizer.split_sentences(text_tokens_list, max_tokens_per_sentence=int(max_tokens_per_sentence))
+    def on_input_text_change(text, max_tokens_per_sentence, model_name=None):
+        if text and len(text) > 0 and readiness.ready:
+            _, sentences = split_cache_for(registry.get(model_name)).split(text, max_tokens_per_sentence)
             data = []
             for i, s in enumerate(sentences):
                 sentence_str = ''.join(s)
@@ -372,21 +920,37 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                 sentences_preview: gr.update(value=data, visible=True, type="array"),
             }
         else:
-            import pandas as pd
             df = pd.DataFrame([], columns=["序号", "分句内容", "Token数"])
             return {
                 sentences_preview: gr.update(value=df)
             }
 
+    # The preview is cheap once cached: run it outside the inference queue and
+    # only for the latest keystroke/slider value while one is in progress.
     input_text_single.change(
         on_input_text_change,
-        inputs=[input_text_single, max_text_tokens_per_sentence],
-        outputs=[sentences_preview]
+        inputs=[input_text_single, max_text_tokens_per_sentence, model_choice],
+        outputs=[sentences_preview],
+        queue=False,
+        trigger_mode="always_last",
+        show_progress="hidden",
     )
     max_text_tokens_per_sentence.change(
         on_input_text_change,
-        inputs=[input_text_single, max_text_tokens_per_sentence],
-        outputs=[sentences_preview]
+        inputs=[input_text_single, max_text_tokens_per_sentence, model_choice],
+        outputs=[sentences_preview],
+        queue=False,
+        trigger_mode="always_last",
+        show_progress="hidden",
+    )
+    # models may tokenize differently
+    model_choice.change(
+        on_input_text_change,
+        inputs=[input_text_single, max_text_tokens_per_sentence, model_choice],
+        outputs=[sentences_preview],
+        queue=False,
+        trigger_mode="always_last",
+        show_progress="hidden",
     )
     
     # Handle explicit save-to-library action (decoupled from file selection)
@@ -396,11 +960,14 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
         if not custom_name or not str(custom_name).strip():
             raise gr.Error("请填写自定义文件名")
         saved_path = save_uploaded_audio(audio_file, custom_name)
-        files = get_reference_audio_files()
-        choices = [os.path.basename(f) for f in files] if files else []
-        value = os.path.basename(saved_path) if saved_path and os.path.exists(saved_path) else (choices[0] if choices else None)
+        choices, summary, _ = reference_page()
+        saved_name = os.path.basename(saved_path) if saved_path else None
+        value = saved_name if library.resolve(saved_name) else (choices[0] if choices else None)
+        if value and value not in choices:
+            # the new clip may sort onto a later page; keep it selectable
+            choices = [value] + choices
         # Clear uploader value (cannot set new filename visually due to browser limits)
-        return gr.update(value=None), gr.update(choices=choices, value=value), os.path.basename(saved_path)
+        return gr.update(value=None), gr.update(choices=choices, value=value, info=summary), os.path.basename(saved_path)
 
     save_to_lib_btn.click(
         on_save_to_library,
@@ -411,10 +978,31 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
     # Handle refresh button for reference audio list
     refresh_button.click(
         refresh_reference_list,
-        inputs=[],
+        inputs=[reference_search, reference_page_index],
         outputs=[reference_dropdown]
     )
+    reference_search.submit(
+        lambda query: search_reference_list(query, 0, 0),
+        inputs=[reference_search],
+        outputs=[reference_dropdown, reference_page_index]
+    )
+    prev_page_button.click(
+        lambda query, page: search_reference_list(query, page, -1),
+        inputs=[reference_search, reference_page_index],
+        outputs=[reference_dropdown, reference_page_index]
+    )
+    next_page_button.click(
+        lambda query, page: search_reference_list(query, page, 1),
+        inputs=[reference_search, reference_page_index],
+        outputs=[reference_dropdown, reference_page_index]
+    )
     
+    refresh_stats_button.click(
+        get_cache_stats,
+        inputs=[],
+        outputs=[cache_stats]
+    )
+
     # Handle reference audio selection
     reference_dropdown.change(
         select_reference_audio,
@@ -424,12 +1012,345 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
 
     gen_button.click(gen_single,
                      inputs=[prompt_audio, reference_dropdown, input_text_single, infer_mode,
-                             max_text_tokens_per_sentence, sentences_bucket_max_size,
+                             max_text_tokens_per_sentence, sentences_bucket_max_size, output_format, model_choice,
                              *advanced_params,
                      ],
-                     outputs=[output_audio])
+                     outputs=[output_audio, job_id_state, job_status],
+                     # jobs wait in the persistent job queue, not in Gradio's
+                     concurrency_limit=None)
+    cancel_button.click(cancel_job, inputs=[job_id_state], outputs=[job_status])
+    stream_button.click(gen_single_stream,
+                        inputs=[prompt_audio, reference_dropdown, input_text_single, infer_mode,
+                                max_text_tokens_per_sentence, sentences_bucket_max_size, output_format, model_choice,
+                                *advanced_params,
+                        ],
+                        outputs=[stream_audio, output_audio],
+                        concurrency_limit=None)
+
+
+class StreamRequest(BaseModel):
+    reference: str
+    text: str
+    model: str = ""
+    max_text_tokens_per_sentence: int = 120
+    do_sample: bool = infer_stages.GENERATION_DEFAULTS["do_sample"]
+    top_p: float = infer_stages.GENERATION_DEFAULTS["top_p"]
+    top_k: int = infer_stages.GENERATION_DEFAULTS["top_k"]
+    temperature: float = infer_stages.GENERATION_DEFAULTS["temperature"]
+    length_penalty: float = infer_stages.GENERATION_DEFAULTS["length_penalty"]
+    num_beams: int = infer_stages.GENERATION_DEFAULTS["num_beams"]
+    repetition_penalty: float = infer_stages.GENERATION_DEFAULTS["repetition_penalty"]
+    max_mel_tokens: int = infer_stages.GENERATION_DEFAULTS["max_mel_tokens"]
+    seed: int = -1
+
+
+api = FastAPI(title="IndexTTS API")
+
+
+@api.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+
+@api.get("/metrics")
+def prometheus_metrics():
+    """Prometheus exposition of request, stage, RTF and GPT throughput histograms."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@api.get("/readyz")
+def readyz():
+    """Readiness: models are loaded and warmed up; 503 until then."""
+    status = readiness.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+def resolve_model_name(name):
+    """Registered model a request names; OpenAI model names (tts-1, ...) and "indextts" mean the default."""
+    if not name or name in registry.models:
+        return registry.resolve(name)
+    if name == "indextts" or name.startswith(("tts-", "gpt-")):
+        return registry.default
+    raise HTTPException(status_code=404, detail=f"model not found: {name}")
+
+
+def lease_model(name):
+    """Lease a model (loading it if needed) and take an admission slot of its pool; 503 when busy."""
+    try:
+        model = registry.acquire(name)
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=f"busy: {e}")
+    try:
+        model.pool.admit()
+    except PoolBusyError as e:
+        registry.release(model)
+        raise HTTPException(status_code=503, detail=f"busy: {e}")
+    return model
+
+
+def return_model(model):
+    model.pool.leave()
+    registry.release(model)
+
+
+@api.get("/v1/models")
+def list_models():
+    """Registered models (OpenAI list shape); pass an ``id`` as ``model`` to pick one."""
+    loaded = {model.name for model in registry.loaded()}
+    return {"object": "list", "data": [
+        {"id": name, "object": "model", "owned_by": "indextts", "version": registry.models[name].version,
+         "loaded": name in loaded, "default": name == registry.default}
+        for name in registry.names()]}
+
+
+@api.post("/api/tts/stream")
+async def tts_stream(req: StreamRequest):
+    """Chunked WAV stream: header first, then PCM as each sentence is vocoded.
+
+    The assembled file is written to outputs/ once the stream completes; its
+    download URL is announced up front in the X-Output-URL header.
+    """
+    try:
+        readiness.check()
+    except NotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    prompt_path = select_reference_audio(req.reference)
+    if prompt_path is None:
+        raise HTTPException(status_code=404, detail=f"reference audio not found: {req.reference}")
+    if not req.text.strip():
+        raise HTTPException(status_code=400, detail="text is empty")
+    kwargs = build_generation_kwargs(req.do_sample, req.top_p, req.top_k, req.temperature,
+                                     req.length_penalty, req.num_beams, req.repetition_penalty, req.max_mel_tokens, req.seed)
+    output_path = output_store.new_path()
+    model = await asyncio.to_thread(lease_model, resolve_model_name(req.model))
+    return sentence_stream_response(model, prompt_path, req.text, req.max_text_tokens_per_sentence, kwargs,
+                                    output_path, "audio/wav", infer_stages.wav_stream_header())
+
+
+class SpeechRequest(BaseModel):
+    """Body of ``POST /v1/audio/speech`` (OpenAI audio.speech shape plus IndexTTS parameters)."""
+    model: str = "indextts"
+    input: str
+    voice: str
+    response_format: str = "wav"
+    stream: bool = False
+    infer_mode: str = "infer"
+    max_text_tokens_per_sentence: int = 120
+    sentences_bucket_max_size: int = 4
+    do_sample: bool = infer_stages.GENERATION_DEFAULTS["do_sample"]
+    top_p: float = infer_stages.GENERATION_DEFAULTS["top_p"]
+    top_k: int = infer_stages.GENERATION_DEFAULTS["top_k"]
+    temperature: float = infer_stages.GENERATION_DEFAULTS["temperature"]
+    length_penalty: float = infer_stages.GENERATION_DEFAULTS["length_penalty"]
+    num_beams: int = infer_stages.GENERATION_DEFAULTS["num_beams"]
+    repetition_penalty: float = infer_stages.GENERATION_DEFAULTS["repetition_penalty"]
+    max_mel_tokens: int = infer_stages.GENERATION_DEFAULTS["max_mel_tokens"]
+    seed: int = -1
+
+
+SPEECH_MEDIA_TYPES = {"wav": "audio/wav", "pcm": "audio/L16; rate=24000; channels=1",
+                      "flac": "audio/flac", "opus": "audio/ogg", "mp3": "audio/mpeg"}
+# blocking synthesis of API requests runs here, never on the event loop; the
+# admission limit bounds how many are in flight
+api_executor = ThreadPoolExecutor(max_workers=cmd_args.max_pending, thread_name_prefix="api-synth")
+
+
+def output_headers(output_path):
+    """Where the saved copy of a response can be fetched again, without exposing server paths."""
+    uid = output_id(output_path)
+    return {"X-Output-Id": uid, "X-Output-URL": f"/api/outputs/{uid}"}
+
+
+def sentence_stream_response(model, prompt_path, text, max_text_tokens_per_sentence, kwargs, output_path, media_type,
+                             header=b""):
+    """Stream ``header``, then PCM sentence by sentence; the assembled WAV is saved once the stream completes.
+
+    Takes over the caller's lease on ``model``: it is returned when the response
+    and its synthesis thread are both done, including when the client goes away
+    before the first chunk or the body is never iterated.
+    """
+    lease = Lease(functools.partial(return_model, model))
+    cancel = threading.Event()
+
+    async def body():
+        trace = metrics.trace("stream", "1", max_text_tokens_per_sentence)
+        wavs = []
+        try:
+            with trace:
+                if header:
+                    yield header
+                sentences = iterate_in_thread(
+                    lambda: stream_sentences(model, prompt_path, text, max_text_tokens_per_sentence, kwargs, trace),
+                    cancel, api_executor, lease)
+                async for wav in sentences:
+                    wavs.append(wav)
+                    yield infer_stages.to_pcm16(wav).tobytes()
+                with trace.span("file_write"):
+                    await asyncio.to_thread(infer_stages.save_wav, output_path, wavs)
+        finally:
+            cancel.set()
+
+    return LeasedStreamingResponse(body(), lease, media_type=media_type, headers=output_headers(output_path))
+
+
+@api.post("/v1/audio/speech")
+async def audio_speech(req: SpeechRequest, request: Request):
+    """OpenAI-style speech synthesis sharing the UI's model pool and caches.
+
+    ``voice`` is a library file name or content hash. With ``stream`` the audio
+    (``wav`` or ``pcm``) is sent sentence by sentence; otherwise the full body is
+    returned in ``response_format``. A client disconnect cancels the request
+    between sentences.
+    """
+    try:
+        readiness.check()
+    except NotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    prompt_path = library.resolve_voice(req.voice)
+    if prompt_path is None:
+        raise HTTPException(status_code=404, detail=f"voice not found: {req.voice}")
+    if not req.input.strip():
+        raise HTTPException(status_code=400, detail="input is empty")
+    if req.response_format not in SPEECH_MEDIA_TYPES or (
+            req.response_format not in ("wav", "pcm") and req.response_format not in output_formats):
+        raise HTTPException(status_code=400, detail=f"unsupported response_format: {req.response_format}")
+    if req.stream and req.response_format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail="streaming supports response_format wav or pcm")
+    if req.infer_mode not in INFER_MODES.values():
+        raise HTTPException(status_code=400, detail="infer_mode must be infer, infer_fast or long_form")
+    kwargs = build_generation_kwargs(req.do_sample, req.top_p, req.top_k, req.temperature,
+                                     req.length_penalty, req.num_beams, req.repetition_penalty, req.max_mel_tokens, req.seed)
+    output_path = output_store.new_path()
+    media_type = SPEECH_MEDIA_TYPES[req.response_format]
+    # the first request for a model waits for it to load, off the event loop
+    model = await asyncio.to_thread(lease_model, resolve_model_name(req.model))
+
+    if req.stream:
+        header = infer_stages.wav_stream_header() if req.response_format == "wav" else b""
+        return sentence_stream_response(model, prompt_path, req.input, req.max_text_tokens_per_sentence, kwargs,
+                                        output_path, media_type, header)
+
+    lease = Lease(functools.partial(return_model, model))
+    cancel = threading.Event()
+    watcher = asyncio.create_task(cancel_on_disconnect(request, cancel))
+    try:
+        mode, bucket_size = trace_labels(req.infer_mode, req.sentences_bucket_max_size)
+        with metrics.trace(mode, bucket_size, req.max_text_tokens_per_sentence) as trace:
+            try:
+                if mode == "infer":
+                    # per sentence, so a disconnect stops synthesis at the next sentence boundary
+                    wavs = [wav async for wav in iterate_in_thread(
+                        lambda: stream_sentences(model, prompt_path, req.input, req.max_text_tokens_per_sentence, kwargs, trace),
+                        cancel, api_executor, lease)]
+                    if cancel.is_set():
+                        raise RequestCancelled("client disconnected")
+                    with trace.span("file_write"):
+                        await asyncio.to_thread(infer_stages.save_wav, output_path, wavs)
+                else:
+                    # the other paths report progress per sentence (chapter for long form); a
+                    # report after a disconnect aborts them there
+                    await asyncio.get_running_loop().run_in_executor(
+                        api_executor, synthesize_to_file, model, prompt_path, req.input, req.infer_mode,
+                        req.max_text_tokens_per_sentence, req.sentences_bucket_max_size, kwargs, output_path, trace,
+                        cancel_progress(cancel))
+            except RequestCancelled:
+                # the client went away; nothing left to deliver
+                trace.status = "cancelled"
+                return Response(status_code=499)
+    finally:
+        cancel.set()
+        watcher.cancel()
+        lease.release()
+    if req.response_format == "pcm":
+        return Response(await asyncio.to_thread(infer_stages.read_pcm16, output_path), media_type=media_type,
+                        headers=output_headers(output_path))
+    if req.response_format != "wav":
+        output_path = await asyncio.wrap_future(output_store.encode(output_path, req.response_format))
+    return FileResponse(output_path, media_type=media_type, headers=output_headers(output_path))
+
+
+@api.get("/api/outputs/{output_id}")
+def get_output(output_id: str):
+    """Download a saved output by the id announced in ``X-Output-Id``."""
+    found = output_store.resolve(output_id)
+    if found is None:
+        # not written yet (a stream still running) or removed by the retention sweep
+        raise HTTPException(status_code=404, detail="output not found")
+    path, fmt = found
+    return FileResponse(path, media_type=SPEECH_MEDIA_TYPES[fmt])
+
+
+class JobRequest(SpeechRequest):
+    priority: str = "bulk"
+
+
+JOB_FIELDS = ("id", "status", "priority", "position", "eta_s", "progress", "stage", "error",
+              "created_at", "started_at", "finished_at", "audio_seconds")
+
+
+def public_job(job):
+    return {name: job[name] for name in JOB_FIELDS if name in job}
+
+
+@api.post("/api/jobs", status_code=202)
+def submit_job(req: JobRequest):
+    """Queue a synthesis job; poll ``/api/jobs/{id}`` and fetch ``/api/jobs/{id}/result`` when done.
+
+    Jobs are accepted while models are still loading and survive restarts.
+    """
+    prompt_path = library.resolve_voice(req.voice)
+    if prompt_path is None:
+        raise HTTPException(status_code=404, detail=f"voice not found: {req.voice}")
+    if not req.input.strip():
+        raise HTTPException(status_code=400, detail="input is empty")
+    if req.response_format not in output_formats:
+        raise HTTPException(status_code=400, detail=f"unsupported response_format: {req.response_format}")
+    if req.infer_mode not in INFER_MODES.values():
+        raise HTTPException(status_code=400, detail="infer_mode must be infer, infer_fast or long_form")
+    if req.priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    kwargs = build_generation_kwargs(req.do_sample, req.top_p, req.top_k, req.temperature,
+                                     req.length_penalty, req.num_beams, req.repetition_penalty, req.max_mel_tokens, req.seed)
+    payload = job_payload(prompt_path, req.input, req.infer_mode, req.max_text_tokens_per_sentence,
+                          req.sentences_bucket_max_size, req.response_format, kwargs, resolve_model_name(req.model))
+    return public_job(job_queue.get(job_queue.submit(payload, len(req.input), priority=req.priority)))
+
+
+@api.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return public_job(job)
+
+
+@api.get("/api/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"job is {job['status']}")
+    if not os.path.exists(job["result_path"]):
+        # removed by the output store's retention sweep
+        raise HTTPException(status_code=410, detail="result expired")
+    return FileResponse(job["result_path"], media_type=SPEECH_MEDIA_TYPES[job["payload"]["output_format"]])
+
+
+@api.delete("/api/jobs/{job_id}")
+def cancel_job_endpoint(job_id: str):
+    """Cancel a queued job, or stop a running one after its current sentence."""
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return {"cancelled": job_queue.cancel(job_id)}
 
 
 if __name__ == "__main__":
+    if cmd_args.lazy_load:
+        readiness.start(load_models)
+    else:
+        readiness.run(load_models)
     demo.queue(20)
-    demo.launch(server_name=cmd_args.host, server_port=cmd_args.port)
+    app = gr.mount_gradio_app(api, demo, path="/")
+    uvicorn.run(app, host=cmd_args.host, port=cmd_args.port)